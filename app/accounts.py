@@ -0,0 +1,133 @@
+import os
+import json
+import threading
+
+# The mail accounts to sync and, per account, the folders to sync.
+#
+# ACCOUNTS_FILE points at a JSON list such as
+#
+#   [
+#     {"id": "work", "host": "imap.gmail.com", "user": "me@work.com", "password_env": "WORK_PASS",
+#      "folders": ["inbox", "[Gmail]/Sent Mail"], "pool_size": 4, "rate_limit": 10},
+#     {"id": "home", "host": "imap.fastmail.com", "user": "me@home.org", "password_env": "HOME_PASS"}
+#   ]
+#
+# "port", "ssl" (default true), "password" (instead of password_env),
+# "pool_size" (IMAP_POOL_SIZE) and "rate_limit" (IMAP commands per second,
+# IMAP_RATE_LIMIT; 0 for none) are optional. Without ACCOUNTS_FILE there is
+# one account, "default", built from IMAP_HOST / EMAIL_USER / EMAIL_PASS /
+# IMAP_FOLDER as before. The first account's first folder is where emails
+# stored before accounts existed belong.
+
+ACCOUNT_ID_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.")
+
+
+def _flag(value, default=True) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("true", "1", "yes")
+
+
+class Account:
+    def __init__(self, id, host, user, password, folders=("inbox",), port=None, use_ssl=True,
+                 pool_size=4, rate_limit=0.0):
+        if not id or set(id) - ACCOUNT_ID_CHARS:
+            raise ValueError(f"Invalid account id '{id}'; use letters, digits, '-', '_' and '.'")
+        if not folders:
+            raise ValueError(f"Account '{id}' has no folders to sync")
+        self.id = id
+        self.host = host
+        self.user = user
+        self.password = password
+        self.folders = tuple(folders)
+        self.port = port
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size
+        self.rate_limit = rate_limit
+
+    def public(self) -> dict:
+        """The account as endpoints and tools show it (no password)."""
+        return {"id": self.id, "user": self.user, "host": self.host, "folders": list(self.folders)}
+
+
+def _from_config(entry) -> Account:
+    password = entry.get("password")
+    if password is None and entry.get("password_env"):
+        password = os.environ[entry["password_env"]]
+    return Account(
+        id=entry["id"],
+        host=entry.get("host", "imap.gmail.com"),
+        user=entry["user"],
+        password=password,
+        folders=entry.get("folders") or ["inbox"],
+        port=int(entry["port"]) if entry.get("port") else None,
+        use_ssl=_flag(entry.get("ssl")),
+        pool_size=int(entry.get("pool_size") or os.getenv("IMAP_POOL_SIZE", "4")),
+        rate_limit=float(entry.get("rate_limit") or os.getenv("IMAP_RATE_LIMIT", "0")),
+    )
+
+
+def _from_env() -> Account:
+    port = os.getenv("IMAP_PORT")
+    return Account(
+        id="default",
+        host=os.getenv("IMAP_HOST", "imap.gmail.com"),
+        user=os.environ["EMAIL_USER"],
+        password=os.environ["EMAIL_PASS"],
+        folders=[f.strip() for f in os.getenv("IMAP_FOLDER", "inbox").split(",") if f.strip()],
+        port=int(port) if port else None,
+        use_ssl=_flag(os.getenv("IMAP_SSL")),
+        pool_size=int(os.getenv("IMAP_POOL_SIZE", "4")),
+        rate_limit=float(os.getenv("IMAP_RATE_LIMIT", "0")),
+    )
+
+
+def load_accounts() -> dict:
+    """Read the accounts from ACCOUNTS_FILE, or the environment; {} when neither names one."""
+    path = os.getenv("ACCOUNTS_FILE")
+    if path:
+        with open(path, "r") as f:
+            accounts = [_from_config(entry) for entry in json.load(f)]
+    elif os.getenv("EMAIL_USER"):
+        accounts = [_from_env()]
+    else:
+        accounts = []
+    by_id = {}
+    for account in accounts:
+        if account.id in by_id:
+            raise ValueError(f"Account id '{account.id}' is used twice")
+        by_id[account.id] = account
+    return by_id
+
+
+_accounts = None
+_accounts_lock = threading.Lock()
+
+
+def get_accounts() -> dict:
+    """id -> Account for every configured account, in configuration order, read on first use."""
+    global _accounts
+    with _accounts_lock:
+        if _accounts is None:
+            _accounts = load_accounts()
+        return _accounts
+
+
+def get_account(account_id=None) -> Account:
+    """The account with account_id, or the first one when it is None. Raises ValueError."""
+    accounts = get_accounts()
+    if not accounts:
+        raise ValueError("No mail account is configured; set EMAIL_USER or ACCOUNTS_FILE")
+    if account_id is None:
+        return next(iter(accounts.values()))
+    if account_id not in accounts:
+        raise ValueError(f"Unknown account '{account_id}'. Use one of: {', '.join(accounts)}.")
+    return accounts[account_id]
+
+
+def check_account(account_id):
+    """Raise ValueError unless account_id is None or a configured account."""
+    if account_id is not None:
+        get_account(account_id)
@@ -8,6 +8,9 @@ from app.tools import toolList
 import os
 from langgraph.graph import StateGraph, END, START
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
+from app.metrics import LLM_REQUEST_SECONDS, LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS
+import time
 
 load_dotenv()
 langgraph_agent_executor = None
@@ -28,8 +31,13 @@ prompt = ChatPromptTemplate.from_messages(
             - “You may think step-by-step before each tool call, then execute.”
 
             Email Logic:
+            - **Bulk requests, one call:**  
+            When a request covers several emails (“summarize all my unread emails”, “mark everything from LinkedIn as read”, “classify my work emails”), call `process_matching_emails` once with the filters and the action. It finds the emails and does the work on the server. Never loop over emails one tool call at a time.
+            If you already have the UIDs, pass them all at once to `summarize_emails`, `classify_emails`, `enrich_emails`, `mark_emails_as_read` or `unmark_emails_as_read`.
+            - **Several accounts:**  
+            Emails may come from more than one mail account. When the user names one (“my work inbox”), call `list_accounts` to find its id and pass it as `account` to `process_matching_emails`, `search_emails`, `get_emails_by_data` or `enrich_emails`.
             - **Bulk “mark all as read”:**  
-            When the user says “mark all as read,” first retrieve only unread messages, then call the mark-as-read tool on each one.
+            `process_matching_emails` with action "mark_read" and is_read false. Use action "mark_unread" the same way.
             - **Idempotency:**  
             Even if you think an email is already read, follow the above steps to catch any new arrivals.
             - **Natural Output:**  
@@ -57,4 +65,36 @@ def build_agent():
     langgraph_agent_executor = create_react_agent(os.environ["OPENAI_MODEL"], toolList, prompt=prompt)
 
     print("Built agent.")
-    return langgraph_agent_executor
\ No newline at end of file
+    return langgraph_agent_executor
+
+
+class AgentMetrics(BaseCallbackHandler):
+    """Per-request callback: times each model call of one agent run and counts
+    them (steps). Pass it in the run's config callbacks; tools time themselves
+    (app.tools.ToolMetrics)."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.steps = 0
+        self._started = {}  # run_id -> start time of a model call
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.steps += 1
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._model_done(run_id, "ok")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                LLM_PROMPT_TOKENS.inc(usage.get("input_tokens", 0), task="agent")
+                LLM_COMPLETION_TOKENS.inc(usage.get("output_tokens", 0), task="agent")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._model_done(run_id, "error")
+
+    def _model_done(self, run_id, outcome):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, task="agent", outcome=outcome)
@@ -0,0 +1,115 @@
+import random
+from app.fakeimap import make_message
+
+# Synthetic mailbox data for the benchmarks in app/bench. Everything is
+# generated from a seed so runs are comparable across commits.
+
+WORDS = (
+    "meeting invoice project update schedule flight hotel order shipped delivery payment "
+    "account security alert newsletter weekly digest team review deadline budget report "
+    "quarterly results offer discount sale coupon subscription renewal password reset login "
+    "verify confirm receipt statement transfer deposit balance portfolio market stock crypto "
+    "garden recipe hiking camera guitar concert ticket friend family birthday dinner weekend "
+    "vacation beach mountain train booking reservation reminder appointment doctor dentist"
+).split()
+SENDERS = [
+    "alice@example.com", "bob@work.example", "Robinhood <noreply@robinhood.com>",
+    "Amazon <shipment-tracking@amazon.com>", "newsletter@substack.com", "Bank <alerts@bank.example>",
+    "GitHub <noreply@github.com>", "carol@hobby.example", "deals@shop.example", "dave@family.example",
+]
+CATEGORIES = ["work", "hobby", "shopping", "finance", "spam"]
+SYLLABLES = "ka lo mi ne ru sa to vi ze bra cho dri fle gro klu pra stu tre wen xor".split()
+
+
+def _vocabulary(size=20000, seed=0):
+    """Common words first, then pseudo-words, drawn with Zipf-like weights
+    so the index sees a realistic long tail of rare terms."""
+    rng = random.Random(seed)
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    cum_weights, total = [], 0.0
+    for rank in range(len(words)):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    return words, cum_weights
+
+
+VOCABULARY, CUM_WEIGHTS = _vocabulary()
+
+
+def _sentence(rng, length):
+    return " ".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=length)).capitalize() + "."
+
+
+# the table-and-inline-style markup most HTML mail is built from
+HTML_TEMPLATE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><style>body{{margin:0;padding:0}}'
+    "td{{font-family:Arial,Helvetica,sans-serif}}</style></head><body>"
+    '<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" style="background-color:#f4f4f4">'
+    '<tr><td align="center"><table role="presentation" width="600" cellpadding="0" cellspacing="0" border="0" '
+    'style="background-color:#ffffff;border-collapse:collapse">{rows}</table></td></tr></table></body></html>'
+)
+HTML_ROW = (
+    '<tr><td style="font-family:Arial,Helvetica,sans-serif;font-size:14px;line-height:20px;'
+    'color:#333333;padding:4px 24px 4px 24px">{}</td></tr>'
+)
+
+
+def synthetic_email(uid, rng, body_sentences=30) -> dict:
+    sentences = [_sentence(rng, rng.randint(6, 16)) for _ in range(body_sentences)]
+    body = " ".join(sentences)
+    return {
+        "uid": uid,
+        "subject": _sentence(rng, rng.randint(3, 8)),
+        "body": body,
+        "raw_body": HTML_TEMPLATE.format(rows="".join(HTML_ROW.format(sentence) for sentence in sentences)),
+        "sender": rng.choice(SENDERS),
+        "summary": _sentence(rng, 20) if rng.random() < 0.5 else None,
+        "classification": {
+            "priority": rng.choice(["important", "not important"]),
+            "category": rng.choice(CATEGORIES),
+        },
+        "isRead": rng.random() < 0.5,
+        "dateTime": f"Mon, {rng.randint(1, 28):02d} Jan 2024 {rng.randint(0, 23):02d}:00:00 +0000",
+    }
+
+
+def synthetic_emails(count, seed=42, body_sentences=30):
+    rng = random.Random(seed)
+    for uid in range(1, count + 1):
+        yield synthetic_email(uid, rng, body_sentences)
+
+
+MESSAGE_KINDS = ("plain", "html", "attachment", "multipart")
+
+
+def synthetic_message(uid, rng, kind) -> bytes:
+    """One raw RFC 822 message for the fake IMAP server:
+    plain text, HTML-heavy, a large attachment, or many small parts."""
+    email_data = synthetic_email(uid, rng, body_sentences=rng.randint(5, 40))
+    subject, sender, body = email_data["subject"], email_data["sender"], email_data["body"]
+    if kind == "plain":
+        return make_message(subject, sender, body)
+    if kind == "html":
+        return make_message(subject, sender, body, html=email_data["raw_body"])
+    if kind == "attachment":
+        data = rng.randbytes(rng.randint(2, 6) * 1024 * 1024)
+        return make_message(subject, sender, body, attachments=[("report.pdf", data, "application/pdf")])
+    attachments = [
+        (f"photo{i}.jpg", rng.randbytes(rng.randint(5, 50) * 1024), "image/jpeg")
+        for i in range(rng.randint(5, 15))
+    ]
+    return make_message(subject, sender, body, html=email_data["raw_body"], attachments=attachments)
+
+
+def synthetic_mailbox(count, seed=42, mix=(("plain", 4), ("html", 4), ("attachment", 1), ("multipart", 1))):
+    """count raw messages, kinds drawn with the weights in mix."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix)
+    for uid in range(1, count + 1):
+        yield synthetic_message(uid, rng, rng.choices(kinds, weights=weights)[0])
@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import json
+import time
+from bs4 import BeautifulSoup, Comment
+from app.htmltext import clean_email_body_from_html, extract_text_from_html, html_fallback_text
+
+# Checks app/htmltext.py against the golden outputs in html_corpus/ and
+# compares its throughput with the BeautifulSoup implementation it replaced.
+#
+# run with python -m app.bench.html [rounds]
+# python -m app.bench.html --update-golden rewrites golden.json from the
+# BeautifulSoup reference below.
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "html_corpus")
+GOLDEN_PATH = os.path.join(CORPUS_DIR, "golden.json")
+
+
+# --- the BeautifulSoup implementation, kept as the reference ---------------------
+
+def soup_clean_email_body_from_html(html: str) -> str:
+    if not html:
+        return "ERROR: HTML Body not received."
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "head", "meta", "link"]):
+        tag.decompose()
+    for img in soup.find_all("img"):
+        img.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for block in soup.find_all(["br", "p", "div", "li"]):
+        block.insert_before("\n")
+    text = soup.get_text()
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def soup_extract_text_from_html(html: str) -> str:
+    if not html:
+        return ""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "head", "meta", "link", "img"]):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    text = soup.get_text(separator=" ")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def soup_html_fallback_text(html: str) -> str:
+    return BeautifulSoup(html, "html.parser").get_text(separator="\n").strip()
+
+
+FUNCTIONS = {
+    "clean_email_body_from_html": (soup_clean_email_body_from_html, clean_email_body_from_html),
+    "extract_text_from_html": (soup_extract_text_from_html, extract_text_from_html),
+    "html_fallback_text": (soup_html_fallback_text, html_fallback_text),
+}
+
+
+def load_corpus() -> dict:
+    corpus = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                corpus[name] = f.read()
+    return corpus
+
+
+def update_golden(corpus):
+    golden = {
+        name: {fn: reference(html) for fn, (reference, _) in FUNCTIONS.items()}
+        for name, html in corpus.items()
+    }
+    with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {GOLDEN_PATH} ({len(golden)} documents)")
+
+
+def check_golden(corpus) -> int:
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)
+    failures = 0
+    for name, html in corpus.items():
+        for fn, (_, fast) in FUNCTIONS.items():
+            expected = golden[name][fn]
+            actual = fast(html)
+            if actual != expected:
+                failures += 1
+                print(f"MISMATCH {name} {fn}:\n  expected {expected!r}\n  actual   {actual!r}")
+    print(f"Golden corpus: {len(corpus) * len(FUNCTIONS) - failures}/{len(corpus) * len(FUNCTIONS)} outputs match")
+    return failures
+
+
+def throughput(fn, documents, rounds) -> float:
+    """MB/s of HTML processed by fn over rounds passes through documents."""
+    size = sum(len(d.encode("utf-8")) for d in documents) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for document in documents:
+            fn(document)
+    return size / (time.perf_counter() - start) / 1e6
+
+
+def main():
+    corpus = load_corpus()
+    if "--update-golden" in sys.argv:
+        update_golden(corpus)
+        return
+
+    failures = check_golden(corpus)
+    rounds = int(next((a for a in sys.argv[1:] if a.isdigit()), "50"))
+    documents = list(corpus.values())
+    print(f"\nThroughput over {len(documents)} documents x {rounds} rounds:")
+    print(f"{'function':<30} {'BeautifulSoup':>14} {'htmltext':>10} {'speedup':>8}")
+    for fn, (reference, fast) in FUNCTIONS.items():
+        before = throughput(reference, documents, rounds)
+        after = throughput(fast, documents, rounds)
+        print(f"{fn:<30} {before:>9.2f} MB/s {after:>5.2f} MB/s {after / before:>7.1f}x")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
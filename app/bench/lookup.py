@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from app.store import MemoryEmailStore, SqliteEmailStore
+from app.bench.corpus import synthetic_emails
+
+# Keyed UID lookups (/getStoredEmailsWithUIDs, /getEmailById) against the
+# scans they replaced, for growing mailboxes. The keyed times should stay
+# flat as the mailbox grows; the scans grow with it.
+#
+# run with python -m app.bench.lookup [largest_mailbox] [uids_per_request]
+
+
+def scan_many(store, uids):
+    """The original /getStoredEmailsWithUIDs: every email, checked against a list."""
+    return [e for e in store.all() if e["uid"] in uids]
+
+
+def scan_one(store, uid):
+    """The original /getEmailById: build the full list, then look for the UID."""
+    return next((e for e in store.all() if e["uid"] == uid), None)
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def fill(store, count):
+    for email_data in synthetic_emails(count, body_sentences=5):
+        store.put(email_data)
+
+
+def main(largest, per_request):
+    rng = random.Random(7)
+    sizes = [size for size in (1000, 10000, 100000) if size < largest] + [largest]
+    print(f"{'store':<8}{'emails':>9}{'get_many ms':>14}{'scan ms':>12}{'get ms':>10}{'scan one ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            stores = {
+                "memory": MemoryEmailStore(),
+                "sqlite": SqliteEmailStore(os.path.join(tmp, f"lookup-{size}.db")),
+            }
+            for name, store in stores.items():
+                fill(store, size)
+                uids = rng.sample(range(1, size + 1), min(per_request, size))
+                many_ms, found = timed(lambda: store.get_many(uids))
+                assert [e["uid"] for e in found] == uids
+                one_ms, _ = timed(lambda: store.get(uids[0]))
+                # the scans are slow on big mailboxes; one pass is enough to show the trend
+                scan_ms, scanned = timed(lambda: scan_many(store, uids), repeat=1)
+                assert sorted(e["uid"] for e in scanned) == sorted(uids)
+                scan_one_ms, _ = timed(lambda: scan_one(store, uids[0]), repeat=1)
+                print(f"{name:<8}{size:>9}{many_ms:>14.2f}{scan_ms:>12.1f}{one_ms:>10.3f}{scan_one_ms:>14.1f}")
+                store.close()
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    )
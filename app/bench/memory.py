@@ -0,0 +1,61 @@
+import sys
+import time
+import tracemalloc
+from app.store import MemoryEmailStore
+from app.bench.corpus import synthetic_emails
+
+# Memory held by MemoryEmailStore with compact EmailRecords (app/record.py)
+# against the per-email dicts it used to keep, and what reading them back
+# costs now that raw HTML is decompressed on demand.
+#
+# run with python -m app.bench.memory [email_count]
+
+
+class DictEmailStore:
+    """How MemoryEmailStore used to hold emails: one dict (plus a nested
+    classification dict) per email, bodies as plain strings."""
+
+    def __init__(self):
+        self._emails = {}
+
+    def put(self, email_data):
+        self._emails[email_data["uid"]] = dict(email_data, classification=dict(email_data["classification"]))
+
+    def get(self, uid, with_body=True):
+        return dict(self._emails[uid])
+
+
+def resident(make_store, count) -> tuple:
+    """(store, bytes still allocated once count emails are stored)."""
+    tracemalloc.start()
+    store = make_store()
+    for email_data in synthetic_emails(count):
+        store.put(email_data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, size
+
+
+def read_ms(store, count, with_body) -> float:
+    start = time.perf_counter()
+    for uid in range(1, count + 1):
+        store.get(uid, with_body=with_body)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(count):
+    print(f"{count} emails\n")
+    print(f"{'store':<10}{'MB':>10}{'MB / 10k':>12}{'get ms':>10}{'get+body ms':>14}")
+    sizes = {}
+    for name, make_store in (("dicts", DictEmailStore), ("records", MemoryEmailStore)):
+        store, size = resident(make_store, count)
+        sizes[name] = size
+        print(
+            f"{name:<10}{size / 1e6:>10.1f}{size / 1e6 * 10000 / count:>12.1f}"
+            f"{read_ms(store, count, False):>10.1f}{read_ms(store, count, True):>14.1f}"
+        )
+    print(f"\nrecords use {sizes['records'] / sizes['dicts']:.0%} of the memory of dicts")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,78 @@
+import sys
+import time
+from app.store import MemoryEmailStore
+from app.search import EmailIndex, field_text
+from app.bench.corpus import synthetic_emails
+
+# Compares the inverted index behind get_emails_by_data / search_emails with
+# the linear scan it replaced.
+#
+# run with python -m app.bench.search [email_count]
+
+QUERIES = [
+    ("subject", "invoice"),
+    ("sender", "robinhood"),
+    ("body", "flight hotel"),
+    ("body", "ipment tra"),
+    ("summary", "quarterly results"),
+    ("classification", "finance"),
+]
+
+
+def linear_scan(store, field, query):
+    """The original get_emails_by_data loop."""
+    query = query.lower().strip()
+    results = {}
+    for email in store.all(with_body=True):
+        value = email.get(field, "")
+        if isinstance(value, dict):
+            value_str = " ".join([str(v) for v in value.values()])
+        else:
+            value_str = str(value)
+        if query in value_str.lower().strip():
+            results[email["uid"]] = value
+    return results
+
+
+def indexed(store, index, field, query):
+    query = query.lower().strip()
+    results = {}
+    for email in store.get_many(sorted(index.candidates(field, query)), with_body=True):
+        value = email.get(field, "")
+        if query in field_text(value).lower().strip():
+            results[email["uid"]] = value
+    return results
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main(count):
+    store = MemoryEmailStore()
+    for email_data in synthetic_emails(count):
+        store.put(email_data)
+
+    index = EmailIndex(store)
+    start = time.perf_counter()
+    index.ensure_built()
+    print(f"{count} emails, index built in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"{'field':<15}{'query':<22}{'hits':>8}{'scan ms':>12}{'index ms':>12}")
+    for field, query in QUERIES:
+        scan_ms, expected = timed(lambda: linear_scan(store, field, query), repeat=1)
+        index_ms, got = timed(lambda: indexed(store, index, field, query))
+        assert got == expected, f"index disagrees with scan for {field}={query!r}"
+        print(f"{field:<15}{query!r:<22}{len(got):>8}{scan_ms:>12.1f}{index_ms:>12.2f}")
+
+    ranked_ms, hits = timed(lambda: index.search("flight hotel booking", limit=10))
+    print(f"\nranked search 'flight hotel booking': {ranked_ms:.2f} ms, top uid {hits[0][0] if hits else None}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from app.fakeimap import FakeImapServer
+from app.mockllm import MockLlmServer
+from app.bench.corpus import synthetic_mailbox
+
+# End-to-end benchmark that needs neither Gmail nor a model: a fake IMAP
+# server (app/fakeimap.py) seeded with a synthetic mailbox of plain,
+# HTML-heavy, large-attachment and many-part messages, and a mock
+# OpenAI-compatible endpoint (app/mockllm.py) with configurable latency.
+#
+# Measures fetch_emails throughput, parse/clean MB/s, enrichment emails/s,
+# endpoint latency percentiles and peak RSS, and writes them as JSON so runs
+# can be compared across commits:
+#
+#   python -m app.bench.suite [--emails 500] [--llm-latency 0.2] [--out results.json]
+#   python -m app.bench.suite --compare before.json after.json
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "../../bench_results")
+SUITE_VERSION = 1
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentiles(samples_ms) -> dict:
+    cuts = statistics.quantiles(samples_ms, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(samples_ms), 3),
+    }
+
+
+def _serve_imap(count, seed, ready):
+    # its own process, so serving the mailbox does not compete with the app for the GIL
+    server = FakeImapServer()
+    for raw in synthetic_mailbox(count, seed=seed):
+        server.mailbox.add(raw)
+    ready.put(server.port)
+    server.serve_forever()
+
+
+def start_imap(count, seed):
+    """Fake IMAP server process holding the same mailbox synthetic_mailbox(count, seed) yields."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=_serve_imap, args=(count, seed, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=600)
+
+
+def configure(tmp, imap_port, llm):
+    """Point the app at the local servers; must run before app.tools is imported."""
+    os.environ.update({
+        "IMAP_HOST": "127.0.0.1",
+        "IMAP_PORT": str(imap_port),
+        "IMAP_SSL": "false",
+        "EMAIL_USER": "user",
+        "EMAIL_PASS": "pass",
+        "IMAP_IDLE": "false",
+        "EMAIL_STORE": "sqlite",
+        "EMAIL_STORE_PATH": os.path.join(tmp, "emails.db"),
+        "JOB_DB_PATH": os.path.join(tmp, "jobs.db"),
+        "TRACE_PATH": os.path.join(tmp, "agent_traces.jsonl"),
+        "LLM_CACHE": "false",  # every enrichment goes to the (mock) model
+        "LMSTUDIO_URL": llm.url,
+        "OPENAI_MODEL": "openai:mock",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def bench_fetch(tools, mailbox_bytes, count) -> dict:
+    start = time.perf_counter()
+    fetched = tools.fetch_emails.invoke({})["new_email_data"]
+    elapsed = time.perf_counter() - start
+    return {
+        "emails": len(fetched),
+        "seconds": round(elapsed, 3),
+        "emails_per_s": round(len(fetched) / elapsed, 1),
+        "mailbox_mb_per_s": round(mailbox_bytes / elapsed / 1e6, 2),
+        "complete": len(fetched) == count,
+    }
+
+
+def bench_parse(raw_messages) -> dict:
+    from app.parsing import build_email_data, parse_messages
+
+    size = sum(len(raw) for raw in raw_messages)
+    start = time.perf_counter()
+    for uid, raw in enumerate(raw_messages, 1):
+        build_email_data(uid, raw)
+    inline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = list(parse_messages((uid, {"raw": raw}) for uid, raw in enumerate(raw_messages, 1)))
+    pooled = time.perf_counter() - start
+    return {
+        "mb": round(size / 1e6, 2),
+        "parse_clean_mb_per_s": round(size / inline / 1e6, 2),
+        "parse_messages_mb_per_s": round(size / pooled / 1e6, 2),  # PARSE_WORKERS processes
+        "parsed": len(parsed),
+    }
+
+
+def bench_enrich(tools, llm) -> dict:
+    from app.llm import close_client
+
+    uids = tools.email_store.unprocessed_uids()
+    requests_before = llm.requests
+
+    async def run():
+        try:
+            return await tools.enrichment.run(uids)
+        finally:
+            await close_client()
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if "error" in r]
+    return {
+        "emails": len(uids),
+        "failed": len(failed),
+        "seconds": round(elapsed, 3),
+        "emails_per_s": round(len(uids) / elapsed, 2) if elapsed else None,
+        "llm_requests": llm.requests - requests_before,
+        "concurrency": tools.enrichment.concurrency,
+    }
+
+
+def bench_endpoints(tools, requests) -> dict:
+    try:
+        from fastapi.testclient import TestClient
+        from app.main import app
+    except ImportError as e:
+        print("Skipping endpoint latency:", e)
+        return {"skipped": str(e)}
+
+    rng = random.Random(1)
+    uids = tools.email_store.uids()
+    endpoints = {
+        "getStoredEmails": lambda: ("/getStoredEmails", {}),
+        "getStoredEmails_projected": lambda: ("/getStoredEmails?fields=uid,subject,sender,isRead,classification", {}),
+        "getStoredEmails_page": lambda: ("/getStoredEmails?sort=-date&limit=50", {}),
+        "getStoredEmailsWithUIDs": lambda: (
+            "/getStoredEmailsWithUIDs?" + "&".join(f"uids={uid}" for uid in rng.sample(uids, min(20, len(uids)))), {}
+        ),
+        "getEmailById": lambda: (f"/getEmailById?uid={rng.choice(uids)}", {}),
+    }
+
+    results = {}
+    with TestClient(app) as client:
+        etag = client.get("/getStoredEmails").headers.get("etag")
+        endpoints["getStoredEmails_not_modified"] = lambda: ("/getStoredEmails", {"If-None-Match": etag})
+        for name, make_request in endpoints.items():
+            samples = []
+            for _ in range(requests):
+                path, headers = make_request()
+                start = time.perf_counter()
+                response = client.get(path, headers=headers)
+                samples.append((time.perf_counter() - start) * 1000)
+                if response.status_code not in (200, 304):
+                    raise RuntimeError(f"{path} returned {response.status_code}")
+            results[name] = percentiles(samples)
+    return results
+
+
+def run_suite(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_messages = list(synthetic_mailbox(args.emails, seed=args.seed))
+        imap, imap_port = start_imap(args.emails, args.seed)
+        llm = MockLlmServer(latency=args.llm_latency, jitter=args.llm_jitter).start()
+        configure(tmp, imap_port, llm)
+
+        from app import tools  # reads the configuration above at import
+
+        mailbox_bytes = sum(len(raw) for raw in raw_messages)
+        results = {}
+        print(f"Mailbox: {args.emails} messages, {mailbox_bytes / 1e6:.1f} MB")
+        results["fetch"] = bench_fetch(tools, mailbox_bytes, args.emails)
+        print("fetch_emails:", results["fetch"])
+        results["parse"] = bench_parse(raw_messages)
+        print("parse:", results["parse"])
+        results["enrich"] = bench_enrich(tools, llm)
+        print("enrich:", results["enrich"])
+        results["endpoints"] = bench_endpoints(tools, args.requests)
+        for name, stats in results["endpoints"].items():
+            print(f"{name}: {stats}")
+        results["peak_rss_mb"] = peak_rss_mb()
+        print("peak RSS:", results["peak_rss_mb"], "MB")
+
+        imap.terminate()
+        llm.stop()
+
+    return {
+        "suite": SUITE_VERSION,
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "emails": args.emails,
+            "seed": args.seed,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "requests": args.requests,
+        },
+        "results": results,
+    }
+
+
+def _numbers(tree, prefix=""):
+    for key, value in tree.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _numbers(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    if before["config"] != after["config"]:
+        print("Warning: the runs used different configurations:", before["config"], after["config"])
+    old = dict(_numbers(before["results"]))
+    print(f"{'metric':<50}{before['commit'] or 'before':>12}{after['commit'] or 'after':>12}{'change':>10}")
+    for name, value in _numbers(after["results"]):
+        if name not in old:
+            continue
+        change = f"{(value - old[name]) / old[name]:+.1%}" if old[name] else ""
+        print(f"{name:<50}{old[name]:>12}{value:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per mock LLM request")
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--out", help="results file (default bench_results/<time>-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_suite(args)
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(RESULTS_DIR, f"{stamp}-{report['commit'] or 'nocommit'}.json")
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"Wrote {os.path.normpath(out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+
+# Persistent cache of LLM results keyed by what the model actually saw:
+# a hash of the normalized email body plus a fingerprint of the prompt,
+# model and category list. Changing any of those changes the fingerprint,
+# and entries written under an old fingerprint are purged the first time
+# the new one is used.
+
+ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+URL_QUERY_RE = re.compile(r"(https?://[^\s?#]+)[?#]\S*")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_body(text: str) -> str:
+    """Make near-identical mail hash the same: tracking parameters on links,
+    invisible characters and whitespace differences are dropped."""
+    text = ZERO_WIDTH_RE.sub("", text or "")
+    text = URL_QUERY_RE.sub(r"\1", text)
+    return WHITESPACE_RE.sub(" ", text).strip()
+
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key         TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_kind ON llm_cache(kind, fingerprint);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access);
+"""
+
+
+class LlmCache:
+    def __init__(self, path, max_entries=50000, ttl=30 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl  # seconds; <= 0 keeps entries until evicted by size
+        self.hits = {}
+        self.misses = {}
+        self._checked = set()  # (kind, fingerprint) pairs already purged of stale entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _invalidate_stale(self, kind, fp):
+        if (kind, fp) in self._checked:
+            return
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM llm_cache WHERE kind = ? AND fingerprint != ?", (kind, fp)
+            ).rowcount
+        self._checked.add((kind, fp))
+        if removed:
+            print(f"Prompt, model or categories changed: dropped {removed} cached '{kind}' results.")
+
+    def get(self, kind, fp, body):
+        self._invalidate_stale(kind, fp)
+        key = fingerprint(kind, fp, normalize_body(body))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl > 0 and now - row[1] > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+        return json.loads(row[0])
+
+    def put(self, kind, fp, body, value):
+        key = fingerprint(kind, fp, normalize_body(body))
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, kind, fingerprint, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, fp, json.dumps(value), now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                # evict least recently used down to 90% so this does not run on every insert
+                excess = count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                    (excess,),
+                )
+
+    def get_or_compute(self, kind, fp, body, compute):
+        """Return the cached value for (kind, fp, body), or compute(), cache and return it.
+
+        Exceptions and empty results from compute() are not cached.
+        """
+        cached = self.get(kind, fp, body)
+        if cached is not None:
+            return cached
+        value = compute()
+        if value:
+            self.put(kind, fp, body, value)
+        return value
+
+    async def aget_or_compute(self, kind, fp, body, compute):
+        """get_or_compute for a coroutine function compute; the SQLite work runs in a thread."""
+        cached = await asyncio.to_thread(self.get, kind, fp, body)
+        if cached is not None:
+            return cached
+        value = await compute()
+        if value:
+            await asyncio.to_thread(self.put, kind, fp, body, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        kinds = set(self.hits) | set(self.misses)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": {
+                k: self.hits.get(k, 0) / (self.hits.get(k, 0) + self.misses.get(k, 0)) for k in kinds
+            },
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class NoCache:
+    """Stand-in used when LLM_CACHE=false."""
+
+    def get_or_compute(self, kind, fp, body, compute):
+        return compute()
+
+    async def aget_or_compute(self, kind, fp, body, compute):
+        return await compute()
+
+    def stats(self) -> dict:
+        return {"entries": 0, "max_entries": 0, "hits": {}, "misses": {}, "hit_rate": {}}
+
+    def close(self):
+        pass
+
+
+def create_cache():
+    if os.getenv("LLM_CACHE", "true").lower() not in ("true", "1", "yes"):
+        return NoCache()
+    return LlmCache(
+        os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "../llm_cache.db")),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000")),
+        ttl=float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600))),
+    )
@@ -0,0 +1,53 @@
+import secrets
+import threading
+
+# Change tracking for incremental reads of the store. Every put, update and
+# remove advances a version counter; clients that remember the version of
+# their last read ask for what changed since then instead of re-reading
+# every email. Versions are only meaningful within one process (each start
+# picks a new epoch), so a client holding a stale version is told to reload.
+
+
+class ChangeLog:
+    def __init__(self, store):
+        self._epoch = secrets.token_hex(4)
+        self._seq = 0
+        self._floor = 0  # versions before a clear() cannot be answered
+        self._changed = {}  # uid -> seq of its latest put/update
+        self._removed = {}  # uid -> seq of its removal
+        self._lock = threading.Lock()
+        store.add_listener(self._on_store_change)
+
+    @property
+    def version(self) -> str:
+        with self._lock:
+            return f"{self._epoch}.{self._seq}"
+
+    def _on_store_change(self, event, uid, fields):
+        with self._lock:
+            self._seq += 1
+            if event == "clear":
+                self._changed.clear()
+                self._removed.clear()
+                self._floor = self._seq
+            elif event == "remove":
+                self._changed.pop(uid, None)
+                self._removed[uid] = self._seq
+            else:
+                self._changed[uid] = self._seq
+                self._removed.pop(uid, None)
+
+    def since(self, version: str):
+        """(changed UIDs, removed UIDs) after version, or None when version did
+        not come from this log (a restart, a clear, garbage) and the client
+        has to read everything again."""
+        epoch, _, seq = (version or "").partition(".")
+        with self._lock:
+            if epoch != self._epoch or not seq.isdigit():
+                return None
+            seq = int(seq)
+            if seq < self._floor or seq > self._seq:
+                return None
+            changed = [uid for uid, changed_at in self._changed.items() if changed_at > seq]
+            removed = [uid for uid, removed_at in self._removed.items() if removed_at > seq]
+        return changed, removed
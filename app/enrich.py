@@ -0,0 +1,122 @@
+import os
+import random
+import asyncio
+from app.ratelimit import AsyncRateLimiter
+
+# Batch summarize/classify pipeline. Emails are processed concurrently with a
+# bounded number of LLM calls in flight, an optional requests-per-second cap,
+# and retries with exponential backoff for transient failures.
+
+
+class EnrichmentPipeline:
+    def __init__(self, store, summarize, classify, enrich=None, mode=None, concurrency=None,
+                 rate_limit=None, max_retries=None, retry_base_delay=None):
+        """summarize(email) -> str, classify(email) -> dict and the optional
+        enrich(email) -> {"summary", "classification"} raise on failure; errors
+        carrying `retryable = True` are retried. They may be coroutine functions
+        (awaited on the loop) or blocking callables (run in a worker thread).
+
+        In "combined" mode (ENRICH_MODE, the default when enrich is given) an
+        email missing both results gets them from a single enrich call.
+        """
+        self.store = store
+        self.summarize = summarize
+        self.classify = classify
+        self.enrich = enrich
+        self.mode = mode or os.getenv("ENRICH_MODE", "combined" if enrich else "separate")
+        self.concurrency = concurrency or int(os.getenv("ENRICH_CONCURRENCY", "4"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "3"))
+        self.retry_base_delay = retry_base_delay if retry_base_delay is not None else float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+        rate = rate_limit if rate_limit is not None else float(os.getenv("LLM_RATE_LIMIT", "0"))
+        self.rate_limiter = AsyncRateLimiter(rate, burst=self.concurrency)
+
+    async def _call(self, fn, email_obj):
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire()
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    return await fn(email_obj)
+                return await asyncio.to_thread(fn, email_obj)
+            except Exception as e:
+                if not getattr(e, "retryable", False) or attempt >= self.max_retries:
+                    raise
+                delay = self.retry_base_delay * (2 ** attempt) * (0.5 + random.random())
+                print(f"LLM call failed ({e}); retrying in {delay:.1f}s...")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _enrich_one(self, uid, semaphore, tasks=None):
+        result = {"uid": uid}
+        async with semaphore:
+            email_obj = await asyncio.to_thread(self.store.get, uid)
+            if not email_obj:
+                result["error"] = "Email not found"
+                return result
+            result["subject"] = email_obj.get("subject")
+
+            if tasks is None:
+                classification = email_obj.get("classification") or {}
+                needs_summary = not email_obj.get("summary")
+                needs_classification = not (classification.get("priority") and classification.get("category"))
+            else:
+                needs_summary = "summary" in tasks
+                needs_classification = "classification" in tasks
+            try:
+                if needs_summary and needs_classification and self.enrich and self.mode == "combined":
+                    try:
+                        enriched = await self._call(self.enrich, email_obj)
+                        await asyncio.to_thread(self.store.update, uid, **enriched)
+                        result.update(enriched)
+                        return result
+                    except ValueError as e:
+                        # the model did not follow the combined format; fall back to one call per task
+                        print(f"Combined enrichment of email {uid} unparseable ({e}); using separate calls.")
+                if needs_summary:
+                    summary = await self._call(self.summarize, email_obj)
+                    if not summary:
+                        raise ValueError("No summary returned.")
+                    await asyncio.to_thread(self.store.update, uid, summary=summary)
+                    result["summary"] = summary
+                if needs_classification:
+                    classification = await self._call(self.classify, email_obj)
+                    await asyncio.to_thread(self.store.update, uid, classification=classification)
+                    result["classification"] = classification
+            except Exception as e:
+                print(f"Enriching email {uid} FAILED:", e)
+                result["error"] = str(e)
+        return result
+
+    async def run(self, uids, on_progress=None, tasks=None) -> list:
+        """Summarize and classify every email in uids that is missing either.
+
+        With tasks (a subset of ("summary", "classification")) exactly those
+        results are (re)generated for every email, whatever it already has.
+        on_progress(result, done, total) is called (it may be async) as each
+        email finishes; results are returned in completion order.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        running = [asyncio.create_task(self._enrich_one(uid, semaphore, tasks)) for uid in uids]
+        results = []
+        try:
+            for finished in asyncio.as_completed(running):
+                result = await finished
+                results.append(result)
+                if on_progress:
+                    progress = on_progress(result, len(results), len(running))
+                    if asyncio.iscoroutine(progress):
+                        await progress
+        finally:
+            for task in running:
+                task.cancel()
+        return results
+
+
+def summarize_results(results) -> dict:
+    """Compact roll-up of pipeline results for API and agent responses."""
+    failed = [{"uid": r["uid"], "error": r["error"]} for r in results if "error" in r]
+    return {
+        "processed": len(results) - len(failed),
+        "failed": failed,
+        "results": [r for r in results if "error" not in r],
+    }
@@ -0,0 +1,53 @@
+import json
+import asyncio
+import threading
+
+# Fan-out of server events to connected clients (served as SSE from /events).
+# publish() may be called from any thread, e.g. the IMAP IDLE worker.
+
+
+class EventBroker:
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._loop = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def bind(self, loop):
+        """Attach the event loop the subscriber queues live on."""
+        self._loop = loop
+
+    def publish(self, event: str, data):
+        if self._loop is None:
+            return
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            self._loop.call_soon_threadsafe(self._offer, queue, message)
+
+    def _offer(self, queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # a client that stopped reading should not hold memory; it resyncs on reconnect
+            print("Dropping event for slow subscriber.")
+
+    async def stream(self, keepalive=15.0):
+        """Yield SSE-formatted messages until the client disconnects."""
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(queue)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(queue)
+
+
+broker = EventBroker()
@@ -0,0 +1,358 @@
+import re
+import email
+import email.policy
+import socketserver
+import threading
+from email.message import EmailMessage
+
+# Minimal in-process IMAP4rev1 server for exercising the IMAP code paths
+# without Gmail. It understands the handful of commands the app sends.
+#
+# run with python -m app.fakeimap, then start the API with
+#   IMAP_HOST=127.0.0.1 IMAP_PORT=1143 IMAP_SSL=false EMAIL_USER=user EMAIL_PASS=pass
+
+
+class FakeMailbox:
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highest_modseq = 1
+        self.messages = []  # list of {"uid", "flags", "raw", "modseq"}, in sequence order
+        self.lock = threading.RLock()
+        self.listeners = set()  # callables receiving untagged lines for sessions in IDLE
+
+    def _notify(self, line):
+        for listener in list(self.listeners):
+            listener(line)
+
+    def add(self, raw: bytes, seen=False) -> int:
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.highest_modseq += 1
+            self.messages.append({
+                "uid": uid,
+                "flags": {"\\Seen"} if seen else set(),
+                "raw": raw,
+                "modseq": self.highest_modseq,
+            })
+            self._notify(f"* {len(self.messages)} EXISTS")
+            return uid
+
+    def expunge(self, uid):
+        with self.lock:
+            for seq, msg in enumerate(self.messages, 1):
+                if msg["uid"] == uid:
+                    del self.messages[seq - 1]
+                    self.highest_modseq += 1
+                    self._notify(f"* {seq} EXPUNGE")
+                    return
+
+    def set_flags(self, msg, flags):
+        with self.lock:
+            if flags != msg["flags"]:
+                self.highest_modseq += 1
+                msg["flags"] = flags
+                msg["modseq"] = self.highest_modseq
+                seq = self.messages.index(msg) + 1
+                self._notify(f"* {seq} FETCH (FLAGS ({' '.join(sorted(flags))}))")
+
+
+def make_message(subject, sender="sender@example.com", body="Hello", html=None, attachments=()) -> bytes:
+    """attachments: (filename, data, "maintype/subtype") tuples."""
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = "user@example.com"
+    msg["Date"] = "Mon, 01 Jan 2024 10:00:00 +0000"
+    msg.set_content(body)
+    if html:
+        msg.add_alternative(html, subtype="html")
+    for filename, data, mime_type in attachments:
+        maintype, subtype = mime_type.split("/")
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    return bytes(msg)
+
+
+def _quote(value) -> str:
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part) -> str:
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+    params = [(k.upper(), v) for k, v in part.get_params()[1:]] if part.get_params() else []
+    param_list = "(" + " ".join(f"{_quote(k)} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = _section_bytes(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        param_list,
+        "NIL",
+        "NIL",
+        _quote((part.get("Content-Transfer-Encoding") or "7bit").upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    disposition = part.get_content_disposition()
+    filename = part.get_filename()
+    fields.append("NIL")  # md5
+    if disposition:
+        dsp_params = f"({_quote('FILENAME')} {_quote(filename)})" if filename else "NIL"
+        fields.append(f"({_quote(disposition.upper())} {dsp_params})")
+    else:
+        fields.append("NIL")
+    return "(" + " ".join(fields) + ")"
+
+
+def _section_bytes(part) -> bytes:
+    payload = part.get_payload(decode=False)
+    return payload.encode() if isinstance(payload, str) else bytes(payload or b"")
+
+
+def _section(msg, spec: str):
+    part = msg
+    for number in spec.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            raise IndexError(spec)
+    return part
+
+
+def _parse_set(spec: str, largest: int) -> set:
+    result = set()
+    for piece in spec.split(","):
+        if ":" in piece:
+            lo, hi = piece.split(":")
+            lo = largest if lo == "*" else int(lo)
+            hi = largest if hi == "*" else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            result.update(range(lo, hi + 1))
+        else:
+            result.add(largest if piece == "*" else int(piece))
+    return result
+
+
+def _tokenize(line: str) -> list:
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\([^)]*\)|\S+', line)
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    # responses go out a line at a time; with Nagle on, each tagged reply waits
+    # on the client's delayed ACK (~40 ms) and benchmarks measure that instead
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+
+    def send(self, line):
+        if isinstance(line, str):
+            line = line.encode()
+        with self.write_lock:
+            self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.selected = False
+        self.send("* OK FakeIMAP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = _tokenize(line.decode().strip())
+            if len(parts) < 2:
+                continue
+            tag, command, args = parts[0], parts[1].upper(), parts[2:]
+            use_uid = command == "UID"
+            if use_uid:
+                command, args = args[0].upper(), args[1:]
+
+            handler = getattr(self, "cmd_" + command.lower(), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command")
+                continue
+            self.server.commands.append(("UID " if use_uid else "") + command)
+            if handler(tag, args, use_uid) is False:
+                return
+
+    def cmd_capability(self, tag, args, use_uid):
+        extra = " ENABLE CONDSTORE" if self.server.condstore else ""
+        self.send("* CAPABILITY IMAP4rev1 IDLE" + extra)
+        self.send(f"{tag} OK CAPABILITY completed")
+
+    def cmd_enable(self, tag, args, use_uid):
+        enabled = [a for a in args if a.upper() == "CONDSTORE" and self.server.condstore]
+        self.send("* ENABLED" + "".join(" " + a for a in enabled))
+        self.send(f"{tag} OK ENABLE completed")
+
+    def cmd_login(self, tag, args, use_uid):
+        user, password = (a.strip('"') for a in args[:2])
+        if (user, password) != (self.server.user, self.server.password):
+            self.send(f"{tag} NO LOGIN failed")
+        else:
+            self.send(f"{tag} OK LOGIN completed")
+
+    def cmd_select(self, tag, args, use_uid):
+        box = self.server.mailbox
+        with box.lock:
+            self.selected = True
+            self.send(f"* {len(box.messages)} EXISTS")
+            self.send("* 0 RECENT")
+            self.send(f"* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {box.uidnext}] Predicted next UID")
+            if self.server.condstore:
+                self.send(f"* OK [HIGHESTMODSEQ {box.highest_modseq}] Highest")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+
+    cmd_examine = cmd_select
+
+    def cmd_noop(self, tag, args, use_uid):
+        self.send(f"{tag} OK NOOP completed")
+
+    def cmd_idle(self, tag, args, use_uid):
+        box = self.server.mailbox
+        self.send("+ idling")
+        box.listeners.add(self.send)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    break
+        finally:
+            box.listeners.discard(self.send)
+        self.send(f"{tag} OK IDLE terminated")
+
+    def cmd_logout(self, tag, args, use_uid):
+        self.send("* BYE logging out")
+        self.send(f"{tag} OK LOGOUT completed")
+        return False
+
+    def _resolve(self, spec, use_uid):
+        box = self.server.mailbox
+        if not box.messages:
+            return []
+        if use_uid:
+            wanted = _parse_set(spec, box.messages[-1]["uid"])
+            return [(i + 1, m) for i, m in enumerate(box.messages) if m["uid"] in wanted]
+        wanted = _parse_set(spec, len(box.messages))
+        return [(i + 1, m) for i, m in enumerate(box.messages) if i + 1 in wanted]
+
+    def cmd_search(self, tag, args, use_uid):
+        box = self.server.mailbox
+        with box.lock:
+            matches = list(enumerate(box.messages, 1))
+            criteria = [a.upper() for a in args if a.upper() != "CHARSET"]
+            i = 0
+            while i < len(criteria):
+                key = criteria[i]
+                if key == "UNSEEN":
+                    matches = [(n, m) for n, m in matches if "\\Seen" not in m["flags"]]
+                elif key == "SEEN":
+                    matches = [(n, m) for n, m in matches if "\\Seen" in m["flags"]]
+                elif key == "UID":
+                    i += 1
+                    keep = {n for n, _ in self._resolve(criteria[i], True)}
+                    matches = [(n, m) for n, m in matches if n in keep]
+                i += 1
+            ids = [str(m["uid"] if use_uid else n) for n, m in matches]
+        self.send("* SEARCH" + ("" if not ids else " " + " ".join(ids)))
+        self.send(f"{tag} OK SEARCH completed")
+
+    def cmd_fetch(self, tag, args, use_uid):
+        box = self.server.mailbox
+        items = " ".join(args[1:]).upper()
+        changed_since = re.search(r"CHANGEDSINCE (\d+)", items)
+        with box.lock:
+            for seq, msg in self._resolve(args[0], use_uid):
+                if changed_since and msg["modseq"] <= int(changed_since.group(1)):
+                    continue
+                fields = []
+                if use_uid or "UID" in items.split():
+                    fields.append(f"UID {msg['uid']}".encode())
+                if "FLAGS" in items:
+                    fields.append(f"FLAGS ({' '.join(sorted(msg['flags']))})".encode())
+                if changed_since:
+                    fields.append(f"MODSEQ ({msg['modseq']})".encode())
+                if "RFC822.SIZE" in items:
+                    fields.append(f"RFC822.SIZE {len(msg['raw'])}".encode())
+                if "BODY.PEEK[]" in items or "RFC822" in items.replace("RFC822.SIZE", ""):
+                    fields.append(b"BODY[] {%d}\r\n" % len(msg["raw"]) + msg["raw"])
+                sections = re.findall(r"BODY\.PEEK\[([^\]]+)\](?:<(\d+)\.(\d+)>)?", items)
+                if "BODYSTRUCTURE" in items or sections:
+                    # parsed once per message; re-parsing megabytes per FETCH would dominate benchmarks
+                    if "parsed" not in msg:
+                        msg["parsed"] = email.message_from_bytes(msg["raw"], policy=email.policy.default)
+                    parsed = msg["parsed"]
+                if "BODYSTRUCTURE" in items:
+                    fields.append(b"BODYSTRUCTURE " + _bodystructure(parsed).encode())
+                for spec, start, length in sections:
+                    if spec == "HEADER":
+                        data = msg["raw"].split(b"\n\n", 1)[0] + b"\n\n"
+                    else:
+                        data = _section_bytes(_section(parsed, spec))
+                    name = f"BODY[{spec}]"
+                    if start:
+                        data = data[int(start):int(start) + int(length)]
+                        name += f"<{start}>"
+                    fields.append(name.encode() + b" {%d}\r\n" % len(data) + data)
+                self.send(f"* {seq} FETCH (".encode() + b" ".join(fields) + b")")
+        self.send(f"{tag} OK FETCH completed")
+
+    def cmd_store(self, tag, args, use_uid):
+        box = self.server.mailbox
+        mode = args[1].upper()
+        flags = set(args[2].strip("()").split())
+        with box.lock:
+            for seq, msg in self._resolve(args[0], use_uid):
+                if mode.startswith("+"):
+                    box.set_flags(msg, msg["flags"] | flags)
+                elif mode.startswith("-"):
+                    box.set_flags(msg, msg["flags"] - flags)
+                else:
+                    box.set_flags(msg, set(flags))
+                if not mode.endswith(".SILENT"):
+                    self.send(f"* {seq} FETCH (FLAGS ({' '.join(sorted(msg['flags']))}))")
+        self.send(f"{tag} OK STORE completed")
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, user="user", password="pass", mailbox=None, condstore=True):
+        super().__init__((host, port), FakeImapHandler)
+        self.condstore = condstore
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox or FakeMailbox()
+        self.connections = 0  # accepted TCP connections, i.e. logins paid for
+        self.commands = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeImapServer(port=1143)
+    for i in range(20):
+        server.mailbox.add(make_message(f"Test email {i}", body=f"This is test email number {i}."))
+    print(f"Fake IMAP server listening on 127.0.0.1:{server.port} (user/pass)")
+    server.serve_forever()
@@ -0,0 +1,134 @@
+import os
+import asyncio
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from app.prepare import estimate_tokens
+
+# Per-session chat history for /promptAgent. Each session keeps its most
+# recent turns verbatim (a turn is a user message plus every AI and tool
+# message that answered it). Older turns are folded into a rolling summary
+# of one line per turn, and tool output from earlier turns is cut short, so
+# the prompt stays under AGENT_HISTORY_TOKEN_BUDGET however long a session runs.
+
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+
+
+def _content(message) -> str:
+    content = message.content
+    if isinstance(content, list):  # multi-part content
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content or "")
+
+
+def _shorten(text: str, tokens: int) -> str:
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"... [{len(text) - limit} more characters not shown]"
+
+
+def _turn_tokens(turn) -> int:
+    return sum(estimate_tokens(_content(m)) + 4 for m in turn)
+
+
+def _digest(turn) -> str:
+    """One summary line for a collapsed turn: what was asked, which tools ran, what was answered."""
+    asked = next((_content(m) for m in turn if isinstance(m, HumanMessage)), "")
+    tools = []
+    for message in turn:
+        for call in getattr(message, "tool_calls", None) or []:
+            if call.get("name") and call["name"] not in tools:
+                tools.append(call["name"])
+    answer = next((_content(m) for m in reversed(turn) if isinstance(m, AIMessage) and _content(m)), "")
+    line = f"- User: {_shorten(' '.join(asked.split()), 40)}"
+    if tools:
+        line += f" | tools: {', '.join(tools)}"
+    if answer:
+        line += f" | Assistant: {_shorten(' '.join(answer.split()), 60)}"
+    return line
+
+
+class _Session:
+    def __init__(self):
+        self.turns = []  # [[message, ...], ...], oldest first
+        self.summary = []  # digest lines of collapsed turns, oldest first
+        self.lock = asyncio.Lock()
+
+
+class ChatSessions:
+    def __init__(self, token_budget=None, max_turns=None, tool_output_tokens=None, max_sessions=None):
+        self.token_budget = token_budget or int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "3000"))
+        self.max_turns = max_turns or int(os.getenv("AGENT_HISTORY_TURNS", "6"))
+        self.tool_output_tokens = tool_output_tokens or int(os.getenv("AGENT_TOOL_OUTPUT_TOKENS", "300"))
+        self.max_sessions = max_sessions or int(os.getenv("AGENT_MAX_SESSIONS", "100"))
+        self._sessions = OrderedDict()
+
+    def _session(self, session_id) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+            # least recently used first; a session whose agent run holds its lock stays,
+            # or the next request in it would get a new lock and run alongside
+            for old_id in [i for i, other in self._sessions.items() if not other.lock.locked()]:
+                if len(self._sessions) <= self.max_sessions:
+                    break
+                if old_id != session_id:
+                    del self._sessions[old_id]
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def lock(self, session_id) -> asyncio.Lock:
+        """Hold while running the agent so two requests in one session do not interleave."""
+        return self._session(session_id).lock
+
+    def messages(self, session_id) -> list:
+        """History to put in front of the next user message."""
+        session = self._session(session_id)
+        messages = []
+        if session.summary:
+            messages += [
+                HumanMessage(content=SUMMARY_PREFIX + "\n".join(session.summary)),
+                AIMessage(content="Understood."),
+            ]
+        for turn in session.turns:
+            messages += turn
+        return messages
+
+    def append(self, session_id, new_messages):
+        """Store the messages one agent run added, then compact the session."""
+        session = self._session(session_id)
+        for message in new_messages:
+            if isinstance(message, HumanMessage) or not session.turns:
+                session.turns.append([])
+            session.turns[-1].append(message)
+        self._compact(session)
+
+    async def reset(self, session_id):
+        """Forget the session's history, once a run holding its lock is done (its turn goes too)."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        async with session.lock:
+            session.turns.clear()
+            session.summary.clear()
+
+    def _compact(self, session):
+        # tool output is only needed verbatim while the turn that produced it is the latest
+        for turn in session.turns[:-1]:
+            for i, message in enumerate(turn):
+                if isinstance(message, ToolMessage):
+                    content = _content(message)
+                    shortened = _shorten(content, self.tool_output_tokens)
+                    if shortened != content:
+                        turn[i] = message.model_copy(update={"content": shortened})
+
+        def total():
+            return sum(_turn_tokens(t) for t in session.turns) + estimate_tokens("\n".join(session.summary))
+
+        while len(session.turns) > 1 and (len(session.turns) > self.max_turns or total() > self.token_budget):
+            session.summary.append(_digest(session.turns.pop(0)))
+
+        # the summary itself gets a quarter of the budget; the oldest lines go first
+        summary_budget = self.token_budget // 4
+        while session.summary and estimate_tokens("\n".join(session.summary)) > summary_budget:
+            session.summary.pop(0)
@@ -0,0 +1,150 @@
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# HTML to text in one streaming pass over html.parser events, replacing the
+# BeautifulSoup tree (parse, decompose, re-walk) each cleaning step used to
+# build. Output follows the BeautifulSoup rules it replaces, including how
+# BeautifulSoup collapses whitespace-only strings between tags.
+
+REMOVED_TAGS = frozenset(("script", "style", "head"))  # dropped with everything inside; meta/link/img carry no text
+HIDDEN_TAGS = frozenset(("script", "style", "template", "rt", "rp"))  # strings get_text never returns
+BLOCK_TAGS = frozenset(("br", "p", "div", "li"))
+PRESERVE_WHITESPACE_TAGS = frozenset(("pre", "textarea"))
+ASCII_SPACES = " \n\t\x0c\r"
+
+CHARREF_RE = re.compile(r"([xX][0-9a-fA-F]+|[0-9]+)(.*)", re.S)
+SPACES_RE = re.compile(r"[ \t]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+class _TextCollector(HTMLParser):
+    def __init__(self, removed_tags, block_breaks):
+        # references are resolved here, the way BeautifulSoup resolves them
+        super().__init__(convert_charrefs=False)
+        self.removed_tags = removed_tags
+        self.block_breaks = block_breaks
+        self.strings = []
+        self._pending = []  # data pieces of the current text node
+        self._removed_depth = 0
+        self._hidden_depth = 0
+        self._preserve_depth = 0
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending = []
+        if self._removed_depth or self._hidden_depth:
+            return
+        if not self._preserve_depth and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        self.strings.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in self.removed_tags:
+            self._removed_depth += 1
+        elif tag in HIDDEN_TAGS:
+            self._hidden_depth += 1
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve_depth += 1
+        self._block_break(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+        self._block_break(tag)
+
+    def _block_break(self, tag):
+        # the inserted newline is an ordinary string, so it shows even inside hidden tags
+        if self.block_breaks and tag in BLOCK_TAGS and not self._removed_depth:
+            self.strings.append("\n")
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in self.removed_tags and self._removed_depth:
+            self._removed_depth -= 1
+        elif tag in HIDDEN_TAGS and self._hidden_depth:
+            self._hidden_depth -= 1
+        elif tag in PRESERVE_WHITESPACE_TAGS and self._preserve_depth:
+            self._preserve_depth -= 1
+
+    def handle_data(self, data):
+        self._pending.append(data)
+
+    def handle_entityref(self, name):
+        # unknown names stay literal text, minus the semicolon
+        self._pending.append(html5.get(name + ";") or html5.get(name) or "&" + name)
+
+    def handle_charref(self, name):
+        match = CHARREF_RE.match(name)
+        if not match:
+            self._pending.append(name)
+            return
+        digits, rest = match.groups()
+        code = int(digits[1:], 16) if digits[0] in "xX" else int(digits)
+        char = None
+        if code < 256:
+            # low references often mean windows-1252 (&#150; is a dash)
+            try:
+                char = bytes([code]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if char is None:
+            try:
+                char = chr(code)
+            except (ValueError, OverflowError):
+                char = "\N{REPLACEMENT CHARACTER}"
+        self._pending.append(char + rest)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.startswith("CDATA[") and not (self._removed_depth or self._hidden_depth):
+            self.strings.append(data[len("CDATA["):])
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def html_strings(html: str, removed_tags=REMOVED_TAGS, block_breaks=False) -> list:
+    """The text nodes of html in document order, as BeautifulSoup's get_text
+    would see them once removed_tags and comments are taken out. With
+    block_breaks a "\\n" is added before every br/p/div/li."""
+    collector = _TextCollector(removed_tags, block_breaks)
+    collector.feed(html)
+    collector.close()
+    return collector.strings
+
+
+def clean_email_body_from_html(html: str) -> str:
+    """Readable text for the LLM and the UI: scripts, styles, images and comments
+    dropped, line breaks kept at block tags, runs of spaces and blank lines collapsed."""
+    if not html:
+        return "ERROR: HTML Body not received."
+    text = "".join(html_strings(html, block_breaks=True))
+    text = SPACES_RE.sub(" ", text)
+    text = BLANK_LINES_RE.sub("\n\n", text)
+    return text.strip()
+
+
+def extract_text_from_html(html: str) -> str:
+    """Visible text on a single line, words separated by single spaces."""
+    if not html:
+        return ""
+    return WHITESPACE_RE.sub(" ", " ".join(html_strings(html))).strip()
+
+
+def html_fallback_text(html: str) -> str:
+    """Every text node, one per line; the plain-text body for HTML-only mail."""
+    return "\n".join(html_strings(html, removed_tags=())).strip()
@@ -0,0 +1,128 @@
+import re
+import socket
+import threading
+
+# Background IMAP IDLE worker. It keeps one dedicated connection parked in
+# IDLE and, as soon as the server reports EXISTS / EXPUNGE / FETCH, leaves
+# IDLE and calls on_change with the kinds of notification it saw. The
+# callback does the actual (incremental) sync over the regular pool. Each
+# synced folder of each account gets its own listener.
+
+UNTAGGED_RE = re.compile(rb"^\* \d+ (EXISTS|EXPUNGE|FETCH)\b", re.IGNORECASE)
+
+
+class IdleListener(threading.Thread):
+    def __init__(self, connect, on_change, renew_after=25 * 60, max_backoff=300, name="default"):
+        super().__init__(name=f"imap-idle-{name}", daemon=True)
+        self.connect = connect  # returns a logged-in session with the folder selected
+        self.on_change = on_change
+        self.renew_after = renew_after  # servers drop IDLE after ~30 minutes
+        self.max_backoff = max_backoff
+        self._stop_event = threading.Event()
+        self._mail = None
+        self._done_lock = threading.Lock()
+        self._done_sent = False
+
+    def stop(self):
+        self._stop_event.set()
+        mail = self._mail
+        if mail is not None:
+            try:
+                # unblocks the readline() the worker is parked in; mail.shutdown()
+                # would first close the file that readline() holds the lock of
+                mail.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+    def run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._mail = self.connect()
+                if "IDLE" not in self._mail.capabilities:
+                    print(f"IMAP server of {self.name} does not support IDLE; listener exiting.")
+                    return
+                backoff = 1
+                # catch anything that arrived while we were disconnected
+                self.on_change({"EXISTS"})
+                while not self._stop_event.is_set():
+                    events = self._idle_once()
+                    if events:
+                        self.on_change(events)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                print(f"IMAP IDLE listener ({self.name}) error: {e}. Reconnecting in {backoff}s...")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                mail, self._mail = self._mail, None
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+    def _send_done(self):
+        with self._done_lock:
+            if self._done_sent or self._mail is None:
+                return
+            self._done_sent = True
+            try:
+                self._mail.send(b"DONE\r\n")
+            except Exception:
+                pass
+
+    def _idle_once(self) -> set:
+        """Run one IDLE command and return the notification kinds seen during it."""
+        mail = self._mail
+        tag = mail._new_tag()
+        with self._done_lock:
+            self._done_sent = False
+        mail.send(tag + b" IDLE\r\n")
+
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            raise RuntimeError(f"IDLE refused: {line!r}")
+
+        timer = threading.Timer(self.renew_after, self._send_done)
+        timer.daemon = True
+        timer.start()
+        events = set()
+        try:
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise ConnectionError("IMAP connection closed during IDLE")
+                match = UNTAGGED_RE.match(line)
+                if match:
+                    events.add(match.group(1).decode().upper())
+                    # leave IDLE right away so the change is synced within about a second
+                    self._send_done()
+                elif line.startswith(tag):
+                    if not line[len(tag):].strip().upper().startswith(b"OK"):
+                        raise RuntimeError(f"IDLE failed: {line!r}")
+                    return events
+        finally:
+            timer.cancel()
+
+
+_listeners = {}  # name -> IdleListener
+
+
+def start_idle_listener(connect, on_change, name="default"):
+    listener = _listeners.get(name)
+    if listener is None:
+        listener = _listeners[name] = IdleListener(connect, on_change, name=name)
+        listener.start()
+        print(f"Started IMAP IDLE listener for {name}.")
+    return listener
+
+
+def stop_idle_listener(timeout=5):
+    listeners = list(_listeners.values())
+    _listeners.clear()
+    for listener in listeners:
+        listener.stop()
+    for listener in listeners:
+        listener.join(timeout)
@@ -0,0 +1,323 @@
+import os
+import time
+import asyncio
+import imaplib
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from app.metrics import IMAP_CONNECT_SECONDS, IMAP_COMMAND_SECONDS
+from app.accounts import get_account
+from app.ratelimit import RateLimiter
+
+# Pools of authenticated IMAP sessions that already have a mailbox selected,
+# one pool per account (see app/accounts.py). The tools borrow a session,
+# run their commands and hand it back, so a bulk operation pays for one TLS
+# handshake + LOGIN instead of one per email.
+#
+# Every account also has its own threads and its own command rate limit, so
+# a slow or throttled account never holds up the others.
+
+
+class _TimedCommands:
+    """Times every UID command (SEARCH, FETCH, STORE, ...) into imap_command_seconds,
+    after waiting for the account's rate limiter if it has one. Also remembers
+    which folder is selected, so the pool can put a borrowed session back on its own."""
+
+    account = None
+    rate_limiter = None
+    selected_folder = None
+
+    def select(self, mailbox="INBOX", readonly=False):
+        self.selected_folder = None
+        result = super().select(mailbox, readonly)
+        if result[0] == "OK":
+            self.selected_folder = mailbox
+        return result
+
+    def uid(self, command, *args):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = super().uid(command, *args)
+            outcome = "ok" if result[0] == "OK" else "no"
+            return result
+        finally:
+            IMAP_COMMAND_SECONDS.observe(
+                time.perf_counter() - start, account=self.account, command=command.upper(), outcome=outcome
+            )
+
+
+class _IMAP4(_TimedCommands, imaplib.IMAP4):
+    pass
+
+
+class _IMAP4_SSL(_TimedCommands, imaplib.IMAP4_SSL):
+    pass
+
+
+class ImapConnectionPool:
+    def __init__(self, host, user, password, folder="inbox", port=None, use_ssl=True,
+                 max_size=4, noop_after=10.0, timeout=30.0, account="default", rate_limit=0.0):
+        self.account = account
+        self.host = host
+        self.user = user
+        self.password = password
+        self.folder = folder
+        self.port = port
+        self.use_ssl = use_ssl
+        self.max_size = max_size
+        self.noop_after = noop_after  # seconds a session may sit idle before it is checked with NOOP
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit and rate_limit > 0 else None
+
+        self._idle = []  # (connection, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _connect(self, folder=None):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            mail = self._login(folder or self.folder)
+            outcome = "ok"
+            return mail
+        finally:
+            IMAP_CONNECT_SECONDS.observe(time.perf_counter() - start, account=self.account, outcome=outcome)
+
+    def _login(self, folder):
+        if self.use_ssl:
+            mail = _IMAP4_SSL(self.host, self.port or imaplib.IMAP4_SSL_PORT, timeout=self.timeout)
+        else:
+            mail = _IMAP4(self.host, self.port or imaplib.IMAP4_PORT, timeout=self.timeout)
+        mail.account = self.account
+        mail.rate_limiter = self.rate_limiter
+        try:
+            mail.login(self.user, self.password)
+            # servers usually advertise more after authentication than in the greeting
+            status, data = mail.capability()
+            if status == "OK" and data and data[-1]:
+                mail.capabilities = tuple(data[-1].decode().upper().split())
+            if "CONDSTORE" in mail.capabilities and "ENABLE" in mail.capabilities:
+                mail.enable("CONDSTORE")
+            status, _ = mail.select(folder)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"Could not select folder {folder}")
+        except Exception:
+            self._discard(mail)
+            raise
+        return mail
+
+    def open_connection(self, folder=None):
+        """Open a session outside the pool, for long-lived use such as IDLE,
+        with folder (the pool's folder when None) selected."""
+        return self._connect(folder)
+
+    def _is_alive(self, mail):
+        try:
+            status, _ = mail.noop()
+            return status == "OK"
+        except Exception:
+            return False
+
+    def _discard(self, mail):
+        try:
+            mail.logout()
+        except Exception:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                mail, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.noop_after or self._is_alive(mail):
+                return mail
+
+            print("IMAP session went stale, reconnecting...")
+            self._discard(mail)
+
+        return self._connect()
+
+    def _checkin(self, mail):
+        if mail.selected_folder != self.folder:
+            # the borrower moved to another folder; the next one expects the pool's
+            try:
+                status, _ = mail.select(self.folder)
+            except Exception:
+                status = "NO"
+            if status != "OK":
+                self._discard(mail)
+                return
+        with self._lock:
+            if not self._closed:
+                self._idle.append((mail, time.monotonic()))
+                return
+        self._discard(mail)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a logged-in session with the folder selected.
+
+        The borrower may select another folder; the session goes back to the
+        pool's folder when it is returned.
+
+        If the block raises, the session is assumed to be broken and is dropped
+        instead of being returned to the pool.
+        """
+        self._slots.acquire()
+        try:
+            mail = self._checkout()
+            try:
+                yield mail
+            except Exception:
+                self._discard(mail)
+                raise
+            else:
+                self._checkin(mail)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for mail, _ in idle:
+            self._discard(mail)
+
+
+_pools = {}  # account id -> ImapConnectionPool
+_executors = {}  # account id -> ThreadPoolExecutor
+_pool_lock = threading.Lock()
+
+
+def get_pool(account_id=None) -> ImapConnectionPool:
+    """Return the pool of account_id (the first account when None), built on first use.
+
+    IMAP_HOST / IMAP_PORT / IMAP_SSL (or an ACCOUNTS_FILE entry's host, port
+    and ssl) can point a pool at a local server (see app/fakeimap.py)
+    instead of Gmail.
+    """
+    account = get_account(account_id)
+    with _pool_lock:
+        pool = _pools.get(account.id)
+        if pool is None:
+            pool = _pools[account.id] = ImapConnectionPool(
+                host=account.host,
+                user=account.user,
+                password=account.password,
+                folder=account.folders[0],
+                port=account.port,
+                use_ssl=account.use_ssl,
+                max_size=account.pool_size,
+                account=account.id,
+                rate_limit=account.rate_limit,
+            )
+        return pool
+
+
+def account_executor(account_id=None) -> ThreadPoolExecutor:
+    """The threads blocking IMAP work for account_id runs on, one per pooled connection."""
+    account = get_account(account_id)
+    with _pool_lock:
+        executor = _executors.get(account.id)
+        if executor is None:
+            executor = _executors[account.id] = ThreadPoolExecutor(
+                max_workers=account.pool_size, thread_name_prefix=f"imap-{account.id}"
+            )
+        return executor
+
+
+def close_pool():
+    """Drop queued IMAP work, wait for what is running, then log out every pooled session."""
+    global _executor
+    with _pool_lock:
+        pools, executors = list(_pools.values()), list(_executors.values())
+        _pools.clear()
+        _executors.clear()
+        if _executor is not None:
+            executors.append(_executor)
+            _executor = None
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+    for executor in executors:
+        executor.shutdown(wait=True)
+    for pool in pools:
+        pool.close()
+
+
+_executor = None
+
+
+async def run_imap(fn, *args, **kwargs):
+    """Run blocking IMAP work fn(*args, **kwargs) from async code.
+
+    It gets its own threads so a slow server cannot stall the event loop or
+    use up the default executor that store reads and other to_thread calls
+    share. fn may spread its work over the accounts with per_account().
+    """
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("IMAP_POOL_SIZE", "4")), thread_name_prefix="imap"
+            )
+        executor = _executor
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+def per_account(calls) -> list:
+    """Run every (account_id, fn, *args) call on that account's threads and wait for all of them.
+
+    Calls for different accounts run side by side, so one slow account does
+    not delay the rest. Returns the results in call order, with the
+    exception in place of the result of a call that raised. Must not be
+    called from an account thread, which could end up waiting on itself.
+    """
+    if len(calls) == 1:
+        account_id, fn, *args = calls[0]
+        try:
+            return [fn(*args)]
+        except Exception as e:
+            return [e]
+    futures = [account_executor(account_id).submit(fn, *args) for account_id, fn, *args in calls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def to_message_set(ids) -> str:
+    """Collapse ids into an IMAP message set, e.g. [1, 2, 3, 7] -> "1:3,7"."""
+    ids = sorted(set(int(i) for i in ids))
+    ranges = []
+    for i in ids:
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+
+def chunked_message_sets(ids, size=None):
+    """Yield (message_set, ids_in_chunk) covering ids in chunks of at most size.
+
+    One FETCH/STORE per chunk keeps round trips low without building command
+    lines some servers reject for being too long.
+    """
+    size = size or int(os.getenv("IMAP_BATCH_SIZE", "500"))
+    ids = sorted(set(int(i) for i in ids))
+    for start in range(0, len(ids), size):
+        chunk = ids[start:start + size]
+        yield to_message_set(chunk), chunk
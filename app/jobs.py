@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+
+# Background jobs for work too slow for an HTTP request (mailbox fetches,
+# summaries, classifications, enrichment). Endpoints submit a job and return
+# its id at once; JOB_CONCURRENCY workers on the event loop run queued jobs
+# user-initiated first, then background ones, oldest first within a priority.
+#
+# Jobs are kept in SQLite, so they survive a restart: anything queued is
+# still queued, and anything that was running is queued again. Submitting a
+# job identical (same kind and parameters) to one still queued returns that
+# job instead of adding another.
+
+PRIORITIES = {"user": 0, "background": 10}
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    dedup_key   TEXT NOT NULL,
+    priority    INTEGER NOT NULL,
+    status      TEXT NOT NULL,
+    progress    TEXT,
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, priority, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+"""
+COLUMNS = ("id", "kind", "params", "dedup_key", "priority", "status", "progress", "result", "error",
+           "attempts", "created_at", "started_at", "finished_at")
+JSON_COLUMNS = ("params", "progress", "result")
+
+
+def dedup_key(kind, params) -> str:
+    return kind + ":" + json.dumps(params, sort_keys=True, default=str)
+
+
+def priority_name(priority: int) -> str:
+    for name, value in PRIORITIES.items():
+        if value == priority:
+            return name
+    return str(priority)
+
+
+def public(job) -> dict:
+    """The job as endpoints return it."""
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "params": job["params"],
+        "priority": priority_name(job["priority"]),
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+class JobQueue:
+    def __init__(self, path, concurrency=2, retention=7 * 24 * 3600, progress_interval=1.0, on_change=None):
+        """on_change(job), if given, is called with the public view of a job
+        whenever its status changes (and, at most every progress_interval
+        seconds, its progress)."""
+        self.concurrency = concurrency
+        self.retention = retention  # seconds finished jobs are kept; <= 0 keeps them forever
+        self.progress_interval = progress_interval
+        self.on_change = on_change
+        self._handlers = {}
+        self._active = {}  # id -> job, for every queued or running job
+        self._tasks = {}  # id -> asyncio task of a running job
+        self._cancelling = set()
+        self._finished_events = {}  # id -> asyncio.Event for wait()
+        self._workers = []
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._load()
+
+    def _row_to_job(self, row) -> dict:
+        job = dict(zip(COLUMNS, row))
+        for column in JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] is not None else None
+        return job
+
+    def _load(self):
+        with self._lock, self._conn:
+            if self.retention > 0:
+                self._conn.execute(
+                    f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) AND finished_at < ?",
+                    (*FINISHED, time.time() - self.retention),
+                )
+            # a job that was running when the server stopped starts over
+            interrupted = self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE status = 'queued' ORDER BY priority, created_at"
+            ).fetchall()
+        for row in rows:
+            job = self._row_to_job(row)
+            self._active[job["id"]] = job
+        if rows:
+            print(f"Resuming {len(rows)} queued jobs ({interrupted} interrupted by the last shutdown).")
+
+    def _save(self, job):
+        values = [json.dumps(job[c], default=str) if c in JSON_COLUMNS and job[c] is not None else job[c] for c in COLUMNS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                values,
+            )
+
+    def _changed(self, job):
+        if self.on_change:
+            self.on_change(public(job))
+
+    def register(self, kind, handler):
+        """handler(params, progress) is a coroutine function returning the job's
+        JSON-serializable result; it reports progress with progress(done, total).
+        A result dict with an "error" key marks the job failed."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, params=None, priority="user") -> dict:
+        """Queue a job, or return the identical job already waiting (with its
+        priority raised if this submission's is higher). The returned view
+        has "deduplicated" set when an existing job was returned."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'; use one of {', '.join(PRIORITIES)}")
+        params = params or {}
+        key = dedup_key(kind, params)
+        for job in self._active.values():
+            if job["status"] == "queued" and job["dedup_key"] == key:
+                if PRIORITIES[priority] < job["priority"]:
+                    job["priority"] = PRIORITIES[priority]
+                    self._save(job)
+                return dict(public(job), deduplicated=True)
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "dedup_key": key,
+            "priority": PRIORITIES[priority],
+            "status": "queued",
+            "progress": None,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._save(job)
+        self._active[job["id"]] = job
+        self._changed(job)
+        if self._wakeup:
+            self._wakeup.set()
+        return dict(public(job), deduplicated=False)
+
+    def get(self, job_id) -> dict:
+        job = self._active.get(job_id)
+        if job:
+            return public(job)
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return public(self._row_to_job(row)) if row else None
+
+    def list(self, status=None, limit=50) -> list:
+        """Most recent jobs first, optionally only those with the given status; results are left out."""
+        query = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+        args = []
+        if status:
+            query += " WHERE status = ?"
+            args.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        jobs = []
+        for row in rows:
+            job = self._active.get(row[0]) or self._row_to_job(row)
+            jobs.append(dict(public(job), result=None))
+        return jobs
+
+    def cancel(self, job_id) -> dict:
+        """Cancel a queued or running job. Returns the job (unchanged if it had
+        already finished), or None if there is no such job. A running job
+        shows "cancelled" once its task has stopped."""
+        job = self._active.get(job_id)
+        if job is None:
+            return self.get(job_id)
+        if job["status"] == "queued":
+            self._finish(job, "cancelled")
+        else:
+            self._cancelling.add(job_id)
+            self._tasks[job_id].cancel()
+        return public(job)
+
+    async def wait(self, job_id) -> dict:
+        """The job once it has finished."""
+        if job_id in self._active:
+            event = self._finished_events.setdefault(job_id, asyncio.Event())
+            await event.wait()
+        return self.get(job_id)
+
+    def _finish(self, job, status, result=None, error=None):
+        job.update(status=status, result=result, error=error, finished_at=time.time())
+        self._save(job)
+        self._active.pop(job["id"], None)
+        self._changed(job)
+        event = self._finished_events.pop(job["id"], None)
+        if event:
+            event.set()
+
+    def _next(self):
+        queued = [job for job in self._active.values() if job["status"] == "queued"]
+        return min(queued, key=lambda job: (job["priority"], job["created_at"]), default=None)
+
+    def _progress_reporter(self, job):
+        last_saved = 0.0
+
+        def progress(done, total=None):
+            nonlocal last_saved
+            job["progress"] = {"done": done, "total": total}
+            now = time.monotonic()
+            if now - last_saved >= self.progress_interval or done == total:
+                last_saved = now
+                self._save(job)
+                self._changed(job)
+
+        return progress
+
+    async def _run(self, job):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            self._finish(job, "failed", error=f"No handler for job kind '{job['kind']}'")
+            return
+        job.update(status="running", started_at=time.time(), attempts=job["attempts"] + 1)
+        self._save(job)
+        self._changed(job)
+        task = asyncio.create_task(handler(job["params"], self._progress_reporter(job)))
+        self._tasks[job["id"]] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if job["id"] not in self._cancelling:
+                raise  # shutting down: the job stays "running" and is queued again on the next start
+            self._finish(job, "cancelled")
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) FAILED:", e)
+            self._finish(job, "failed", error=str(e))
+        else:
+            error = result.get("error") if isinstance(result, dict) else None
+            self._finish(job, "failed" if error else "done", result=result, error=error)
+        finally:
+            self._tasks.pop(job["id"], None)
+            self._cancelling.discard(job["id"])
+
+    async def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job["status"] = "running"  # claimed before the next await so no other worker takes it
+            await self._run(job)
+
+    def start(self):
+        """Start the workers on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers + list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_queue(on_change=None) -> JobQueue:
+    return JobQueue(
+        os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(__file__), "../jobs.db")),
+        concurrency=int(os.getenv("JOB_CONCURRENCY", "2")),
+        retention=float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600))),
+        on_change=on_change,
+    )
@@ -0,0 +1,205 @@
+import os
+import json
+import asyncio
+import time
+import httpx
+from app.metrics import LLM_REQUEST_SECONDS, LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS
+from app.tracing import span
+
+# Calls to the OpenAI-compatible chat endpoint at LMSTUDIO_URL, plus the
+# prompts the email tools send through it.
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You are an email summarization assistant. "
+    "You will be given an email. "
+    "Summarize the main content of the email."
+    "If unable to summarize - DO NOT speculate. Just state 'The content could not be understood.' "
+    "Otherwise, summarize the key points in 2-3 sentences."
+)
+
+
+class LlmError(Exception):
+    def __init__(self, message, status_code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+_client = None
+_client_loop = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for the running event loop.
+
+    LLM_MAX_CONNECTIONS caps concurrent connections to the model server;
+    LLM_TIMEOUT bounds each read (generation can be slow), LLM_CONNECT_TIMEOUT
+    the connection setup.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop or _client.is_closed:
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "8"))
+        _client = httpx.AsyncClient(
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(
+                float(os.getenv("LLM_TIMEOUT", "120")),
+                connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "10")),
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+async def chat_completion(messages, max_tokens=150, temperature=0, task="chat") -> str:
+    """Send one chat completion request and return the reply text ("" if the model sent none).
+
+    Raises LlmError; `retryable` is set for connection problems, timeouts,
+    rate limiting (429) and server errors (5xx). Cancelling the awaiting task
+    aborts the request. `task` labels the request's metrics and its span in the agent trace.
+    """
+    with span(f"llm {task}", "llm", task=task, max_tokens=max_tokens) as attributes:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            try:
+                response = await get_client().post(
+                    os.environ["LMSTUDIO_URL"],
+                    json={
+                        "model": os.environ["OPENAI_MODEL"],
+                        "messages": messages,
+                        "temperature": temperature,
+                        "max_tokens": max_tokens,
+                    },
+                )
+            except httpx.HTTPError as e:
+                raise LlmError(f"LLM request failed: {e!r}", retryable=True) from e
+
+            if not response.is_success:
+                outcome = str(response.status_code)
+                raise LlmError(
+                    f"LLM returned {response.status_code}: {response.text[:500]}",
+                    status_code=response.status_code,
+                    retryable=response.status_code == 429 or response.status_code >= 500,
+                )
+            outcome = "ok"
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, task=task, outcome=outcome)
+
+        result = response.json()
+        usage = result.get("usage") or {}
+        attributes["prompt_tokens"] = usage.get("prompt_tokens") or 0
+        attributes["completion_tokens"] = usage.get("completion_tokens") or 0
+    LLM_PROMPT_TOKENS.inc(attributes.get("prompt_tokens", 0), task=task)
+    LLM_COMPLETION_TOKENS.inc(attributes.get("completion_tokens", 0), task=task)
+    content = result.get("choices", [{}])[0].get("message", {}).get("content")
+    return (content or "").strip()
+
+
+def summary_messages(body: str) -> list:
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Summarize the following email:\n\n{body}"}
+    ]
+
+
+def summary_reduce_messages(partial_summaries) -> list:
+    """Combine summaries of consecutive parts of one long email into a single summary."""
+    parts = "\n\n".join(f"Part {i}: {summary}" for i, summary in enumerate(partial_summaries, 1))
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"The following are summaries of consecutive parts of one long email. "
+                                    f"Summarize the email as a whole:\n\n{parts}"}
+    ]
+
+
+def classification_prompt(categories) -> str:
+    category_list = ", ".join(f'"{c}"' for c in categories)
+    return f"""
+    You are an AI assistant that classifies emails.
+    Classify the email into:
+    - \"priority\": either \"important\" or \"not important\"
+    - \"category\": one of the following: {category_list}
+
+    Return your response in JSON format like:
+    {{
+      \"priority\": \"important\",
+      \"category\": \"work\"
+    }}
+    """
+
+
+def classification_messages(body: str, categories) -> list:
+    return [
+        {"role": "system", "content": "You are an email classification assistant."},
+        {"role": "user", "content": classification_prompt(categories) + "\n\n" + body}
+    ]
+
+
+def enrichment_messages(body: str, categories) -> list:
+    """One request that asks for the summary and the classification together."""
+    category_list = ", ".join(f'"{c}"' for c in categories)
+    prompt = f"""
+    You are an AI assistant that summarizes and classifies emails.
+    For the email below, return:
+    - \"summary\": the key points in 2-3 sentences. If unable to summarize - DO NOT speculate. Just state 'The content could not be understood.'
+    - \"priority\": either \"important\" or \"not important\"
+    - \"category\": one of the following: {category_list}
+
+    Return your response in JSON format like:
+    {{
+      \"summary\": \"The sender asks to move Friday's review to Monday.\",
+      \"priority\": \"important\",
+      \"category\": \"work\"
+    }}
+    """
+    return [
+        {"role": "system", "content": "You are an email summarization and classification assistant."},
+        {"role": "user", "content": prompt + "\n\n" + body}
+    ]
+
+
+def parse_json_object(content: str) -> dict:
+    """Pull the outermost {...} out of a model reply and parse it. Raises ValueError."""
+    if not content:
+        raise ValueError("empty model reply")
+    start = content.index("{")
+    end = content.rindex("}") + 1
+    parsed = json.loads(content[start:end])
+    if not isinstance(parsed, dict):
+        raise ValueError("model reply is not a JSON object")
+    return parsed
+
+
+PRIORITIES = ("important", "not important")
+
+
+def validate_classification(parsed: dict, categories) -> dict:
+    """Normalize priority/category from a parsed reply. Raises ValueError when
+    either is missing or not one of the allowed values."""
+    priority = str(parsed.get("priority") or "").strip().lower()
+    category = str(parsed.get("category") or "").strip().lower()
+    allowed = {c.lower(): c for c in categories}
+    if priority not in PRIORITIES:
+        raise ValueError(f"invalid priority {parsed.get('priority')!r}")
+    if category not in allowed:
+        raise ValueError(f"invalid category {parsed.get('category')!r}")
+    return {"priority": priority, "category": allowed[category]}
+
+
+def parse_enrichment(content: str, categories) -> dict:
+    """Parse a reply to enrichment_messages into {"summary", "classification"}. Raises ValueError."""
+    parsed = parse_json_object(content)
+    summary = str(parsed.get("summary") or "").strip()
+    if not summary:
+        raise ValueError("reply has no summary")
+    return {"summary": summary, "classification": validate_classification(parsed, categories)}
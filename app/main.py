@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException, status, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, status, Query, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
-from app.tools import fetch_emails, get_stored_emails, stored_emails, remove_email, classify_email, summarize_email, mark_as_read, unmark_as_read
-from app.agent import build_agent
+from app.tools import sync_folder, load_mailbox_syncs, fetch_emails, get_stored_emails, email_store, email_index, remove_email, classify_email, summarize_email, mark_as_read, unmark_as_read, mark_emails_as_read, unmark_emails_as_read, enrichment, llm_cache, email_changes, get_emails_by_uids
+from app.enrich import summarize_results
+import json
+import hashlib
+from app.agent import build_agent, AgentMetrics
+from app.metrics import Counter, Gauge, render as render_metrics, AGENT_STEPS, AGENT_REQUEST_SECONDS, HTTP_REQUEST_SECONDS
+from app.imap import get_pool, close_pool, run_imap
+from app.accounts import get_accounts, check_account
+from app.llm import close_client
+from app.parsing import close_parse_pool
+from app.idle import start_idle_listener, stop_idle_listener
+from app.events import broker
+from app.history import ChatSessions
+from app.tracing import AgentTrace, close_exporter
+from app.jobs import create_job_queue
+import asyncio
+import functools
+import threading
+import time
 from langchain.schema import AIMessage
-from typing import List
+from typing import List, Optional
 
 #run with uvicorn app.main:app --reload --port 9119
 
@@ -14,7 +32,97 @@ load_dotenv()
 
 app = FastAPI()
 graph = build_agent()
-chatHistory = []
+chat_sessions = ChatSessions() #per-session history, compacted to AGENT_HISTORY_TOKEN_BUDGET
+jobs = create_job_queue(on_change=lambda job: broker.publish("job", {k: v for k, v in job.items() if k != "result"}))
+
+async def fetch_job(params, progress):
+    return await run_imap(fetch_emails.invoke, params)  # {"account": ...} or every account
+
+async def enrich_job(params, progress):
+    uids = params.get("uids")
+    if uids is None:
+        uids = await asyncio.to_thread(email_store.unprocessed_uids, params.get("account"))
+    progress(0, len(uids))
+    return summarize_results(await enrichment.run(uids, on_progress=lambda result, done, total: progress(done, total)))
+
+async def summarize_job(params, progress):
+    return await summarize_email.ainvoke({"uid": params["uid"]})
+
+async def classify_job(params, progress):
+    return await classify_email.ainvoke({"uid": params["uid"]})
+
+jobs.register("fetch", fetch_job)
+jobs.register("enrich", enrich_job)
+jobs.register("summarize", summarize_job)
+jobs.register("classify", classify_job)
+
+# read when /metrics is scraped
+Gauge("emails_stored", "Emails in the store.", collect=email_store.count)
+Gauge("llm_cache_entries", "Entries in the LLM result cache.", collect=lambda: llm_cache.stats()["entries"])
+def llm_cache_lookups():
+    stats = llm_cache.stats()
+    return [
+        ({"kind": kind, "result": result}, count)
+        for result, counts in (("hit", stats["hits"]), ("miss", stats["misses"]))
+        for kind, count in counts.items()
+    ]
+
+Counter("llm_cache_lookups", "LLM result cache lookups by kind and result.", ["kind", "result"], collect=llm_cache_lookups)
+Gauge("llm_cache_hit_ratio", "Share of LLM cache lookups answered from the cache, by kind.", ["kind"], collect=lambda: [
+    ({"kind": kind}, ratio) for kind, ratio in llm_cache.stats()["hit_rate"].items()
+])
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method, route=route.path if route else "unmatched", status=response.status_code,
+    )
+    return response
+
+def on_mailbox_change(account_id, folder, events):
+    changes = sync_folder(account_id, folder, check_expunged="EXPUNGE" in events)
+    if changes["new"] or changes["updated"] or changes["removed"]:
+        print(f"Mailbox {account_id}/{folder} changed: {len(changes['new'])} new, {len(changes['updated'])} updated, {len(changes['removed'])} removed")
+        broker.publish("emails", {
+            "account": account_id,
+            "new": [e["uid"] for e in changes["new"]],
+            "updated": changes["updated"],
+            "removed": changes["removed"],
+        })
+
+@app.on_event("startup")
+async def start_background_sync():
+    broker.bind(asyncio.get_running_loop())
+    jobs.start()
+    # build the search index off the request path; queries wait for it if they arrive first
+    threading.Thread(target=email_index.ensure_built, name="search-index", daemon=True).start()
+    await asyncio.to_thread(load_mailbox_syncs)
+    if os.getenv("IMAP_IDLE", "true").lower() in ("true", "1", "yes"):
+        # IDLE watches one folder per session, so every synced folder gets its own listener
+        for account in get_accounts().values():
+            for folder in account.folders:
+                start_idle_listener(
+                    functools.partial(get_pool(account.id).open_connection, folder),
+                    functools.partial(on_mailbox_change, account.id, folder),
+                    name=f"{account.id}/{folder}",
+                )
+
+@app.on_event("shutdown")
+async def shutdown():
+    # one handler, so nothing is closed under a job that is still running
+    await jobs.stop()  # running jobs are queued again on the next start
+    stop_idle_listener()
+    await asyncio.to_thread(close_pool)  # lets IMAP work of a cancelled job finish before the store closes
+    email_store.close()
+    llm_cache.close()
+    close_parse_pool()
+    close_exporter()
+    jobs.close()
+    await close_client()
 
 def print_stream(stream):
     for s in stream:
@@ -26,42 +134,134 @@ def print_stream(stream):
 
 class AgentPrompt(BaseModel):
     user_input: str
+    session_id: str = "default"
+    stream: bool = False  # server-sent events: tokens and tool calls as they happen, then the usual response
+
+class UidList(BaseModel):
+    uids: List[int]
+
+class EmailLookup(BaseModel):
+    uids: List[int]
+    fields: Optional[List[str]] = None  # None: every field, bodies included
+
+class EnrichRequest(BaseModel):
+    uids: Optional[List[int]] = None  # None: every email (of account, if given) missing a summary or classification
+    account: Optional[str] = None
+    stream: bool = False
+    priority: str = "user"
+    wait: bool = False
+
+async def queue_job(kind, params=None, priority="user", wait=False):
+    """Submit a job and answer 202 with it, or with wait, answer once it has
+    finished with its result (the endpoint's response from before jobs)."""
+    try:
+        job = jobs.submit(kind, params, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not wait:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=job, headers={"Location": f"/jobs/{job['id']}"})
+    job = await jobs.wait(job["id"])
+    if job["result"] is not None:
+        return job["result"]
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT if job["status"] == "cancelled" else 500, content=job)
+
+def agent_response(new_messages, trace=None):
+    #get tool calls
+    last_calls = []
+    for msg in new_messages:
+        if isinstance(msg, AIMessage):
+            tc = msg.additional_kwargs.get("tool_calls") or []
+            last_calls.extend(tc)
+
+    return {
+        "agent_message": new_messages[-1],
+        "tool_calls" : last_calls,
+        "trace_id": trace.trace_id if trace else None,
+    }
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def agent_events(request: AgentPrompt):
+    """The agent run as server-sent events:
+    start, token {content}, tool_start {id, name, input}, tool_end {id, name, output},
+    then done with the same body the non-streaming call returns (or error {error})."""
+    async with chat_sessions.lock(request.session_id):
+        yield sse("start", {"session_id": request.session_id})
+        history = chat_sessions.messages(request.session_id)
+        state = None
+        metrics = AgentMetrics()
+        trace = AgentTrace("promptAgent", session_id=request.session_id, stream=True, history_messages=len(history))
+        start = time.perf_counter()
+        try:
+            with trace.activate():
+                async for event in graph.astream_events({
+                    "messages": history + [("user", request.user_input)],
+                }, version="v2", config={"callbacks": [metrics, trace]}):
+                    kind = event["event"]
+                    if kind == "on_chat_model_stream":
+                        content = event["data"]["chunk"].content
+                        if content:
+                            yield sse("token", {"content": content})
+                    elif kind == "on_tool_start":
+                        yield sse("tool_start", {"id": event["run_id"], "name": event["name"], "input": event["data"].get("input")})
+                    elif kind == "on_tool_end":
+                        output = event["data"].get("output")
+                        yield sse("tool_end", {"id": event["run_id"], "name": event["name"], "output": getattr(output, "content", output)})
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        state = event["data"]["output"]  # the graph's final state
+        except Exception as e:
+            print("API Error from agent stream:", e)
+            AGENT_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            trace.finish(e)
+            yield sse("error", {"error": str(e), "trace_id": trace.trace_id})
+            return
+        AGENT_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+        AGENT_STEPS.observe(metrics.steps)
+        trace.finish()
+
+        if not state or not state.get("messages"):
+            yield sse("error", {"error": "Agent finished without a response."})
+            return
+        new_messages = state["messages"][len(history):]
+        chat_sessions.append(request.session_id, new_messages)
+
+    yield sse("done", agent_response(new_messages, trace))
 
 @app.post("/promptAgent")
 async def prompt_agent(request: AgentPrompt):
-    global chatHistory
     global graph
 
-    try:
-        state = await graph.ainvoke({
-            "messages": chatHistory + [("user", request.user_input)],
-        })
-
-        before_len = len(chatHistory)
-        new_messages = state["messages"][before_len:]
-        chatHistory = state["messages"]
+    if request.stream:
+        return StreamingResponse(agent_events(request), media_type="text/event-stream")
 
-        msgs = state["messages"]
+    metrics = AgentMetrics()
+    trace = AgentTrace("promptAgent", session_id=request.session_id, stream=False)
+    start = time.perf_counter()
+    try:
+        async with chat_sessions.lock(request.session_id):
+            history = chat_sessions.messages(request.session_id)
+            trace.root["attributes"]["history_messages"] = len(history)
+            with trace.activate():
+                state = await graph.ainvoke({
+                    "messages": history + [("user", request.user_input)],
+                }, config={"callbacks": [metrics, trace]})
+            AGENT_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+            AGENT_STEPS.observe(metrics.steps)
+            trace.finish()
 
-        #get tool calls
-        last_calls = []
-        for msg in new_messages:
-            if isinstance(msg, AIMessage):
-                tc = msg.additional_kwargs.get("tool_calls") or []
-                last_calls.extend(tc)  
+            new_messages = state["messages"][len(history):]
+            chat_sessions.append(request.session_id, new_messages)
 
-        print("API Agent State Response:", state)
-        return {
-            "agent_message": msgs[-1],
-            "tool_calls" : last_calls
-        }
+        print(f"Agent run {trace.trace_id}: {metrics.steps} model calls in {trace.duration:.2f}s")
+        return agent_response(new_messages, trace)
     
     # except RecursionLimitError as e:
     #     # e.messages is the list of all messages up to the failure
     #     partial = e.messages  
     #     # figure out which ones are “new”
-    #     new_messages = partial[len(chatHistory):]
-    #     chatHistory = partial
+    #     new_messages = partial[len(history):]
+    #     chat_sessions.append(request.session_id, new_messages)
 
     #     #get tool calls
     #     last_calls = []
@@ -79,6 +279,8 @@ async def prompt_agent(request: AgentPrompt):
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
+        AGENT_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="error")
+        trace.finish(e)
 
         print("API Error from agent:", e)
         print("Error details:", e.__class__.__module__, e.__class__.__name__)
@@ -87,51 +289,178 @@ async def prompt_agent(request: AgentPrompt):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={
                 "error": str(e),
-                "trace": error_trace
+                "trace": error_trace,
+                "trace_id": trace.trace_id,
             }
         )
 
+@app.post("/resetChat")
+async def reset_chat(session_id: str = "default"):
+    """Forget a session's history and start the next prompt fresh."""
+    await chat_sessions.reset(session_id)
+    return {"session_id": session_id}
+
+@app.get("/events")
+async def stream_events():
+    """Server-sent events; an `emails` event carries the account and the UIDs that were added, updated or removed."""
+    return StreamingResponse(broker.stream(), media_type="text/event-stream")
+
+@app.get("/metrics")
+async def get_metrics():
+    """Stage timings, LLM tokens, tool and agent counters, store and cache size, in the Prometheus text format."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/llmCacheStats")
+async def get_llm_cache_stats():
+    """Entries and per-kind hit/miss counts of the LLM result cache."""
+    return llm_cache.stats()
+
+@app.get("/jobs")
+async def list_jobs(
+    job_status: Optional[str] = Query(None, alias="status", description="queued, running, done, failed or cancelled"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Recent jobs, newest first, without their results."""
+    return await asyncio.to_thread(jobs.list, job_status, limit)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress {done, total} and, once finished, the result or error of a job."""
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job
+
+@app.get("/accounts")
+async def get_mail_accounts():
+    """The configured mail accounts and their folders."""
+    return [account.public() for account in get_accounts().values()]
+
+def checked_account(account):
+    try:
+        check_account(account)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return account
+
 @app.post("/fetchEmails")
-async def trigger_fetch_emails():
-    return await fetch_emails.ainvoke({})
+async def trigger_fetch_emails(account: Optional[str] = None, priority: str = "user", wait: bool = False):
+    """Queue a fetch of every account (or only `account`); wait=true answers with the fetch result instead of the job."""
+    return await queue_job("fetch", {"account": checked_account(account)} if account else {}, priority, wait)
 
 @app.get("/getStoredEmails")
-async def trigger_get_stored_emails():
-    return get_stored_emails()
+async def trigger_get_stored_emails(
+    fields: Optional[str] = Query(None, description="Comma-separated fields, e.g. uid,subject,sender,isRead,classification; bodies only when listed"),
+    sort: str = Query("uid", description="uid, date, -uid or -date"),
+    limit: Optional[int] = Query(None, ge=1, description="Page size; the response then carries next_cursor"),
+    cursor: Optional[str] = None,
+    since: Optional[str] = Query(None, description="version from an earlier page; only emails changed after it are returned"),
+    account: Optional[str] = Query(None, description="Only emails of this account"),
+    if_none_match: Optional[str] = Header(None),
+):
+    # a response is fully determined by the store version and the query
+    version = email_changes.version
+    etag = 'W/"' + hashlib.sha1(f"{version}|{fields}|{sort}|{limit}|{cursor}|{since}|{account}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "X-Email-Version": version}
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        result = await asyncio.to_thread(get_stored_emails, field_list, sort, limit, cursor, since, account)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=result, headers=headers)
 
 @app.get("/getStoredEmailsWithUIDs")
-async def get_stored_emails_with_uids(uids: List[int] = Query(..., description="One or more email UIDs to fetch, e.g. ?uids=101&uids=30558")):
-    return [
-        email_obj
-        for uid, email_obj in stored_emails.items()
-        if uid in uids
-    ]
+async def get_stored_emails_with_uids(
+    uids: List[int] = Query(..., description="One or more email UIDs to fetch, e.g. ?uids=101&uids=30558"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields; every field when left out"),
+):
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        return await asyncio.to_thread(get_emails_by_uids, uids, field_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/getStoredEmailsWithUIDs")
+async def post_stored_emails_with_uids(request: EmailLookup):
+    """Same as the GET, for UID sets too large for a query string."""
+    try:
+        return await asyncio.to_thread(get_emails_by_uids, request.uids, request.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/removeEmail")
 async def trigger_remove_email(uid: int):
-    return await remove_email.ainvoke({})
+    return await asyncio.to_thread(remove_email.invoke, {"uid": uid})
 
 @app.get("/getEmailById") #not yet tested
 async def get_email_by_id(uid: int):
-    emails = get_stored_emails()
-    for email_obj in emails:
-        if email_obj.get("uid") == uid:
-            return email_obj
+    email_obj = await asyncio.to_thread(email_store.get, uid)
+    if email_obj:
+        return email_obj
 
     raise HTTPException(status_code=404, detail=f"No email found with UID {uid}")
 
 @app.get("/classifyEmail")
-async def trigger_classify_email(uid: int):
-    return await classify_email.ainvoke({"uid": uid})
+async def trigger_classify_email(uid: int, priority: str = "user", wait: bool = False):
+    return await queue_job("classify", {"uid": uid}, priority, wait)
 
 @app.get("/summarizeEmail")
-async def trigger_summarize_email(uid: int):
-    return await summarize_email.ainvoke({"uid": uid})
+async def trigger_summarize_email(uid: int, priority: str = "user", wait: bool = False):
+    return await queue_job("summarize", {"uid": uid}, priority, wait)
+
+@app.post("/enrichEmails")
+async def trigger_enrich_emails(request: EnrichRequest):
+    """Queue enrichment of request.uids (every unprocessed email when left out).
+    With stream, progress is sent as server-sent events from this request instead."""
+    checked_account(request.account)
+    if not request.stream:
+        if request.uids is not None:
+            params = {"uids": sorted(set(request.uids))}
+        else:
+            params = {"uids": None, "account": request.account} if request.account else {"uids": None}
+        return await queue_job("enrich", params, request.priority, request.wait)
+
+    uids = request.uids if request.uids is not None else await asyncio.to_thread(email_store.unprocessed_uids, request.account)
+
+    async def progress_events():
+        queue = asyncio.Queue()
+
+        async def report(result, done, total):
+            await queue.put(f"event: progress\ndata: {json.dumps({**result, 'done': done, 'total': total})}\n\n")
+
+        run = asyncio.create_task(enrichment.run(uids, on_progress=report))
+        run.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (message := await queue.get()) is not None:
+                yield message
+            yield f"event: done\ndata: {json.dumps(summarize_results(run.result()))}\n\n"
+        finally:
+            run.cancel()
+
+    return StreamingResponse(progress_events(), media_type="text/event-stream")
 
 @app.get("/markAsRead")
 async def trigger_mark_as_read(uid: int):
-    return await mark_as_read.ainvoke({"uid": uid})
+    return await run_imap(mark_as_read.invoke, {"uid": uid})
 
 @app.get("/unmarkAsRead")
 async def trigger_unmark_as_read(uid: int):
-    return await unmark_as_read.ainvoke({"uid": uid})
\ No newline at end of file
+    return await run_imap(unmark_as_read.invoke, {"uid": uid})
+
+@app.post("/markAsRead")
+async def trigger_mark_emails_as_read(request: UidList):
+    return await run_imap(mark_emails_as_read.invoke, {"uids": request.uids})
+
+@app.post("/unmarkAsRead")
+async def trigger_unmark_emails_as_read(request: UidList):
+    return await run_imap(unmark_emails_as_read.invoke, {"uids": request.uids})
\ No newline at end of file
@@ -0,0 +1,234 @@
+import math
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# In-process counters, gauges and histograms, served by GET /metrics in the
+# Prometheus text exposition format. An observation is a dict update under a
+# per-metric lock (about a microsecond), so the hooks stay on in production.
+# Counters and gauges may take a `collect` callback that is read at scrape
+# time instead of being kept up to date.
+#
+# Parse workers are separate processes: parse_messages drains their
+# histograms after every batch and merges them into this process (see
+# Histogram.drain / merge).
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, math.inf)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY, collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect  # callable returning a number or (labels dict, value) pairs
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels) -> tuple:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _labelled(self, key, extra=()) -> tuple:
+        return tuple(zip(self.labels, key)) + tuple(extra)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _current(self) -> list:
+        if self.collect is None:
+            with self._lock:
+                return list(self._values.items())
+        try:
+            collected = self.collect()
+        except Exception as e:
+            print(f"Metric {self.name} could not be collected:", e)
+            return []
+        if isinstance(collected, (int, float)):
+            collected = [({}, collected)]
+        return [(self._key(labels), value) for labels, value in collected]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._current():
+            yield self.name + "_total", self._labelled(key), value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        for key, value in self._current():
+            yield self.name, self._labelled(key), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the block took, whether or not it raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def drain(self) -> dict:
+        """Take (and reset) the observations so far, for merge() in another process."""
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", self._labelled(key, [("le", _format_value(float(bound)))]), cumulative
+            yield self.name + "_sum", self._labelled(key), total
+            yield self.name + "_count", self._labelled(key), count
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# Pipeline stages
+
+IMAP_CONNECT_SECONDS = Histogram(
+    "imap_connect_seconds", "Opening an IMAP session: connect, TLS, LOGIN and SELECT.", ["account", "outcome"])
+IMAP_COMMAND_SECONDS = Histogram(
+    "imap_command_seconds", "IMAP UID commands (SEARCH, FETCH, STORE) by account and command.", ["account", "command", "outcome"])
+EMAIL_PARSE_SECONDS = Histogram(
+    "email_parse_seconds", "Turning one fetched message into an email record (MIME parse and HTML clean).")
+HTML_CLEAN_SECONDS = Histogram(
+    "html_clean_seconds", "Cleaning one email body to plain text.")
+EMAILS_PARSED = Counter(
+    "emails_parsed", "Messages turned into email records.")
+
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds", "Chat completion requests to LMSTUDIO_URL.", ["task", "outcome"])
+LLM_PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens", "Prompt tokens reported by the model server.", ["task"])
+LLM_COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens", "Completion tokens reported by the model server.", ["task"])
+
+TOOL_SECONDS = Histogram(
+    "agent_tool_seconds", "Agent tool invocations by tool, from the agent or an endpoint/job.", ["tool", "outcome"])
+AGENT_STEPS = Histogram(
+    "agent_steps", "Model calls the agent made per /promptAgent request.", buckets=COUNT_BUCKETS)
+AGENT_REQUEST_SECONDS = Histogram(
+    "agent_request_seconds", "Whole /promptAgent runs.", ["outcome"])
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API requests by route until the response starts.", ["method", "route", "status"])
@@ -0,0 +1,195 @@
+import re
+import quopri
+import base64
+import binascii
+
+# Just enough of the IMAP response grammar to read BODYSTRUCTURE and body
+# section FETCH responses, so messages can be downloaded part by part
+# instead of as one BODY[] literal.
+
+TOKEN_RE = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}\s*$|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))'
+)
+
+
+OPEN = object()
+CLOSE = object()
+
+
+def _tokens(data):
+    """Tokens of an imaplib FETCH response.
+
+    data is the list imaplib returns: bytes lines, and (prefix, literal)
+    tuples whose prefix ends in {size}. Yields OPEN / CLOSE markers, str for
+    atoms and quoted strings, None for NIL and bytes for literals.
+    """
+    for item in data or []:
+        if item is None:
+            continue
+        prefix, literal = item if isinstance(item, tuple) else (item, None)
+        pos = 0
+        while pos < len(prefix):
+            match = TOKEN_RE.match(prefix, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            open_paren, close_paren, quoted, size, atom = match.groups()
+            if open_paren:
+                yield OPEN
+            elif close_paren:
+                yield CLOSE
+            elif quoted is not None:
+                yield re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", errors="replace")
+            elif size is not None:
+                yield literal if literal is not None else b""
+                literal = None
+            elif atom.upper() == b"NIL":
+                yield None
+            else:
+                yield atom.decode("ascii", errors="replace")
+
+
+class _List(list):
+    pass
+
+
+def _nest(tokens):
+    """Turn the token stream into nested lists, one top-level item per token/list."""
+    stack = [[]]
+    for token in tokens:
+        if token is OPEN:
+            stack.append(_List())
+        elif token is CLOSE and len(stack) > 1:
+            done = stack.pop()
+            stack[-1].append(done)
+        elif token is not CLOSE:
+            stack[-1].append(token)
+    while len(stack) > 1:  # tolerate a truncated response
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_response(data) -> list:
+    """Parse `FETCH` untagged responses into [{ITEM: value, ...}, ...], one dict per message.
+
+    Item names are upper-cased as sent, e.g. "UID", "BODYSTRUCTURE", "BODY[1]<0>".
+    """
+    items = _nest(_tokens(data))
+    messages = []
+    for i, item in enumerate(items):
+        # "<seq> (<item> <value> ...)"
+        if isinstance(item, _List) and i > 0 and isinstance(items[i - 1], str) and items[i - 1].isdigit():
+            pairs = {}
+            for j in range(0, len(item) - 1, 2):
+                key = item[j]
+                if isinstance(key, str):
+                    pairs[key.upper()] = item[j + 1]
+            messages.append(pairs)
+    return messages
+
+
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value or ""
+
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {
+        _text(value[i]).lower(): _text(value[i + 1])
+        for i in range(0, len(value) - 1, 2)
+        if isinstance(value[i], (str, bytes)) and isinstance(value[i + 1], (str, bytes))
+    }
+
+
+def parse_bodystructure(structure, section="") -> list:
+    """Flatten a parsed BODYSTRUCTURE into its leaf parts.
+
+    Each part is {"section", "type", "subtype", "params", "encoding", "size",
+    "disposition", "filename"}; section is the number to pass to BODY[...].
+    Attached messages (message/rfc822) are reported as a single part.
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        # multipart: (part)(part)... "subtype" [extension data]
+        parts = []
+        number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            number += 1
+            parts.extend(parse_bodystructure(child, f"{section}.{number}" if section else str(number)))
+        return parts
+
+    main_type = _text(structure[0]).lower()
+    subtype = _text(structure[1]).lower() if len(structure) > 1 else ""
+    params = _params(structure[2]) if len(structure) > 2 else {}
+    encoding = _text(structure[5]).lower() if len(structure) > 5 else "7bit"
+    try:
+        size = int(structure[6]) if len(structure) > 6 else 0
+    except (TypeError, ValueError):
+        size = 0
+
+    # extension data starts after the type-specific basic fields
+    if main_type == "text":
+        extension_at = 8
+    elif main_type == "message" and subtype == "rfc822":
+        extension_at = 10
+    else:
+        extension_at = 7
+    disposition, filename = None, None
+    if len(structure) > extension_at + 1 and isinstance(structure[extension_at + 1], list):
+        dsp = structure[extension_at + 1]
+        disposition = _text(dsp[0]).lower() if dsp else None
+        filename = _params(dsp[1] if len(dsp) > 1 else None).get("filename")
+    filename = filename or params.get("name")
+
+    return [{
+        "section": section or "1",
+        "type": main_type,
+        "subtype": subtype,
+        "params": params,
+        "encoding": encoding,
+        "size": size,
+        "disposition": disposition,
+        "filename": filename,
+    }]
+
+
+def is_attachment(part) -> bool:
+    if part["disposition"] == "attachment":
+        return True
+    if part["type"] == "text" and part["subtype"] in ("plain", "html"):
+        return False
+    # inline images, calendar invites, attached messages... anything we will not read as the body
+    return True
+
+
+def attachment_metadata(part) -> dict:
+    return {
+        "name": part["filename"],
+        "size": part["size"],
+        "type": f"{part['type']}/{part['subtype']}",
+    }
+
+
+def decode_part(data: bytes, encoding: str, charset: str = None) -> str:
+    """Decode a body section fetched with BODY[n]. Tolerates payloads cut off by a partial fetch."""
+    encoding = (encoding or "").lower()
+    try:
+        if encoding == "base64":
+            data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+            data = base64.b64decode(data[: len(data) - len(data) % 4])
+        elif encoding == "quoted-printable":
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+    try:
+        return data.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
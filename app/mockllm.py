@@ -0,0 +1,103 @@
+import re
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Minimal OpenAI-compatible chat completions server for exercising the LLM
+# code paths without a model. Replies follow the shape each prompt in
+# app/llm.py asks for (plain summary, classification JSON, or both), and
+# every request waits latency +/- jitter seconds to stand in for generation.
+#
+# run with python -m app.mockllm [latency_seconds], then start the API with
+#   LMSTUDIO_URL=http://127.0.0.1:1234/v1/chat/completions
+
+CATEGORIES_RE = re.compile(r"one of the following: (.+)")
+QUOTED_RE = re.compile(r'"([^"]+)"')
+
+
+def _reply(messages) -> str:
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    categories = CATEGORIES_RE.search(prompt)
+    names = QUOTED_RE.findall(categories.group(1)) if categories else []
+    category = names[0] if names else "other"
+    words = prompt.split()
+    summary = f"This email covers {' '.join(words[-12:])[:200]}."
+    priority = "important" if len(words) % 2 else "not important"
+    if '"summary"' in prompt:
+        return json.dumps({"summary": summary, "priority": priority, "category": category})
+    if categories:
+        return json.dumps({"priority": priority, "category": category})
+    return summary
+
+
+class MockLlmHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        delay = max(server.latency + random.uniform(-server.jitter, server.jitter), 0)
+        time.sleep(delay)
+        with server.lock:
+            server.requests += 1
+        messages = request.get("messages", [])
+        reply = _reply(messages)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4  # about 4 characters a token
+        completion_tokens = len(reply) // 4
+        body = json.dumps({
+            "object": "chat.completion",
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on the request (e.g. a cancelled job)
+
+    def log_message(self, format, *args):
+        pass  # one line per request drowns benchmark output
+
+
+class MockLlmServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+        super().__init__((host, port), MockLlmHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1/chat/completions"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import sys
+    server = MockLlmServer(port=1234, latency=float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)
+    print(f"Mock LLM listening on {server.url} ({server.latency}s per request)")
+    server.serve_forever()
@@ -0,0 +1,212 @@
+import os
+import email
+import quopri
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from email.header import decode_header
+from concurrent.futures import ProcessPoolExecutor
+from app.htmltext import clean_email_body_from_html, html_fallback_text
+from app.metrics import EMAIL_PARSE_SECONDS, HTML_CLEAN_SECONDS, EMAILS_PARSED
+
+# Turning fetched message bytes into email records. This is CPU-bound (MIME
+# decoding, quoted-printable, HTML cleaning), so large syncs hand it to a
+# pool of worker processes. Nothing here may import app.tools: every worker
+# imports this module.
+
+
+def clean_text(text):
+    return " ".join(text.split()) if text else ""
+
+
+def extract_email_parts(msg):
+    plain_text = None
+    html_text = None
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = part.get("Content-Disposition", "")
+
+            # skip attachments
+            if "attachment" in content_disposition.lower():
+                continue
+
+            try:
+                # HTML branch unchanged
+                if content_type == "text/html" and not html_text:
+                    raw = part.get_payload(decode=True) or b""
+                    html_text = raw.decode(part.get_content_charset() or "utf-8", errors="ignore").strip()
+
+                # new plain‐text branch
+                elif content_type == "text/plain" and not plain_text:
+                    cte = part.get("Content-Transfer-Encoding", "").lower()
+                    raw_payload = part.get_payload(decode=False) or b""
+                    if "quoted-printable" in cte:
+                        decoded_bytes = quopri.decodestring(raw_payload)
+                    else:
+                        decoded_bytes = part.get_payload(decode=True) or b""
+                    charset = part.get_content_charset() or "utf-8"
+                    plain_text = decoded_bytes.decode(charset, errors="replace").strip()
+
+            except Exception as e:
+                print("Error decoding email part:", e)
+
+    else:
+        # single‐part fallback stays the same
+        try:
+            payload = msg.get_payload(decode=True) or b""
+            decoded = payload.decode(msg.get_content_charset() or "utf-8", errors="ignore")
+            return decoded.strip(), decoded.strip()
+        except Exception:
+            return "", ""
+
+    # final fallback: if no plain_text but have html_text, strip tags
+    if not plain_text and html_text:
+        plain_text = html_fallback_text(html_text)
+
+    return plain_text or "", html_text or ""
+
+
+def attachments_of(msg) -> list:
+    """Name, size and type of every attachment in a fully downloaded message."""
+    attachments = []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        is_body = content_type in ("text/plain", "text/html")
+        if "attachment" in part.get("Content-Disposition", "").lower() or (not is_body and msg.is_multipart()):
+            attachments.append({
+                "name": part.get_filename(),
+                "size": len(part.get_payload(decode=False) or ""),
+                "type": content_type,
+            })
+    return attachments
+
+
+def clean_body(text: str) -> str:
+    with HTML_CLEAN_SECONDS.time():
+        return clean_email_body_from_html(text)
+
+
+def make_email_data(uid: int, headers, plainTextBody: str, rawHtmlbody: str, attachments=()) -> dict:
+    subject, encoding = decode_header(headers.get("Subject", ""))[0]
+    if isinstance(subject, bytes):
+        subject = subject.decode(encoding or "utf-8", errors="ignore")
+
+    return {
+        "uid": uid,
+        "subject": clean_text(subject),
+        "body": clean_body(plainTextBody),
+        "raw_body": rawHtmlbody,
+        "sender": headers.get("From", "unknown"),
+        "summary": None,
+        "classification": {"priority": None, "category": None},
+        "isRead": False,
+        "dateTime": headers.get("Date", "UNKNOWN"),
+        "attachments": list(attachments),
+    }
+
+
+def build_email_data(uid: int, raw: bytes) -> dict:
+    msg = email.message_from_bytes(raw)
+    plainTextBody, rawHtmlbody = extract_email_parts(msg)
+    return make_email_data(uid, msg, plainTextBody, rawHtmlbody, attachments_of(msg))
+
+
+def build_email_data_from_parts(uid: int, fetched: dict) -> dict:
+    """build_email_data for a message fetched section by section (see fetch_message_parts)."""
+    if "raw" in fetched:
+        return build_email_data(uid, fetched["raw"])
+    headers = email.message_from_bytes(fetched["header"])
+    plainTextBody = (fetched["plain"] or "").strip()
+    rawHtmlbody = (fetched["html"] or "").strip()
+    if not plainTextBody and rawHtmlbody:
+        plainTextBody = html_fallback_text(rawHtmlbody)
+    if fetched["truncated"]:
+        print(f"Email {uid} is larger than IMAP_MAX_BODY_BYTES; stored a truncated body.")
+    return make_email_data(uid, headers, plainTextBody, rawHtmlbody, fetched["attachments"])
+
+
+def parse_fetched(uid: int, fetched) -> dict:
+    """Record for one fetched message: raw bytes from fetch_messages, or a
+    dict from fetch_message_parts."""
+    with EMAIL_PARSE_SECONDS.time():
+        if isinstance(fetched, dict):
+            email_data = build_email_data_from_parts(uid, fetched)
+        else:
+            email_data = build_email_data(uid, fetched)
+    EMAILS_PARSED.inc()
+    return email_data
+
+
+def _parse_batch(batch) -> tuple:
+    # runs in a worker process: hand its timings back with the records
+    records = [parse_fetched(uid, fetched) for uid, fetched in batch]
+    return records, (EMAIL_PARSE_SECONDS.drain(), HTML_CLEAN_SECONDS.drain())
+
+
+def _collect(future) -> list:
+    records, (parse_seconds, clean_seconds) = future.result()
+    EMAIL_PARSE_SECONDS.merge(parse_seconds)
+    HTML_CLEAN_SECONDS.merge(clean_seconds)
+    EMAILS_PARSED.inc(len(records))
+    return records
+
+
+_pool = None
+_pool_lock = threading.Lock()  # accounts sync side by side and share the one pool
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the server process runs threads (IMAP IDLE, index build) that fork would copy mid-flight
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def close_parse_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def parse_messages(fetched, workers=None, batch_size=None):
+    """Yield an email record for every (uid, fetched) pair, in input order.
+
+    Batches of PARSE_BATCH_SIZE messages go to PARSE_WORKERS processes (all
+    cores by default; 0 or 1 parses inline). At most two batches per worker
+    are in flight, so a large sync never holds more than that many raw
+    messages at once and the fetch generator is only read as fast as the
+    workers keep up. Syncs that fit in a single batch are parsed inline,
+    which is cheaper than waking the pool.
+    """
+    workers = workers if workers is not None else int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+    batch_size = batch_size or int(os.getenv("PARSE_BATCH_SIZE", "25"))
+    fetched = iter(fetched)
+    first = list(itertools.islice(fetched, batch_size))
+
+    if workers <= 1 or len(first) < batch_size:
+        for uid, item in itertools.chain(first, fetched):
+            yield parse_fetched(uid, item)
+        return
+
+    pool = _get_pool(workers)
+    pending = deque()
+    batches = itertools.chain([first], iter(lambda: list(itertools.islice(fetched, batch_size)), []))
+    try:
+        for batch in batches:
+            pending.append(pool.submit(_parse_batch, batch))
+            if len(pending) >= workers * 2:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,123 @@
+import os
+import re
+
+# Trimming email bodies before they are sent to the model. Quoted reply
+# chains, signatures, footers and tracking links are removed, and whatever
+# is left is cut into chunks that fit LLM_BODY_TOKEN_BUDGET. Summaries of
+# mail longer than one chunk are built map-reduce style from the chunks;
+# single-pass tasks (classification) only see the first chunk.
+
+# start of the quoted message in a reply; everything from here on is dropped
+REPLY_MARKERS = [
+    re.compile(r"^On\b[^\n]{0,300}(?:\n[^\n]{0,300})?\bwrote:[ \t]*$", re.M),
+    re.compile(r"^Le\b[^\n]{0,300}(?:\n[^\n]{0,300})?\ba écrit ?:[ \t]*$", re.M),
+    re.compile(r"^Am\b[^\n]{0,300}(?:\n[^\n]{0,300})?\bschrieb[^\n]{0,100}:[ \t]*$", re.M),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.M | re.I),
+    re.compile(r"^_{10,}[ \t]*\n+From:", re.M),
+    re.compile(r"^From:[^\n]*\n(?:[^\n]*\n){0,2}?(?:Sent|Date):[^\n]*\n(?:[^\n]*\n){0,3}?Subject:", re.M),
+]
+QUOTED_LINE_RE = re.compile(r"^[ \t]*>[^\n]*\n?", re.M)
+SIGNATURE_RE = re.compile(r"^-- ?$", re.M)
+SENT_FROM_RE = re.compile(r"^Sent from my [^\n]{0,40}$|^Get Outlook for [^\n]{0,20}$", re.M | re.I)
+BOILERPLATE_RE = re.compile(
+    r"unsubscribe|manage (?:your )?(?:email |subscription )?preferences|view (?:this email |it )?in (?:your |a )?browser"
+    r"|you(?: are|'re)? receiv(?:ed|ing) this|to stop receiving|privacy policy|all rights reserved"
+    r"|(?:this|the information in this) (?:e-?mail|message|communication)[^.]{0,80}(?:confidential|privileged)"
+    r"|if you (?:are not the intended recipient|have received this[^.]{0,30}in error)"
+    r"|please consider the environment before printing",
+    re.I,
+)
+BOILERPLATE_MAX_CHARS = 1200  # longer paragraphs are content that happens to mention these words
+LONG_URL_RE = re.compile(r"(https?://[^\s/]+)/\S{30,}")
+INVISIBLE_RE = re.compile("[\u034f\u00ad\u200b-\u200f\u2007\u2060\ufeff]+")
+LINE_EDGE_SPACE_RE = re.compile(r"^[^\S\n]+|[^\S\n]+$", re.M)  # includes no-break spaces
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English with
+    the usual BPE vocabularies). Good enough for budgeting; no tokenizer needed."""
+    return (len(text) + 3) // 4
+
+
+def strip_quoted_replies(text: str) -> str:
+    cut = len(text)
+    for marker in REPLY_MARKERS:
+        match = marker.search(text)
+        if match and match.start() > 0:
+            cut = min(cut, match.start())
+    return QUOTED_LINE_RE.sub("", text[:cut])
+
+
+def strip_signature(text: str) -> str:
+    match = SIGNATURE_RE.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    return SENT_FROM_RE.sub("", text)
+
+
+def strip_boilerplate(text: str) -> str:
+    paragraphs = re.split(r"\n[ \t]*\n", text)
+    kept = [
+        p for p in paragraphs
+        if len(p) > BOILERPLATE_MAX_CHARS or not BOILERPLATE_RE.search(p)
+    ]
+    text = "\n\n".join(kept)
+    text = LONG_URL_RE.sub(r"\1/…", text)  # tracking parameters carry no meaning for the model
+    return INVISIBLE_RE.sub("", text)
+
+
+def clean_for_llm(text: str) -> str:
+    cleaned = strip_boilerplate(strip_signature(strip_quoted_replies(text or "")))
+    cleaned = BLANK_LINES_RE.sub("\n\n", LINE_EDGE_SPACE_RE.sub("", cleaned)).strip()
+    # a message that is nothing but a forward or a footer still has to be described
+    return cleaned or (text or "").strip()
+
+
+def split_chunks(text: str, budget: int) -> list:
+    """Cut text into pieces of at most budget tokens, at paragraph, then line,
+    then word boundaries where possible."""
+    limit = budget * 4
+    chunks, current = [], ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > limit:
+            cut = paragraph.rfind("\n", 0, limit)
+            if cut <= 0:
+                cut = paragraph.rfind(" ", 0, limit)
+            if cut <= 0:
+                cut = limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + 2 + len(paragraph) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks or [""]
+
+
+def prepare_body(text: str, budget=None, max_chunks=None) -> dict:
+    """Trim an email body for the model.
+
+    Returns {"text": first chunk, for single-pass prompts,
+             "chunks": [...] (more than one only when map-reduce is worthwhile),
+             "original_tokens", "tokens" (sent when summarizing), "saved"}.
+    LLM_BODY_TOKEN_BUDGET sets the chunk size; at most LLM_MAP_REDUCE_MAX_CHUNKS
+    chunks are kept (1 turns map-reduce off and simply truncates).
+    """
+    budget = budget or int(os.getenv("LLM_BODY_TOKEN_BUDGET", "2000"))
+    max_chunks = max_chunks or int(os.getenv("LLM_MAP_REDUCE_MAX_CHUNKS", "8"))
+    original_tokens = estimate_tokens(text or "")
+    chunks = split_chunks(clean_for_llm(text), budget)[:max(max_chunks, 1)]
+    tokens = sum(estimate_tokens(chunk) for chunk in chunks)
+    return {
+        "text": chunks[0],
+        "chunks": chunks,
+        "original_tokens": original_tokens,
+        "tokens": tokens,
+        "saved": max(original_tokens - tokens, 0),
+    }
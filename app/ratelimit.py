@@ -0,0 +1,55 @@
+import time
+import asyncio
+import threading
+
+# Token buckets capping how often something may happen: IMAP commands per
+# account (app/imap.py) and LLM requests of the enrichment pipeline
+# (app/enrich.py). RateLimiter is the bucket and blocks the calling thread;
+# AsyncRateLimiter waits on the same kind of bucket without blocking the loop.
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second with bursts of up to `burst`; rate <= 0 disables it."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(burst or rate, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available and return 0, else return the seconds until one is."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AsyncRateLimiter:
+    """RateLimiter for coroutines: waits with asyncio.sleep, serving waiters in arrival order."""
+
+    def __init__(self, rate, burst=None):
+        self.limiter = RateLimiter(rate, burst)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                wait = self.limiter.try_acquire()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
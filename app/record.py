@@ -0,0 +1,121 @@
+import sys
+import zlib
+from dataclasses import dataclass
+
+# The email record in two forms. EmailRecord is the compact in-memory form
+# MemoryEmailStore keeps per email: a slotted object instead of a dict (plus
+# a nested classification dict), sender/priority/category interned so a
+# mailbox holds one copy of each distinct value, and the raw HTML
+# zlib-compressed until someone asks for it. email_dict() builds the dict
+# shape described in app/store.py that every store returns and the tools and
+# API responses pass on; SqliteEmailStore builds its rows through it too.
+
+
+def email_dict(uid, subject, sender, summary, priority, category, is_read, date_time,
+               attachments, tokens_saved, with_body=False, body=None, raw_body=None,
+               account=None, folder=None) -> dict:
+    email_data = {
+        "uid": uid,
+        "account": account,
+        "folder": folder,
+        "subject": subject,
+        "sender": sender,
+        "summary": summary,
+        "classification": {"priority": priority, "category": category},
+        "isRead": bool(is_read),
+        "dateTime": date_time,
+        "attachments": [dict(a) for a in attachments or ()],
+        "tokensSaved": tokens_saved,
+    }
+    if with_body:
+        email_data["body"] = body
+        email_data["raw_body"] = raw_body
+    return email_data
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _compress(text):
+    return None if text is None else zlib.compress(text.encode("utf-8"))
+
+
+def _attachments(attachments) -> tuple:
+    # (("name", ...), ("size", ...), ("type", ...)) per attachment; dict() turns it back
+    return tuple(
+        tuple((key, _intern(value)) for key, value in attachment.items())
+        for attachment in attachments or ()
+    )
+
+
+# record field -> EmailRecord attribute, for the fields stored as they are
+ATTRIBUTES = {
+    "subject": "subject",
+    "summary": "summary",
+    "dateTime": "date_time",
+    "tokensSaved": "tokens_saved",
+    "body": "body",
+    "uidvalidity": "uidvalidity",
+    "imap_uid": "imap_uid",
+}
+CONVERTED_FIELDS = ("classification", "sender", "attachments", "raw_body", "isRead", "account", "folder")
+
+
+@dataclass(slots=True)
+class EmailRecord:
+    uid: int
+    subject: str = None
+    sender: str = None
+    summary: str = None
+    priority: str = None
+    category: str = None
+    is_read: bool = False
+    date_time: str = None
+    attachments: tuple = ()
+    tokens_saved: int = None
+    body: str = None
+    raw_body_z: bytes = None  # zlib-compressed UTF-8
+    account: str = None  # where the message lives on the server, see app/store.py
+    folder: str = None
+    uidvalidity: int = None
+    imap_uid: int = None
+
+    @classmethod
+    def from_dict(cls, email_data: dict) -> "EmailRecord":
+        record = cls(email_data["uid"])
+        record.update(**{k: v for k, v in email_data.items() if k != "uid"})
+        return record
+
+    def update(self, **fields):
+        """Apply record-shaped fields; raises KeyError (changing nothing) for unknown ones."""
+        unknown = [f for f in fields if f not in ATTRIBUTES and f not in CONVERTED_FIELDS]
+        if unknown:
+            raise KeyError(f"Unknown email field '{unknown[0]}'")
+        for field, value in fields.items():
+            if field == "classification":
+                value = value or {}
+                self.priority = _intern(value.get("priority"))
+                self.category = _intern(value.get("category"))
+            elif field in ("sender", "account", "folder"):
+                setattr(self, field, _intern(value))
+            elif field == "attachments":
+                self.attachments = _attachments(value)
+            elif field == "raw_body":
+                self.raw_body_z = _compress(value)
+            elif field == "isRead":
+                self.is_read = bool(value)
+            else:
+                setattr(self, ATTRIBUTES[field], value)
+
+    @property
+    def raw_body(self):
+        return None if self.raw_body_z is None else zlib.decompress(self.raw_body_z).decode("utf-8")
+
+    def to_dict(self, with_body=True) -> dict:
+        return email_dict(
+            self.uid, self.subject, self.sender, self.summary, self.priority, self.category,
+            self.is_read, self.date_time, self.attachments, self.tokens_saved,
+            with_body=with_body, body=self.body, raw_body=self.raw_body if with_body else None,
+            account=self.account, folder=self.folder,
+        )
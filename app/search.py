@@ -0,0 +1,223 @@
+import re
+import math
+import bisect
+import threading
+from collections import Counter, defaultdict
+
+# Inverted index over the searchable email fields, kept in step with the
+# store through its listener hook.
+#
+# Substring queries (what get_emails_by_data promises) are answered by
+# narrowing to candidate emails through the index and then checking the
+# real field value, so results match a plain `query in value.lower()` scan.
+# Ranked queries use BM25 over all indexed fields.
+
+INDEXED_FIELDS = ("subject", "sender", "summary", "body", "classification")
+FIELD_WEIGHTS = {"subject": 2.0, "sender": 1.5, "summary": 1.5, "body": 1.0, "classification": 1.0}
+
+TOKEN_RE = re.compile(r"\w+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def field_text(value) -> str:
+    """The string a field is matched against; dicts become their space-joined values."""
+    if isinstance(value, dict):
+        return " ".join([str(v) for v in value.values()])
+    return str(value)
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+class EmailIndex:
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.RLock()
+        self._built = False
+        self._reset()
+        store.add_listener(self._on_store_change)
+
+    def _reset(self):
+        self._postings = {f: defaultdict(dict) for f in INDEXED_FIELDS}  # field -> term -> {uid: tf}
+        self._doc_terms = {f: {} for f in INDEXED_FIELDS}  # field -> uid -> distinct terms, for removal
+        self._doc_len = {f: {} for f in INDEXED_FIELDS}  # field -> uid -> token count
+        self._total_len = {f: 0 for f in INDEXED_FIELDS}
+        self._vocab = []  # sorted terms, for prefix lookups
+        self._vocab_set = set()
+        self._grams = defaultdict(set)  # trigram -> terms containing it, for infix lookups
+
+    # --- maintenance ---------------------------------------------------------
+
+    def ensure_built(self):
+        with self._lock:
+            if self._built:
+                return
+            print("Building search index...")
+            self._reset()
+            for email_data in self.store.scan(with_body=True):
+                self._index(email_data["uid"], email_data)
+            self._built = True
+            print(f"Search index ready ({len(self._vocab)} terms).")
+
+    def _on_store_change(self, event, uid, fields):
+        with self._lock:
+            if not self._built:
+                return  # the first query builds from the store anyway
+            if event == "clear":
+                self._reset()
+            elif event == "remove":
+                self._unindex(uid, INDEXED_FIELDS)
+            elif event in ("put", "update"):
+                changed = [f for f in INDEXED_FIELDS if f in fields]
+                if event == "put":
+                    changed = INDEXED_FIELDS
+                self._unindex(uid, changed)
+                self._index(uid, fields, changed)
+
+    def _add_terms(self, terms):
+        new_terms = terms - self._vocab_set
+        if not new_terms:
+            return
+        self._vocab_set |= new_terms
+        for term in new_terms:
+            bisect.insort(self._vocab, term)
+            for i in range(len(term) - 2):
+                self._grams[term[i:i + 3]].add(term)
+
+    def _index(self, uid, email_data, fields=INDEXED_FIELDS):
+        for field in fields:
+            terms = Counter(tokenize(field_text(email_data.get(field, ""))))
+            if not terms:
+                continue
+            self._doc_terms[field][uid] = tuple(terms)
+            self._doc_len[field][uid] = sum(terms.values())
+            self._total_len[field] += self._doc_len[field][uid]
+            postings = self._postings[field]
+            for term, tf in terms.items():
+                postings[term][uid] = tf
+            self._add_terms(terms.keys())
+
+    def _unindex(self, uid, fields):
+        for field in fields:
+            terms = self._doc_terms[field].pop(uid, None)
+            if not terms:
+                continue
+            self._total_len[field] -= self._doc_len[field].pop(uid)
+            postings = self._postings[field]
+            for term in terms:
+                docs = postings.get(term)
+                if docs is not None:
+                    docs.pop(uid, None)
+                    if not docs:
+                        del postings[term]
+
+    # --- term lookups --------------------------------------------------------
+
+    def _terms_with_prefix(self, prefix):
+        start = bisect.bisect_left(self._vocab, prefix)
+        end = bisect.bisect_left(self._vocab, prefix + "\U0010ffff")
+        return self._vocab[start:end]
+
+    def _terms_containing(self, fragment):
+        if len(fragment) < 3:
+            return [t for t in self._vocab if fragment in t]
+        candidates = None
+        for i in range(len(fragment) - 2):
+            terms = self._grams.get(fragment[i:i + 3], set())
+            candidates = terms if candidates is None else candidates & terms
+            if not candidates:
+                return []
+        return [t for t in candidates if fragment in t]
+
+    def _docs_for_terms(self, field, terms):
+        postings = self._postings[field]
+        docs = set()
+        for term in terms:
+            docs.update(postings.get(term, ()))
+        return docs
+
+    # --- queries -------------------------------------------------------------
+
+    def candidates(self, field: str, query: str):
+        """UIDs whose `field` may contain `query` as a substring (case-insensitive).
+
+        Returns None when the index cannot narrow the search (field not
+        indexed, or the query has no word characters); callers should then
+        scan. Every true match is included; callers confirm against the value.
+        """
+        if field not in INDEXED_FIELDS:
+            return None
+        query = query.lower().strip()
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        self.ensure_built()
+
+        with self._lock:
+            if len(tokens) == 1:
+                term_groups = [self._terms_containing(tokens[0])]
+            else:
+                first, *middle, last = tokens
+                # the match may start inside a word and end inside a word
+                starts_clean = not query[0].isalnum() and query[0] != "_"
+                ends_clean = not query[-1].isalnum() and query[-1] != "_"
+                term_groups = [
+                    [first] if starts_clean else [t for t in self._terms_containing(first) if t.endswith(first)],
+                    *[[term] for term in middle],
+                    [last] if ends_clean else self._terms_with_prefix(last),
+                ]
+
+            result = None
+            # most selective group first keeps the intersections small
+            for terms in sorted(term_groups, key=len):
+                docs = self._docs_for_terms(field, terms)
+                result = docs if result is None else result & docs
+                if not result:
+                    return set()
+            return result
+
+    def search(self, query: str, limit=10, fields=INDEXED_FIELDS, uids=None, match_all=False) -> list:
+        """Rank emails against free-text query with BM25. The last query word
+        also matches as a prefix, so partially typed words still hit. uids,
+        when given, restricts the ranking to those emails. With match_all only
+        emails containing every query word (in any field) are returned;
+        otherwise any one word is enough.
+
+        Returns [(uid, score), ...], best first.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self.ensure_built()
+
+        scores = defaultdict(float)
+        matched = defaultdict(set)  # uid -> positions of the query words it contains
+        with self._lock:
+            query_terms = [[t] for t in tokens[:-1]] + [self._terms_with_prefix(tokens[-1])]
+            for field in fields:
+                postings = self._postings[field]
+                doc_lens = self._doc_len[field]
+                n_docs = len(doc_lens)
+                if not n_docs:
+                    continue
+                avg_len = self._total_len[field] / n_docs
+                weight = FIELD_WEIGHTS.get(field, 1.0)
+                for position, terms in enumerate(query_terms):
+                    for term in terms:
+                        docs = postings.get(term)
+                        if not docs:
+                            continue
+                        idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                        for uid, tf in docs.items():
+                            norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[uid] / avg_len))
+                            scores[uid] += weight * idf * norm
+                            matched[uid].add(position)
+
+        if match_all:
+            scores = {uid: score for uid, score in scores.items() if len(matched[uid]) == len(query_terms)}
+        if uids is not None:
+            uids = set(uids)
+            scores = {uid: score for uid, score in scores.items() if uid in uids}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
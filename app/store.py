@@ -0,0 +1,609 @@
+import os
+import json
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+from app.record import EmailRecord, email_dict
+
+# Email storage behind a small repository interface. Records keep the shape
+# the rest of the app already uses:
+#
+#   {"uid", "account", "folder", "subject", "body", "raw_body", "sender", "summary",
+#    "classification": {"priority", "category"}, "isRead", "dateTime",
+#    "attachments": [{"name", "size", "type"}, ...], "tokensSaved"}
+#
+# "uid" is the store's own id for an email. Where the message lives on the
+# server is its location key (account, folder, UIDVALIDITY, IMAP UID); two
+# accounts or folders can hold messages with the same IMAP UID, so the key
+# is only unique as a whole. put() of a record carrying "account",
+# "folder", "uidvalidity" and "imap_uid" assigns the uid, reusing the one
+# already stored under that key. Emails stored before accounts existed
+# have no key and their uid is their IMAP UID until claim_unkeyed() files
+# them under an account.
+#
+# "tokensSaved" is how many prompt tokens body preparation (app/prepare.py)
+# cut from the email, once it has been sent to the model.
+#
+# "body" and "raw_body" are only loaded when asked for (with_body=True).
+
+BODY_FIELDS = ("body", "raw_body")
+KEY_FIELDS = ("account", "folder", "uidvalidity", "imap_uid")
+
+
+def location_key(email_data: dict):
+    """(account, folder, uidvalidity, imap_uid) of email_data, or None if it has no location."""
+    key = tuple(email_data.get(f) for f in KEY_FIELDS)
+    return key if key[0] is not None and key[3] is not None else None
+
+
+class EmailStore:
+    """Interface every storage backend implements.
+
+    Listeners registered with add_listener are called after every change as
+    listener(event, uid, fields), where event is "put" (fields is the whole
+    record), "update" (only the changed fields), "remove" or "clear".
+    """
+
+    def add_listener(self, listener):
+        if not hasattr(self, "_listeners"):
+            self._listeners = []
+        self._listeners.append(listener)
+
+    def _notify(self, event, uid=None, fields=None):
+        for listener in getattr(self, "_listeners", ()):
+            try:
+                listener(event, uid, fields)
+            except Exception as e:
+                print(f"Store listener failed on {event}:", e)
+
+    def get(self, uid: int, with_body=True):
+        raise NotImplementedError
+
+    def get_many(self, uids, with_body=True) -> list:
+        raise NotImplementedError
+
+    def all(self, with_body=True, account=None) -> list:
+        """Every stored email, or only those of account."""
+        raise NotImplementedError
+
+    def uids(self, account=None, folder=None) -> list:
+        raise NotImplementedError
+
+    def imap_uids(self, account, folder, uidvalidity=None) -> dict:
+        """{IMAP UID: uid} of the emails stored for a folder (and UIDVALIDITY, when given)."""
+        raise NotImplementedError
+
+    def locate(self, uids) -> dict:
+        """{uid: (account, folder, uidvalidity, imap_uid)} for the stored uids; all None for unkeyed emails."""
+        raise NotImplementedError
+
+    def claim_unkeyed(self, account, folder, uidvalidity) -> int:
+        """File every email without a location under account/folder, its uid
+        taken as its IMAP UID. Returns how many were claimed."""
+        raise NotImplementedError
+
+    def scan(self, batch_size=500, with_body=True):
+        """Iterate over every stored email without loading them all at once."""
+        uids = self.uids()
+        for start in range(0, len(uids), batch_size):
+            yield from self.get_many(uids[start:start + batch_size], with_body=with_body)
+
+    def unprocessed_uids(self, account=None) -> list:
+        """UIDs of emails (of account, when given) still missing a summary or a classification."""
+        raise NotImplementedError
+
+    def page(self, sort="uid", after=None, limit=None, uids=None, with_body=True, account=None) -> list:
+        """Emails in `sort` order: "uid" or "date" (undated mail counts as
+        oldest), ties broken by UID; a leading "-" reverses it.
+
+        after is the sort_key of the last email of the previous page and
+        limit caps the page size. uids and account, when given, restrict the
+        page to those emails.
+        """
+        raise NotImplementedError
+
+    def put(self, email_data: dict) -> int:
+        """Store email_data and return its uid (also set as email_data["uid"])."""
+        raise NotImplementedError
+
+    def update(self, uid: int, **fields) -> bool:
+        """Change some fields of a stored email. Returns False if uid is not stored."""
+        raise NotImplementedError
+
+    def remove(self, uid: int) -> bool:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def get_meta(self, key: str, default=None):
+        raise NotImplementedError
+
+    def set_meta(self, key: str, value):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __contains__(self, uid) -> bool:
+        return self.get(uid, with_body=False) is not None
+
+    def __len__(self) -> int:
+        return self.count()
+
+
+SORTS = ("uid", "-uid", "date", "-date")
+
+
+def sort_key(email_data: dict, sort: str) -> list:
+    """Position of email_data in a page() ordering, usable as its `after`."""
+    if sort.lstrip("-") == "date":
+        return [_date_ts(email_data.get("dateTime")) or 0, email_data["uid"]]
+    return [email_data["uid"]]
+
+
+class MemoryEmailStore(EmailStore):
+    """Process-local store; nothing survives a restart. Emails are kept as
+    compact EmailRecords (see app/record.py) and turned into dicts on read."""
+
+    def __init__(self):
+        self._emails = {}  # uid -> EmailRecord
+        self._keys = {}  # location key -> uid
+        self._next_uid = 1
+        self._meta = {}
+        self._lock = threading.RLock()
+
+    def _records(self, account=None, folder=None):
+        return [
+            r for r in self._emails.values()
+            if (account is None or r.account == account) and (folder is None or r.folder == folder)
+        ]
+
+    def get(self, uid, with_body=True):
+        with self._lock:
+            record = self._emails.get(uid)
+            return record.to_dict(with_body) if record else None
+
+    def get_many(self, uids, with_body=True):
+        with self._lock:
+            return [self._emails[uid].to_dict(with_body) for uid in uids if uid in self._emails]
+
+    def all(self, with_body=True, account=None):
+        with self._lock:
+            return [record.to_dict(with_body) for record in self._records(account)]
+
+    def uids(self, account=None, folder=None):
+        with self._lock:
+            return [record.uid for record in self._records(account, folder)]
+
+    def imap_uids(self, account, folder, uidvalidity=None):
+        with self._lock:
+            return {
+                r.imap_uid: r.uid for r in self._records(account, folder)
+                if uidvalidity is None or r.uidvalidity == uidvalidity
+            }
+
+    def locate(self, uids):
+        with self._lock:
+            return {
+                uid: (r.account, r.folder, r.uidvalidity, r.imap_uid)
+                for uid in uids if (r := self._emails.get(uid)) is not None
+            }
+
+    def claim_unkeyed(self, account, folder, uidvalidity):
+        with self._lock:
+            claimed = [r for r in self._emails.values() if r.account is None]
+            for record in claimed:
+                record.update(account=account, folder=folder, uidvalidity=uidvalidity, imap_uid=record.uid)
+                self._keys[location_key({"account": account, "folder": folder, "uidvalidity": uidvalidity,
+                                         "imap_uid": record.uid})] = record.uid
+        for record in claimed:
+            self._notify("update", record.uid, {"account": account, "folder": folder})
+        return len(claimed)
+
+    def unprocessed_uids(self, account=None):
+        with self._lock:
+            return [
+                record.uid for record in self._records(account)
+                if not record.summary or not record.priority or not record.category
+            ]
+
+    def page(self, sort="uid", after=None, limit=None, uids=None, with_body=True, account=None):
+        descending = sort.startswith("-")
+        with self._lock:
+            if uids is None:
+                records = self._records(account)
+            else:
+                records = [
+                    self._emails[uid] for uid in uids
+                    if uid in self._emails and (account is None or self._emails[uid].account == account)
+                ]
+            keyed = sorted(
+                ((sort_key({"uid": r.uid, "dateTime": r.date_time}, sort), r) for r in records),
+                key=lambda pair: pair[0],
+                reverse=descending,
+            )
+            if after is not None:
+                keyed = [(key, r) for key, r in keyed if (key < after if descending else key > after)]
+            return [record.to_dict(with_body) for _, record in keyed[:limit]]
+
+    def put(self, email_data):
+        key = location_key(email_data)
+        with self._lock:
+            uid = email_data.get("uid")
+            if uid is None:
+                uid = self._keys.get(key) if key else None
+            if uid is None:
+                uid = self._next_uid
+            email_data["uid"] = uid
+            self._next_uid = max(self._next_uid, uid + 1)
+            self._drop_key(self._emails.get(uid))
+            self._emails[uid] = EmailRecord.from_dict(email_data)
+            if key:
+                self._keys[key] = uid
+        self._notify("put", uid, email_data)
+        return uid
+
+    def _drop_key(self, record):
+        if record is not None and record.account is not None:
+            self._keys.pop((record.account, record.folder, record.uidvalidity, record.imap_uid), None)
+
+    def update(self, uid, **fields):
+        with self._lock:
+            if uid not in self._emails:
+                return False
+            self._emails[uid].update(**fields)
+        self._notify("update", uid, fields)
+        return True
+
+    def remove(self, uid):
+        with self._lock:
+            record = self._emails.pop(uid, None)
+            self._drop_key(record)
+            removed = record is not None
+        if removed:
+            self._notify("remove", uid)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._emails.clear()
+            self._keys.clear()
+        self._notify("clear")
+
+    def count(self):
+        return len(self._emails)
+
+    def get_meta(self, key, default=None):
+        return self._meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self._meta[key] = value
+
+    def __contains__(self, uid):
+        return uid in self._emails
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    uid         INTEGER PRIMARY KEY,
+    subject     TEXT,
+    sender      TEXT,
+    date_time   TEXT,
+    date_ts     REAL,
+    is_read     INTEGER NOT NULL DEFAULT 0,
+    summary     TEXT,
+    priority    TEXT,
+    category    TEXT,
+    attachments TEXT,
+    tokens_saved INTEGER,
+    account     TEXT,
+    folder      TEXT,
+    uidvalidity INTEGER,
+    imap_uid    INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_emails_sender   ON emails(sender);
+CREATE INDEX IF NOT EXISTS idx_emails_date_ts  ON emails(date_ts);
+CREATE INDEX IF NOT EXISTS idx_emails_is_read  ON emails(is_read);
+CREATE INDEX IF NOT EXISTS idx_emails_priority ON emails(priority);
+CREATE INDEX IF NOT EXISTS idx_emails_category ON emails(category);
+
+CREATE TABLE IF NOT EXISTS bodies (
+    uid      INTEGER PRIMARY KEY REFERENCES emails(uid) ON DELETE CASCADE,
+    body     TEXT,
+    raw_body TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# record field -> emails column, for everything except the nested classification
+COLUMNS = {
+    "subject": "subject",
+    "sender": "sender",
+    "dateTime": "date_time",
+    "isRead": "is_read",
+    "summary": "summary",
+    "tokensSaved": "tokens_saved",
+}
+
+
+# page() sort -> ORDER BY columns, matching sort_key()
+SORT_COLUMNS = {
+    "uid": ("e.uid",),
+    "date": ("COALESCE(e.date_ts, 0)", "e.uid"),
+}
+
+
+def _scope(account=None, folder=None):
+    """WHERE clause and parameters limiting a query to an account and folder."""
+    conditions, params = [], []
+    for column, value in (("account", account), ("folder", folder)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def _date_ts(date_time):
+    try:
+        return parsedate_to_datetime(date_time).timestamp()
+    except Exception:
+        return None
+
+
+class SqliteEmailStore(EmailStore):
+    """SQLite store in WAL mode. Metadata and bodies live in separate tables
+    so listing emails never reads message bodies."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        # databases created before these columns existed
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(emails)")}
+        for column, column_type in (
+            ("attachments", "TEXT"), ("tokens_saved", "INTEGER"),
+            ("account", "TEXT"), ("folder", "TEXT"), ("uidvalidity", "INTEGER"), ("imap_uid", "INTEGER"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE emails ADD COLUMN {column} {column_type}")
+        # also serves the account (and account + folder) filters
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_emails_location ON emails(account, folder, uidvalidity, imap_uid)"
+        )
+
+    def _row_to_email(self, row, with_body):
+        return email_dict(
+            row["uid"], row["subject"], row["sender"], row["summary"], row["priority"], row["category"],
+            row["is_read"], row["date_time"], json.loads(row["attachments"]) if row["attachments"] else [],
+            row["tokens_saved"],
+            with_body=with_body,
+            body=row["body"] if with_body else None,
+            raw_body=row["raw_body"] if with_body else None,
+            account=row["account"],
+            folder=row["folder"],
+        )
+
+    def _select(self, with_body, where="", params=()):
+        if with_body:
+            sql = "SELECT e.*, b.body, b.raw_body FROM emails e LEFT JOIN bodies b ON b.uid = e.uid"
+        else:
+            sql = "SELECT e.* FROM emails e"
+        with self._lock:
+            rows = self._conn.execute(f"{sql} {where}", params).fetchall()
+        return [self._row_to_email(row, with_body) for row in rows]
+
+    def get(self, uid, with_body=True):
+        rows = self._select(with_body, "WHERE e.uid = ?", (uid,))
+        return rows[0] if rows else None
+
+    def get_many(self, uids, with_body=True):
+        uids = list(uids)
+        if not uids:
+            return []
+        # one primary-key lookup per UID, all passed as a single JSON parameter
+        found = {
+            email_data["uid"]: email_data
+            for email_data in self._select(with_body, "WHERE e.uid IN (SELECT value FROM json_each(?))", (json.dumps(uids),))
+        }
+        return [found[uid] for uid in uids if uid in found]
+
+    def all(self, with_body=True, account=None):
+        if account is not None:
+            return self._select(with_body, "WHERE e.account = ? ORDER BY e.uid", (account,))
+        return self._select(with_body, "ORDER BY e.uid")
+
+    def uids(self, account=None, folder=None):
+        conditions, params = _scope(account, folder)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(f"SELECT uid FROM emails {conditions} ORDER BY uid", params)]
+
+    def imap_uids(self, account, folder, uidvalidity=None):
+        sql = "SELECT imap_uid, uid FROM emails WHERE account = ? AND folder = ?"
+        params = [account, folder]
+        if uidvalidity is not None:
+            sql += " AND uidvalidity = ?"
+            params.append(uidvalidity)
+        with self._lock:
+            return dict(self._conn.execute(sql, params).fetchall())
+
+    def locate(self, uids):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT uid, account, folder, uidvalidity, imap_uid FROM emails "
+                "WHERE uid IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(uids)),),
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def claim_unkeyed(self, account, folder, uidvalidity):
+        with self._lock, self._conn:
+            claimed = [row[0] for row in self._conn.execute("SELECT uid FROM emails WHERE account IS NULL")]
+            self._conn.execute(
+                "UPDATE emails SET account = ?, folder = ?, uidvalidity = ?, imap_uid = uid WHERE account IS NULL",
+                (account, folder, uidvalidity),
+            )
+        for uid in claimed:
+            self._notify("update", uid, {"account": account, "folder": folder})
+        return len(claimed)
+
+    def unprocessed_uids(self, account=None):
+        conditions, params = _scope(account)
+        conditions = f"{conditions} AND" if conditions else "WHERE"
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT uid FROM emails {conditions} "
+                "(summary IS NULL OR summary = '' OR priority IS NULL OR category IS NULL) ORDER BY uid",
+                params,
+            )]
+
+    def page(self, sort="uid", after=None, limit=None, uids=None, with_body=True, account=None):
+        columns = SORT_COLUMNS[sort.lstrip("-")]
+        descending = sort.startswith("-")
+        conditions, params = [], []
+        if after is not None:
+            # row-value comparison resumes right after the last email, even among equal dates
+            conditions.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})")
+            params += list(after)
+        if uids is not None:
+            conditions.append("e.uid IN (SELECT value FROM json_each(?))")  # one parameter however many UIDs
+            params.append(json.dumps(list(uids)))
+        if account is not None:
+            conditions.append("e.account = ?")
+            params.append(account)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+        limit_clause = ""
+        if limit is not None:
+            limit_clause = "LIMIT ?"
+            params.append(limit)
+        return self._select(with_body, f"{where} ORDER BY {order} {limit_clause}", params)
+
+    def put(self, email_data):
+        classification = email_data.get("classification") or {}
+        key = location_key(email_data)
+        with self._lock, self._conn:
+            uid = email_data.get("uid")
+            if uid is None and key:
+                row = self._conn.execute(
+                    "SELECT uid FROM emails WHERE account = ? AND folder = ? AND uidvalidity IS ? AND imap_uid = ?", key
+                ).fetchone()
+                uid = row[0] if row else None
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO emails "
+                "(uid, subject, sender, date_time, date_ts, is_read, summary, priority, category, attachments, tokens_saved, "
+                "account, folder, uidvalidity, imap_uid) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    uid,
+                    email_data.get("subject"),
+                    email_data.get("sender"),
+                    email_data.get("dateTime"),
+                    _date_ts(email_data.get("dateTime")),
+                    int(bool(email_data.get("isRead"))),
+                    email_data.get("summary"),
+                    classification.get("priority"),
+                    classification.get("category"),
+                    json.dumps(email_data.get("attachments") or []),
+                    email_data.get("tokensSaved"),
+                    *(key or (None,) * len(KEY_FIELDS)),
+                ),
+            )
+            uid = cursor.lastrowid if uid is None else uid  # a new email gets the next rowid
+            email_data["uid"] = uid
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bodies (uid, body, raw_body) VALUES (?, ?, ?)",
+                (uid, email_data.get("body"), email_data.get("raw_body")),
+            )
+        self._notify("put", uid, email_data)
+        return uid
+
+    def update(self, uid, **fields):
+        assignments, params = [], []
+        for field, value in fields.items():
+            if field == "classification":
+                value = value or {}
+                assignments += ["priority = ?", "category = ?"]
+                params += [value.get("priority"), value.get("category")]
+            elif field == "isRead":
+                assignments.append("is_read = ?")
+                params.append(int(bool(value)))
+            elif field == "attachments":
+                assignments.append("attachments = ?")
+                params.append(json.dumps(value or []))
+            elif field == "dateTime":
+                assignments += ["date_time = ?", "date_ts = ?"]
+                params += [value, _date_ts(value)]
+            elif field in COLUMNS:
+                assignments.append(f"{COLUMNS[field]} = ?")
+                params.append(value)
+            elif field not in BODY_FIELDS:
+                raise KeyError(f"Unknown email field '{field}'")
+
+        body_fields = [f for f in BODY_FIELDS if f in fields]
+        with self._lock, self._conn:
+            if assignments:
+                cursor = self._conn.execute(f"UPDATE emails SET {', '.join(assignments)} WHERE uid = ?", (*params, uid))
+            else:
+                cursor = self._conn.execute("SELECT 1 FROM emails WHERE uid = ?", (uid,))
+            found = cursor.rowcount > 0 if assignments else cursor.fetchone() is not None
+            if found and body_fields:
+                self._conn.execute(
+                    f"UPDATE bodies SET {', '.join(f + ' = ?' for f in body_fields)} WHERE uid = ?",
+                    (*[fields[f] for f in body_fields], uid),
+                )
+        if found:
+            self._notify("update", uid, fields)
+        return found
+
+    def remove(self, uid):
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM emails WHERE uid = ?", (uid,)).rowcount > 0
+        if removed:
+            self._notify("remove", uid)
+        return removed
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM emails")
+        self._notify("clear")
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store() -> EmailStore:
+    """Build the backend named by EMAIL_STORE ("sqlite" by default, or "memory")."""
+    backend = os.getenv("EMAIL_STORE", "sqlite").lower()
+    if backend == "memory":
+        return MemoryEmailStore()
+    if backend == "sqlite":
+        path = os.getenv("EMAIL_STORE_PATH", os.path.join(os.path.dirname(__file__), "../emails.db"))
+        return SqliteEmailStore(path)
+    raise ValueError(f"Unknown EMAIL_STORE backend '{backend}'")
@@ -0,0 +1,250 @@
+import re
+from app.imap import chunked_message_sets, to_message_set
+from app.mime import parse_fetch_response, parse_bodystructure, is_attachment, attachment_metadata, decode_part
+
+# Incremental mailbox sync keyed on real IMAP UIDs.
+#
+# The sync remembers UIDVALIDITY, the highest UID it has seen and, when the
+# server supports CONDSTORE, the mailbox HIGHESTMODSEQ. A poll then only asks
+# for messages above that UID and for flags changed since that mod-sequence,
+# so its cost follows what changed rather than how big the mailbox is.
+
+FLAGS_RE = re.compile(rb"FLAGS \(([^)]*)\)")
+UID_RE = re.compile(rb"UID (\d+)")
+
+
+def _response_int(mail, code):
+    status, data = mail.response(code)
+    if data and data[-1] is not None:
+        try:
+            return int(data[-1].split()[0])
+        except (ValueError, IndexError):
+            pass
+    return None
+
+
+def select_folder(mail, folder):
+    """SELECT folder on mail and return its UIDVALIDITY. Raises RuntimeError if it cannot be selected."""
+    status, _ = mail.select(folder)
+    if status != "OK":
+        raise RuntimeError(f"Could not select folder {folder}")
+    return _response_int(mail, "UIDVALIDITY")
+
+
+def parse_uid_search(data) -> list:
+    if not data or not data[0]:
+        return []
+    return [int(uid) for uid in data[0].split()]
+
+
+def parse_flag_responses(data) -> dict:
+    """Map uid -> is-seen from the lines of a `UID FETCH ... (FLAGS)` response."""
+    flags = {}
+    for item in data or []:
+        line = item[0] if isinstance(item, tuple) else item
+        if not line:
+            continue
+        uid_match = UID_RE.search(line)
+        flag_match = FLAGS_RE.search(line)
+        if uid_match and flag_match:
+            flags[int(uid_match.group(1))] = b"\\Seen" in flag_match.group(1).split()
+    return flags
+
+
+class MailboxSync:
+    def __init__(self, folder="inbox", uidvalidity=None, last_uid=0, highest_modseq=None):
+        self.folder = folder
+        self.uidvalidity = uidvalidity
+        self.last_uid = last_uid
+        self.highest_modseq = highest_modseq
+
+    def state(self) -> dict:
+        return {
+            "folder": self.folder,
+            "uidvalidity": self.uidvalidity,
+            "last_uid": self.last_uid,
+            "highest_modseq": self.highest_modseq,
+        }
+
+    def poll(self, mail, known_uids=(), check_expunged=False) -> dict:
+        """Work out what changed since the last poll.
+
+        Nothing is remembered until `commit` is called with the result, so a
+        poll whose messages could not be fetched is simply retried next time.
+
+        Returns:
+        {
+            "reset": bool,          # UIDVALIDITY changed; every stored UID is stale
+            "new_uids": [...],      # unseen messages above the last synced UID
+            "flag_changes": {uid: is_seen},  # for known_uids only
+            "expunged": [...],      # known_uids gone from the server (only with check_expunged)
+            "state": {...}          # sync position to commit once the changes are stored
+        }
+        """
+        # re-selecting refreshes UIDVALIDITY / UIDNEXT / HIGHESTMODSEQ in one round trip
+        uidvalidity = select_folder(mail, self.folder)
+        uidnext = _response_int(mail, "UIDNEXT")
+        highest_modseq = _response_int(mail, "HIGHESTMODSEQ")
+
+        last_uid, last_modseq = self.last_uid, self.highest_modseq
+        reset = self.uidvalidity is not None and uidvalidity != self.uidvalidity
+        if reset:
+            print(f"UIDVALIDITY changed for {self.folder}, resyncing from scratch...")
+            last_uid, last_modseq = 0, None
+            known_uids = ()
+
+        new_uids = []
+        if uidnext is None or uidnext - 1 > last_uid:
+            if last_uid:
+                status, data = mail.uid("SEARCH", None, "UID", f"{last_uid + 1}:*", "UNSEEN")
+            else:
+                status, data = mail.uid("SEARCH", None, "UNSEEN")
+            # "n:*" always matches the newest message, even when its UID is below n
+            new_uids = [uid for uid in parse_uid_search(data) if uid > last_uid]
+
+        flag_changes = {}
+        known_uids = [uid for uid in known_uids if uid <= last_uid]
+        if known_uids:
+            if highest_modseq is not None and last_modseq is not None:
+                if highest_modseq != last_modseq:
+                    status, data = mail.uid(
+                        "FETCH", f"1:{last_uid}", "(FLAGS)", f"(CHANGEDSINCE {last_modseq})"
+                    )
+                    flag_changes = parse_flag_responses(data)
+            else:
+                # no CONDSTORE: re-read flags, but only for the messages we hold
+                for message_set, _ in chunked_message_sets(known_uids):
+                    status, data = mail.uid("FETCH", message_set, "(FLAGS)")
+                    flag_changes.update(parse_flag_responses(data))
+            known = set(known_uids)
+            flag_changes = {uid: seen for uid, seen in flag_changes.items() if uid in known}
+
+        expunged = []
+        if check_expunged and known_uids:
+            still_there = set()
+            for message_set, _ in chunked_message_sets(known_uids):
+                status, data = mail.uid("SEARCH", None, "UID", message_set)
+                still_there.update(parse_uid_search(data))
+            expunged = [uid for uid in known_uids if uid not in still_there]
+
+        state = {
+            "folder": self.folder,
+            "uidvalidity": uidvalidity,
+            "last_uid": max([last_uid, *new_uids, (uidnext or 1) - 1]),
+            "highest_modseq": highest_modseq,
+        }
+        return {
+            "reset": reset,
+            "new_uids": new_uids,
+            "flag_changes": flag_changes,
+            "expunged": expunged,
+            "state": state,
+        }
+
+    def commit(self, result):
+        state = result["state"]
+        self.uidvalidity = state["uidvalidity"]
+        self.last_uid = state["last_uid"]
+        self.highest_modseq = state["highest_modseq"]
+
+
+def fetch_messages(mail, uids):
+    """Yield (uid, raw message bytes) for uids, one `UID FETCH` per chunk."""
+    for message_set, _ in chunked_message_sets(uids):
+        status, data = mail.uid("FETCH", message_set, "(BODY.PEEK[])")
+        for part in data:
+            if not isinstance(part, tuple):
+                continue
+            uid_match = UID_RE.search(part[0])
+            if uid_match:
+                yield int(uid_match.group(1)), part[1]
+
+
+def plan_text_fetch(parts, max_bytes):
+    """Choose the body sections worth downloading for a message.
+
+    Returns ({"plain"/"html": (part, bytes_to_fetch)}, attachments, truncated).
+    The first text/plain and text/html parts that are not attachments share
+    the max_bytes budget, plain text first; everything else becomes
+    attachment metadata and is never downloaded.
+    """
+    wanted, attachments = {}, []
+    budget = max_bytes
+    for part in parts:
+        if is_attachment(part):
+            attachments.append(attachment_metadata(part))
+            continue
+        if part["subtype"] in wanted:
+            continue
+        wanted[part["subtype"]] = part
+
+    plan, truncated = {}, False
+    for kind in ("plain", "html"):
+        part = wanted.get(kind)
+        if part is None:
+            continue
+        take = min(part["size"], budget) if part["size"] > 0 else budget
+        truncated = truncated or part["size"] > take
+        if take > 0:
+            plan[kind] = (part, take)
+            budget -= take
+    return plan, attachments, truncated
+
+
+def fetch_message_parts(mail, uids, max_bytes):
+    """Yield (uid, message) for uids without downloading attachments.
+
+    Reads BODYSTRUCTURE first, then fetches only the header and the text
+    sections, each with a partial fetch capped so a message never costs more
+    than max_bytes of body. message is
+    {"header": bytes, "plain": str or None, "html": str or None,
+     "attachments": [{"name", "size", "type"}, ...], "truncated": bool},
+    or {"raw": bytes} for messages whose structure could not be read, which
+    are fetched whole.
+    """
+    for message_set, chunk in chunked_message_sets(uids):
+        status, data = mail.uid("FETCH", message_set, "(BODYSTRUCTURE)")
+        structures = {}
+        for message in parse_fetch_response(data):
+            if "UID" in message and isinstance(message.get("BODYSTRUCTURE"), list):
+                structures[int(message["UID"])] = message["BODYSTRUCTURE"]
+
+        plans, unreadable = {}, []
+        for uid in chunk:
+            if uid not in structures:
+                unreadable.append(uid)
+                continue
+            plans[uid] = plan_text_fetch(parse_bodystructure(structures[uid]), max_bytes)
+
+        # messages laid out the same way share one FETCH
+        groups = {}
+        for uid, (plan, _, _) in plans.items():
+            items = ["BODY.PEEK[HEADER]"] + [
+                f"BODY.PEEK[{part['section']}]<0.{take}>" for part, take in plan.values()
+            ]
+            groups.setdefault(tuple(items), []).append(uid)
+
+        for items, group in groups.items():
+            status, data = mail.uid("FETCH", to_message_set(group), f"({' '.join(items)})")
+            for message in parse_fetch_response(data):
+                if "UID" not in message or int(message["UID"]) not in plans:
+                    continue
+                uid = int(message["UID"])
+                plan, attachments, truncated = plans[uid]
+                fetched = {
+                    "header": message.get("BODY[HEADER]") or b"",
+                    "plain": None,
+                    "html": None,
+                    "attachments": attachments,
+                    "truncated": truncated,
+                }
+                for kind, (part, take) in plan.items():
+                    body = message.get(f"BODY[{part['section']}]<0>", message.get(f"BODY[{part['section']}]"))
+                    if isinstance(body, str):
+                        body = body.encode()
+                    if body:
+                        fetched[kind] = decode_part(body, part["encoding"], part["params"].get("charset"))
+                yield uid, fetched
+
+        for uid, raw in fetch_messages(mail, unreadable):
+            yield uid, {"raw": raw}
@@ -2,10 +2,11 @@
 
 import asyncio
 from app.agent import build_agent
-from app.tools import updated_UIDs
+from langchain_core.messages import AIMessage
 from fastapi import status
 
 # run with python -m app.testTheAgent
+# needs a real model and mailbox; for offline performance numbers use python -m app.bench.suite
 
 
 # Simulate the global chat history used in your API
@@ -26,6 +27,15 @@ async def test_prompt(user_input: str):
 
         chatHistory = state["messages"]
 
+        # the UIDs the agent's tool calls touched, as the frontend works them out
+        tool_calls = [call for msg in state["messages"] if isinstance(msg, AIMessage) for call in msg.tool_calls]
+        updated_UIDs = sorted({
+            uid
+            for call in tool_calls
+            for uid in call["args"].get("uids") or [call["args"].get("uid")]
+            if uid is not None
+        })
+
         print("Last updated:", updated_UIDs)
         print("Message from Agent:", state["messages"][-1])
 
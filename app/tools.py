@@ -1,178 +1,161 @@
 import os
-import imaplib
-import email
-from email.header import decode_header
-from bs4 import BeautifulSoup
 import json
-import requests
-import os
+import base64
 import random
 from langchain.tools import tool
-import re
-import quopri
+from langchain_core.tools import BaseTool
+from langchain_core.callbacks import BaseCallbackHandler
+import threading
+import time
+import asyncio
+from typing import Optional
+from app.imap import get_pool, chunked_message_sets, run_imap, per_account
+from app.accounts import get_account, get_accounts, check_account
+from app.sync import MailboxSync, select_folder, fetch_messages, fetch_message_parts
+from app.store import create_store, sort_key, SORTS, BODY_FIELDS
+from app.changes import ChangeLog
+from app.search import EmailIndex, field_text
+from app.enrich import EnrichmentPipeline, summarize_results
+from app.cache import create_cache, fingerprint
+from app.parsing import parse_messages
+from app.prepare import prepare_body
+from app.metrics import TOOL_SECONDS
+from app.llm import (
+    LlmError, chat_completion, summary_messages, summary_reduce_messages, classification_messages, enrichment_messages,
+    parse_json_object, validate_classification, parse_enrichment,
+)
 
 # Load categories for classification
 with open(os.path.join(os.path.dirname(__file__), "../categories.json"), "r") as f:
     CATEGORY_DATA = json.load(f)
 
-stored_emails = {} #all emails, acts as the database for now - updating this will replace with API calls to DB
+email_store = create_store() #all emails by store uid, located by (account, folder, UIDVALIDITY, IMAP UID); see app/store.py
+email_index = EmailIndex(email_store)
+email_changes = ChangeLog(email_store) #versions for /getStoredEmails?since=
+mailbox_syncs = {} #(account, folder) -> MailboxSync, loaded on first use
+sync_locks = {} #(account, folder) -> Lock; the IDLE listeners and /fetchEmails must not sync a folder at the same time
+sync_state_lock = threading.Lock()
 
-def clean_text(text):
-    return " ".join(text.split()) if text else ""
+def sync_meta_key(account_id, folder) -> str:
+    return f"sync:{account_id}:{folder}"
 
-import re
-from bs4 import BeautifulSoup, Comment
+def get_mailbox_sync(account_id, folder):
+    """(MailboxSync, lock) of one account's folder, its position read from the store on first use.
 
-def clean_email_body_from_html(html: str) -> str:
-    if not html:
-        return "ERROR: HTML Body not received."
-    
-    soup = BeautifulSoup(html, "html.parser")
-
-    # 1) Remove tags that are never useful
-    for tag in soup(["script", "style", "head", "meta", "link"]):
-        tag.decompose()
-
-    # 2) Remove all images (including base64 inline)
-    for img in soup.find_all("img"):
-        img.decompose()
-
-    # 3) Remove HTML comments
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
-
-    # 4) Replace <br> and block tags with newlines
-    for block in soup.find_all(["br", "p", "div", "li"]):
-        block.insert_before("\n")
-
-    # 5) Get text and collapse multiple blank lines
-    text = soup.get_text()
-    # Normalize whitespace
-    text = re.sub(r"[ \t]+", " ", text)
-    # Collapse more than 2 newlines
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    
-    # 6) Strip leading/trailing whitespace
-    return text.strip()
-
-def extract_text_from_html(html: str) -> str:
-    if not html:
-        return ""
-
-    soup = BeautifulSoup(html, "html.parser")
-
-    # Remove scripts/styles/comments as above
-    for tag in soup(["script", "style", "head", "meta", "link", "img"]):
-        tag.decompose()
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
-
-    # Get text with single-space separation
-    text = soup.get_text(separator=" ")
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
-
-def extract_email_parts(msg):
-    plain_text = None
-    html_text = None
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = part.get("Content-Disposition", "")
-
-            # skip attachments
-            if "attachment" in content_disposition.lower():
-                continue
-
-            try:
-                # HTML branch unchanged
-                if content_type == "text/html" and not html_text:
-                    raw = part.get_payload(decode=True) or b""
-                    html_text = raw.decode(part.get_content_charset() or "utf-8", errors="ignore").strip()
-
-                # new plain‐text branch
-                elif content_type == "text/plain" and not plain_text:
-                    cte = part.get("Content-Transfer-Encoding", "").lower()
-                    raw_payload = part.get_payload(decode=False) or b""
-                    if "quoted-printable" in cte:
-                        decoded_bytes = quopri.decodestring(raw_payload)
-                    else:
-                        decoded_bytes = part.get_payload(decode=True) or b""
-                    charset = part.get_content_charset() or "utf-8"
-                    plain_text = decoded_bytes.decode(charset, errors="replace").strip()
-
-            except Exception as e:
-                print("Error decoding email part:", e)
+    The position kept before there were accounts (meta "sync") becomes that of the
+    first account's first folder, and the emails stored back then are filed under it.
+    """
+    key = (account_id, folder)
+    with sync_state_lock:
+        if key not in mailbox_syncs:
+            state = email_store.get_meta(sync_meta_key(account_id, folder))
+            first = get_account()
+            if state is None and key == (first.id, first.folders[0]):
+                state = email_store.get_meta("sync")
+                if state is not None:
+                    claimed = email_store.claim_unkeyed(account_id, folder, state.get("uidvalidity"))
+                    email_store.set_meta(sync_meta_key(account_id, folder), state)
+                    print(f"Filed {claimed} stored emails under {account_id}/{folder}.")
+            mailbox_syncs[key] = MailboxSync(**dict(state or {}, folder=folder))
+            sync_locks[key] = threading.Lock()
+        return mailbox_syncs[key], sync_locks[key]
+
+def load_mailbox_syncs():
+    """Load the sync position of every configured folder (filing legacy emails on the way)."""
+    for account in get_accounts().values():
+        for folder in account.folders:
+            get_mailbox_sync(account.id, folder)
+
+def sync_folder(account_id, folder, check_expunged=False) -> dict:
+    """Bring the stored emails of one account's folder up to date with the server.
+
+    Returns {"new": [email_data, ...], "updated": [uid, ...], "removed": [uid, ...]}.
+    Used by `sync_mailbox` and by the IMAP IDLE listeners.
+    """
+    mailbox_sync, lock = get_mailbox_sync(account_id, folder)
+    new_emails, updated, removed = [], [], []
+    with lock, get_pool(account_id).connection() as mail:
+        known = email_store.imap_uids(account_id, folder, mailbox_sync.uidvalidity) #IMAP UID -> store uid
+        changes = mailbox_sync.poll(mail, known_uids=list(known), check_expunged=check_expunged)
+        if changes["reset"]:
+            for uid in email_store.uids(account=account_id, folder=folder):
+                if email_store.remove(uid):
+                    removed.append(uid)
+            known = {}
+
+        for imap_uid, seen in changes["flag_changes"].items():
+            uid = known.get(imap_uid)
+            email = email_store.get(uid, with_body=False) if uid is not None else None
+            if email and email["isRead"] != seen:
+                email_store.update(uid, isRead=seen)
+                updated.append(uid)
+
+        for imap_uid in changes["expunged"]:
+            if imap_uid in known and email_store.remove(known[imap_uid]):
+                removed.append(known[imap_uid])
+
+        new_ids = [imap_uid for imap_uid in changes["new_uids"] if imap_uid not in known]
+        if os.getenv("IMAP_FETCH_MODE", "structure").lower() == "full":
+            fetched = fetch_messages(mail, new_ids)
+        else:
+            # only the text sections, up to IMAP_MAX_BODY_BYTES; attachments are never downloaded
+            max_bytes = int(os.getenv("IMAP_MAX_BODY_BYTES", str(1024 * 1024)))
+            fetched = fetch_message_parts(mail, new_ids, max_bytes)
+        uidvalidity = changes["state"]["uidvalidity"]
+        for email_data in parse_messages(fetched):
+            email_data.update(account=account_id, folder=folder, uidvalidity=uidvalidity, imap_uid=email_data.pop("uid"))
+            email_store.put(email_data) #assigns email_data["uid"]
+            new_emails.append(email_data)
 
-    else:
-        # single‐part fallback stays the same
-        try:
-            payload = msg.get_payload(decode=True) or b""
-            decoded = payload.decode(msg.get_content_charset() or "utf-8", errors="ignore")
-            return decoded.strip(), decoded.strip()
-        except Exception:
-            return "", ""
+        mailbox_sync.commit(changes)
+        email_store.set_meta(sync_meta_key(account_id, folder), mailbox_sync.state())
+
+    return {"new": new_emails, "updated": updated, "removed": removed}
 
-    # final fallback: if no plain_text but have html_text, strip tags
-    if not plain_text and html_text:
-        soup = BeautifulSoup(html_text, "html.parser")
-        plain_text = soup.get_text(separator="\n").strip()
+def sync_mailbox(account=None, check_expunged=False) -> dict:
+    """Sync every folder of account (of every account when None) and report what changed.
 
-    return plain_text or "", html_text or ""
+    Each account's folders are synced on that account's own connections and
+    threads, so accounts run side by side and a slow one does not hold up the rest.
+
+    Returns {"new": [email_data, ...], "updated": [uid, ...], "removed": [uid, ...],
+    "errors": {"account/folder": "...", ...}}. Raises ValueError for an unknown account.
+    """
+    accounts = [get_account(account)] if account else list(get_accounts().values())
+    if not accounts:
+        raise ValueError("No mail account is configured; set EMAIL_USER or ACCOUNTS_FILE")
+    folders = [(a.id, folder) for a in accounts for folder in a.folders]
+    results = per_account([(account_id, sync_folder, account_id, folder, check_expunged) for account_id, folder in folders])
+
+    changes = {"new": [], "updated": [], "removed": [], "errors": {}}
+    for (account_id, folder), result in zip(folders, results):
+        if isinstance(result, Exception):
+            changes["errors"][f"{account_id}/{folder}"] = str(result)
+            continue
+        for kind in ("new", "updated", "removed"):
+            changes[kind].extend(result[kind])
+    return changes
 
 @tool #removed as tool
-def fetch_emails() -> dict:
+def fetch_emails(account: Optional[str] = None) -> dict:
     """
-    Fetch new, unread emails and store them in memory.
+    Fetch new, unread emails and store them in the database.
 
-    Only unseen emails are fetched. The returned list contains minimal metadata,
+    Every configured account is fetched unless `account` names one (see `list_accounts`).
+    Only unseen emails that arrived since the last fetch are downloaded, and the read
+    status of already stored emails is refreshed. The returned list contains minimal metadata,
     omitting the full email body to preserve token context. Use `get_email_by_uid`
     or similar tools to retrieve full content later.
     """
     print("Fetching unread emails...")
-    emails = []
+    emails, errors = [], {}
     try:
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(os.environ["EMAIL_USER"], os.environ["EMAIL_PASS"])
-        mail.select("inbox")
-
-        status, messages = mail.search(None, "UNSEEN")
-        message_ids = messages[0].split()
-
-        for uid_bytes in message_ids:
-            uid = int(uid_bytes)
-            if uid in stored_emails:
-                continue
-
-            res, msg_data = mail.fetch(str(uid), "(BODY.PEEK[])")
-            for part in msg_data:
-                if not isinstance(part, tuple):
-                    continue
-
-                msg = email.message_from_bytes(part[1])
-                subject, encoding = decode_header(msg.get("Subject", ""))[0]
-                if isinstance(subject, bytes):
-                    subject = subject.decode(encoding or "utf-8", errors="ignore")
-
-                plainTextBody, rawHtmlbody = extract_email_parts(msg)
-
-                email_data = {
-                    "uid": uid,
-                    "subject": clean_text(subject),
-                    "body": clean_email_body_from_html(plainTextBody),
-                    "raw_body": rawHtmlbody,
-                    "sender": msg.get("From", "unknown"),
-                    "summary": None,
-                    "classification": {"priority": None, "category": None},
-                    "isRead": False,
-                    "dateTime": msg.get("Date", "UNKNOWN")
-                }
-
-                stored_emails[uid] = email_data
-                emails.append(email_data)
-
-        mail.logout()
+        changes = sync_mailbox(account)
+        emails, errors = changes["new"], changes["errors"]
+        for name, error in errors.items():
+            print(f"Error fetching emails from {name}:", error)
+    except ValueError as e:
+        return {"error": str(e), "new_email_data": []}
     except Exception as e:
         print("Error fetching emails:", e)
 
@@ -180,28 +163,114 @@ def fetch_emails() -> dict:
         "new_email_data": [
             {
                 "uid": e["uid"],
+                "account": e["account"],
                 "subject": e["subject"],
                 "sender": e["sender"],
                 "isRead": e.get("isRead", False),
                 "summary": e.get("summary"),
                 "classification": e.get("classification")
             } for e in emails
-        ]
+        ],
+        "errors": errors,
     }
 
-def get_stored_emails() -> list:
-    """Return a list of all stored emails in memory.
+@tool
+def list_accounts() -> list:
+    """
+    List the mail accounts that are synced, with their folders and how many emails are stored for each.
 
-    Each entry includes minimal identifying info: UID, subject, sender, read status, and classification.
-    The full email body is not included to conserve context.
+    Pass an account's "id" as `account` to other tools to work on that account only.
 
-    Use `get_email_by_uid` or related tools to retrieve the full content when needed.
-    """
-    print("Returning stored emails...")
-    return [
-        email
-        for email in stored_emails.values()
+    Returns:
+    [
+        {"id": "work", "user": "me@work.com", "host": "imap.gmail.com", "folders": ["inbox"], "emails": 120},
+        ...
     ]
+    """
+    return [dict(a.public(), emails=len(email_store.uids(account=a.id))) for a in get_accounts().values()]
+
+EMAIL_FIELDS = ("uid", "account", "folder", "subject", "sender", "summary", "classification", "isRead", "dateTime", "attachments", "tokensSaved", "body", "raw_body")
+DEFAULT_EMAIL_FIELDS = tuple(f for f in EMAIL_FIELDS if f not in BODY_FIELDS)
+
+def projection(fields, default=EMAIL_FIELDS) -> tuple:
+    """Validated field names to return, uid first."""
+    fields = tuple(fields) if fields else default
+    unknown = [f for f in fields if f not in EMAIL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ("uid",) + tuple(f for f in fields if f != "uid")
+
+def get_emails_by_uids(uids, fields=None) -> list:
+    """Stored emails for uids, in the order given, skipping unknown UIDs.
+
+    One keyed batch read from the store, so the cost depends on how many
+    UIDs are asked for, not on the size of the mailbox. Every field is
+    returned unless `fields` narrows it; bodies are only read when included.
+    """
+    fields = projection(fields)
+    emails = email_store.get_many(dict.fromkeys(uids), with_body=any(f in BODY_FIELDS for f in fields))
+    return [{f: e.get(f) for f in fields} for e in emails]
+
+def encode_cursor(sort: str, key: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, key]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was issued for sort '{cursor_sort}', not '{sort}'.")
+    return key
+
+def get_stored_emails(fields=None, sort="uid", limit=None, cursor=None, since=None, account=None):
+    """Return stored emails, without their bodies unless `fields` asks for them.
+
+    fields: names of the record fields to include (uid is always included).
+    sort: "uid", "date", or either with a leading "-" for descending order.
+    account: only emails of this account.
+    With none of limit, cursor or since this is a plain list of every email.
+    Otherwise it is a page:
+    {
+        "emails": [...],
+        "next_cursor": "...",   # pass back as cursor for the next page; null on the last one
+        "version": "...",       # pass back as since to get only what changed afterwards
+        "removed": [104],       # with since: UIDs removed since that version
+        "reset": false          # with since: true when since was unusable and this is a full read
+    }
+    Raises ValueError for unknown fields, sorts, cursors and accounts.
+    """
+    fields = projection(fields, DEFAULT_EMAIL_FIELDS)
+    check_account(account)
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort '{sort}'. Use one of: {', '.join(SORTS)}.")
+    with_body = any(f in BODY_FIELDS for f in fields)
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    version = email_changes.version  # taken first, so changes made while reading show up next time
+    uids, removed, reset = None, [], False
+    if since:
+        delta = email_changes.since(since)
+        if delta is None:
+            reset = True
+        else:
+            uids, removed = delta
+
+    rows = email_store.page(sort=sort, after=after, limit=limit, uids=uids, with_body=with_body, account=account)
+    emails = [{f: e.get(f) for f in fields} for e in rows]
+    print(f"Returning {len(emails)} stored emails...")
+    if limit is None and cursor is None and since is None:
+        return emails
+
+    page = {
+        "emails": emails,
+        "next_cursor": encode_cursor(sort, sort_key(rows[-1], sort)) if limit and len(rows) == limit else None,
+        "version": version,
+    }
+    if since is not None:
+        page["removed"] = removed
+        page["reset"] = reset
+    return page
 
 @tool
 def get_stored_email_with_uid(uid: int) -> dict:
@@ -211,12 +280,14 @@ def get_stored_email_with_uid(uid: int) -> dict:
     Use this when the user asks to see an email or when full analysis is needed.
     """
     #print(f"Fetching email with UID: {uid}...")
-    email = stored_emails.get(uid)
+    email = email_store.get(uid)
     if not email:
         return {"error": f"No email found with UID {uid}"}
     
     return {
         "uid":            email["uid"],
+        "account":        email["account"],
+        "folder":         email["folder"],
         "subject":        email["subject"],
         "sender":         email["sender"],
         "body":           email["body"],
@@ -226,7 +297,7 @@ def get_stored_email_with_uid(uid: int) -> dict:
     }
 
 @tool
-def get_emails_by_data(field: str, query: str) -> dict:
+def get_emails_by_data(field: str, query: str, account: Optional[str] = None) -> dict:
     """
     When a user asks for emails of a certain criteria call this function.
 
@@ -241,6 +312,7 @@ def get_emails_by_data(field: str, query: str) -> dict:
     Parameters:
         field (str): The name of the field to search (e.g., "subject", "sender", "summary", "classification").
         query (str): The query string to search for as a substring.
+        account (str, optional): Only search this account's emails (see `list_accounts`).
 
     Returns:
         dict: A dictionary mapping matching email UIDs to the field value that matched.
@@ -251,19 +323,65 @@ def get_emails_by_data(field: str, query: str) -> dict:
         It might return: { 103: "meeting with robinhood updates" }
     """
     print("Getting emails by data:", field, ":", query)
+    try:
+        check_account(account)
+    except ValueError as e:
+        return {"error": str(e)}
     query = query.lower().strip()
+    with_body = field in ("body", "raw_body")
+
+    candidates = email_index.candidates(field, query)
+    if candidates is None:
+        emails = email_store.all(with_body=with_body, account=account)
+    else:
+        emails = email_store.get_many(sorted(candidates), with_body=with_body)
+
     results = {}
-    for email in stored_emails.values():
+    for email in emails:
+        if account is not None and email["account"] != account:
+            continue
         value = email.get(field, "")
-        if isinstance(value, dict):
-            value_str = " ".join([str(v) for v in value.values()])
-        else:
-            value_str = str(value)
-        value_str_lower = value_str.lower().strip()
+        value_str_lower = field_text(value).lower().strip()
         if query in value_str_lower:
             results[email["uid"]] = value
     return results
 
+@tool
+def search_emails(query: str, limit: int = 10, account: Optional[str] = None) -> list:
+    """
+    Full-text search across subject, sender, summary, body and classification, best matches first.
+
+    Use this for open-ended requests ("anything about the flight to Denver?") where you do not
+    know which field holds the answer. The last word of the query also matches word prefixes.
+    Pass `account` to search only that account's emails (see `list_accounts`).
+
+    Returns a list like:
+    [
+        {"uid": 103, "account": "work", "subject": "...", "sender": "...", "score": 7.2},
+        ...
+    ]
+    Use `get_stored_email_with_uid` or `get_data_by_id` to read a hit in full.
+    """
+    print("Searching emails:", query)
+    try:
+        check_account(account)
+    except ValueError as e:
+        return [{"error": str(e)}]
+    scope = email_store.uids(account=account) if account else None
+    hits = email_index.search(query, limit=limit, uids=scope)
+    emails = {e["uid"]: e for e in email_store.get_many([uid for uid, _ in hits], with_body=False)}
+    return [
+        {
+            "uid": uid,
+            "account": emails[uid]["account"],
+            "subject": emails[uid]["subject"],
+            "sender": emails[uid]["sender"],
+            "score": round(score, 2),
+        }
+        for uid, score in hits
+        if uid in emails
+    ]
+
 @tool
 def get_data_by_id(uid: int, field: str) -> dict:
     """
@@ -291,7 +409,7 @@ def get_data_by_id(uid: int, field: str) -> dict:
 
     Use this after filtering with tools like `get_emails_by_classification` or `get_emails_by_sender`.
     """
-    email = stored_emails.get(uid)
+    email = email_store.get(uid, with_body=field in ("body", "raw_body"))
     if not email:
         return {"uid": uid, "field": field, "value": "Email not found."}
     
@@ -301,7 +419,7 @@ def get_data_by_id(uid: int, field: str) -> dict:
 @tool #removed as tool
 def get_stored_email_uids() -> list:
     """
-    Return a list of UIDs for all stored emails in memory.
+    Return a list of UIDs for all stored emails.
 
     This tool returns only the unique identifiers (UIDs) of the emails,
     so that the agent can use these UIDs to retrieve specific email data
@@ -311,73 +429,134 @@ def get_stored_email_uids() -> list:
     [101, 102, 103, ...]
     """
     print("Returning stored email UIDs...")
-    return list(stored_emails.keys())
+    return email_store.uids()
+
+def test_mode(name: str) -> bool:
+    return os.getenv(name, "false").lower() in ("true", "1", "yes")
+
+# LLM results keyed by email content, so re-fetched or duplicate mail is not
+# sent to the model again; see app/cache.py
+llm_cache = create_cache()
+
+def prompt_fingerprint(template_messages: list, max_tokens=150) -> str:
+    """Identifies the prompt (rendered with an empty body), model and reply budget a result came from."""
+    return fingerprint(template_messages, os.getenv("OPENAI_MODEL"), max_tokens)
+
+async def prepare_email_body(email_obj: dict) -> dict:
+    """prepare_body for email_obj's body, recording on the stored email how many tokens it saved."""
+    prepared = prepare_body(email_obj.get("body") or "")
+    if "uid" in email_obj and email_obj.get("tokensSaved") != prepared["saved"]:
+        await asyncio.to_thread(email_store.update, email_obj["uid"], tokensSaved=prepared["saved"])
+        email_obj["tokensSaved"] = prepared["saved"]
+    return prepared
+
+async def generate_summary(email_obj: dict) -> str:
+    """Ask the model for a summary of email_obj's body. Raises LlmError.
+
+    Bodies longer than one LLM_BODY_TOKEN_BUDGET chunk are summarized chunk by
+    chunk and the partial summaries combined with one more call.
+    """
+    if test_mode("TEST_SUMMARY"):
+        return "This is a test summary"
+    prepared = await prepare_email_body(email_obj)
+    chunks = prepared["chunks"]
+
+    async def summarize():
+        if len(chunks) == 1:
+            return await chat_completion(summary_messages(chunks[0]), task="summary")
+        partials = await asyncio.gather(*(chat_completion(summary_messages(chunk), task="summary") for chunk in chunks))
+        return await chat_completion(summary_reduce_messages(partials), task="summary_reduce")
+
+    return await llm_cache.aget_or_compute(
+        "summary", prompt_fingerprint([summary_messages(""), summary_reduce_messages([])]),
+        "\n\n".join(chunks), summarize,
+    )
+
+async def generate_classification(email_obj: dict) -> dict:
+    """Ask the model for {"priority", "category"}. Raises LlmError, or ValueError if the reply is not JSON."""
+    if test_mode("TEST_CLASSIFICATION"):
+        return {
+            "priority": random.choice(["important", "not important"]),
+            "category": random.choice(CATEGORY_DATA["categories"])
+        }
+    categories = CATEGORY_DATA["categories"]
+    body = (await prepare_email_body(email_obj))["text"]
+
+    async def classify():
+        content = await chat_completion(classification_messages(body, categories), task="classification")
+        try:
+            return validate_classification(parse_json_object(content), categories)
+        except ValueError:
+            print("Classification response:", content)
+            raise
+
+    return await llm_cache.aget_or_compute(
+        "classification", prompt_fingerprint(classification_messages("", categories)), body, classify
+    )
+
+async def generate_enrichment(email_obj: dict) -> dict:
+    """Summary and classification from a single model call.
+
+    Returns {"summary", "classification"}. Raises LlmError, or ValueError if the reply does not parse.
+    """
+    if test_mode("TEST_SUMMARY") and test_mode("TEST_CLASSIFICATION"):
+        return {"summary": await generate_summary(email_obj), "classification": await generate_classification(email_obj)}
+    categories = CATEGORY_DATA["categories"]
+    prepared = await prepare_email_body(email_obj)
+    if len(prepared["chunks"]) > 1:
+        # too long for one prompt: map-reduce the summary, classify from the opening chunk
+        return {"summary": await generate_summary(email_obj), "classification": await generate_classification(email_obj)}
+    body = prepared["text"]
+
+    async def enrich():
+        content = await chat_completion(enrichment_messages(body, categories), max_tokens=300, task="enrichment")
+        try:
+            return parse_enrichment(content, categories)
+        except ValueError:
+            print("Enrichment response:", content)
+            raise
+
+    return await llm_cache.aget_or_compute(
+        "enrichment", prompt_fingerprint(enrichment_messages("", categories), max_tokens=300), body, enrich
+    )
 
 @tool
-def summarize_email(uid: int) -> dict:
+async def summarize_email(uid: int) -> dict:
     """
     Summarize a single email by its UID and store the result in the database.
 
     This tool operates on one email at a time. The summary is stored persistently with the email data,
     and the tool also returns a structured response with the UID and generated summary.
 
-    To summarize all emails, first retrieve UIDs using get_stored_emails,
-    then call summarize_email individually for each.
+    To summarize many emails at once, use `summarize_emails` (or `process_matching_emails`
+    to pick them by filter) instead of calling this tool for each one.
     """
     #print(f"Summarizing message with UID: {uid}...")
 
-    system_prompt = (
-        "You are an email summarization assistant. "
-        "You will be given an email. "
-        "Summarize the main content of the email."
-        "If unable to summarize - DO NOT speculate. Just state 'The content could not be understood.' "
-        "Otherwise, summarize the key points in 2-3 sentences."
-    )
-
-    email_obj = stored_emails.get(uid)
+    email_obj = await asyncio.to_thread(email_store.get, uid)
     #print("Summarizing an email:", email_obj)
     if not email_obj:
         print("Email not found.")
         return { "uid" : uid , "summary" : "Email not found"}
     
     print(f"Summarizing body (truncated): {email_obj['body'][:250]}...")
-    
-    test_summary = os.getenv("TEST_SUMMARY", "false").lower() in ("true", "1", "yes")
-    if test_summary:
-        email_obj["summary"] = "This is a test summary"
-        stored_emails[uid] = email_obj
-        return { "uid" : uid , "summary" : email_obj["summary"]}
-
-    response = requests.post(
-        os.environ["LMSTUDIO_URL"],
-        headers={"Content-Type": "application/json"},
-        json={
-            "model": os.environ["OPENAI_MODEL"],
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Summarize the following email:\n\n{email_obj['body']}"}
-            ],
-            "temperature": 0,
-            "max_tokens": 150,
-        },
-    )
 
-    if not response.ok:
-        print("Summarization FAILED:", response.json())
-        return { "uid" : uid , "summary" : "Summarization failed: {response.status_code}"}
+    try:
+        summary = await generate_summary(email_obj)
+    except LlmError as e:
+        print("Summarization FAILED:", e)
+        return { "uid" : uid , "summary" : f"Summarization failed: {e.status_code}"}
 
-    content = response.json().get("choices", [{}])[0].get("message", {}).get("content")
-    if not content:
+    if not summary:
         print("No summary returned.")
         return { "uid" : uid , "summary" : "No summary returned."}
 
-    email_obj["summary"] = content.strip()
-    stored_emails[uid] = email_obj
+    await asyncio.to_thread(email_store.update, uid, summary=summary)
     print("Successfully summarized.")
-    return { "uid" : uid , "summary" : email_obj["summary"]}
+    return { "uid" : uid , "summary" : summary}
 
 @tool
-def classify_email(uid: int) -> dict:
+async def classify_email(uid: int) -> dict:
     """
     Classify a single email by its UID and store the classification in the database.
 
@@ -385,103 +564,231 @@ def classify_email(uid: int) -> dict:
     and stores the result alongside the email data.
 
     The tool also returns a structured response with the UID and classification details.
-    To classify all emails, retrieve UIDs using get_stored_emails and call this tool for each one.
+    To classify many emails at once, use `classify_emails` (or `process_matching_emails`
+    to pick them by filter) instead of calling this tool for each one.
     """
     #print(f"Classifying email with UID: {uid}...")
 
-    email_obj = stored_emails.get(uid)
+    email_obj = await asyncio.to_thread(email_store.get, uid)
     #print("Classifying an email:", email_obj)
     if not email_obj:
         print("Email not found.")
         return { "uid" : uid , "classification" : { "priority" : "Email not found", "category" : "Email not found"}}
-    
-    test_classification = os.getenv("TEST_CLASSIFICATION", "false").lower() in ("true", "1", "yes")
-    if test_classification:
-        priority = random.choice(["important", "not important"])
-        category = random.choice(CATEGORY_DATA["categories"])
-
-        email_obj["classification"] = {
-            "priority": priority,
-            "category": category
+
+    try:
+        classification = await generate_classification(email_obj)
+    except LlmError as e:
+        print("Classification FAILED:", e)
+        return { "uid" : uid , "classification" : { "priority" : "FAILED", "category" : "FAILED"}}
+    except ValueError as e:
+        print("Classification FAILED:", e)
+        return { "uid" : uid , "classification" : { "priority" : "FAILED TO PARSE", "category" : "FAILED TO PARSE"}}
+
+    await asyncio.to_thread(email_store.update, uid, classification=classification)
+    return {
+        "uid": uid,
+        "classification": {
+            "priority": classification.get("priority", "FAILED TO PARSE"),
+            "category": classification.get("category", "FAILED TO PARSE")
         }
-        stored_emails[uid] = email_obj
-        return { "uid" : uid , "classification" : { "priority" : priority, "category" : category}}
+    }
 
-    categories = CATEGORY_DATA["categories"]
-    category_list = ", ".join(f'"{c}"' for c in categories)
-
-    system_prompt = f"""
-    You are an AI assistant that classifies emails.
-    Classify the email into:
-    - \"priority\": either \"important\" or \"not important\"
-    - \"category\": one of the following: {category_list}
-
-    Return your response in JSON format like:
-    {{
-      \"priority\": \"important\",
-      \"category\": \"work\"
-    }}
-    """
-
-    response = requests.post(
-        os.environ["LMSTUDIO_URL"],
-        headers={"Content-Type": "application/json"},
-        json={
-            "model": os.environ["OPENAI_MODEL"],
-            "messages": [
-                {"role": "system", "content": "You are an email classification assistant."},
-                {"role": "user", "content": system_prompt + "\n\n" + email_obj["body"]}
-            ],
-            "temperature": 0,
-            "max_tokens": 150,
-        },
-    )
+@tool
+async def summarize_and_classify_email(uid: int) -> dict:
+    """
+    Summarize and classify a single email by its UID with one model call, storing both results.
 
-    
-    if not response.ok:
-        print("Classification FAILED:", response)
-        return { "uid" : uid , "classification" : { "priority" : "FAILED", "category" : "FAILED"}}
+    Cheaper and faster than calling `summarize_email` and then `classify_email` for the same email.
+    Returns the UID, the summary and the classification (priority and category).
+    """
+    email_obj = await asyncio.to_thread(email_store.get, uid)
+    if not email_obj:
+        print("Email not found.")
+        return { "uid" : uid , "summary" : "Email not found", "classification" : { "priority" : "Email not found", "category" : "Email not found"}}
 
-    content = response.json().get("choices", [{}])[0].get("message", {}).get("content")
     try:
-        start = content.index("{")
-        end = content.rindex("}") + 1
-        classification = json.loads(content[start:end])
-        email_obj["classification"] = classification
-        stored_emails[uid] = email_obj
-        return {
-            "uid": uid,
-            "classification": {
-                "priority": classification.get("priority", "FAILED TO PARSE"),
-                "category": classification.get("category", "FAILED TO PARSE")
-            }
+        enriched = await generate_enrichment(email_obj)
+    except LlmError as e:
+        print("Summarize and classify FAILED:", e)
+        return { "uid" : uid , "summary" : f"Summarization failed: {e.status_code}", "classification" : { "priority" : "FAILED", "category" : "FAILED"}}
+    except ValueError as e:
+        print("Summarize and classify FAILED:", e)
+        return { "uid" : uid , "summary" : "No summary returned.", "classification" : { "priority" : "FAILED TO PARSE", "category" : "FAILED TO PARSE"}}
+
+    await asyncio.to_thread(email_store.update, uid, summary=enriched["summary"], classification=enriched["classification"])
+    return { "uid" : uid , **enriched}
+
+enrichment = EnrichmentPipeline(email_store, generate_summary, generate_classification, enrich=generate_enrichment)
+
+@tool
+async def enrich_emails(uids: Optional[list[int]] = None, account: Optional[str] = None) -> dict:
+    """
+    Summarize and classify many emails in one call, storing the results in the database.
+
+    Pass the UIDs to process, or leave `uids` empty to process every stored email (of `account`,
+    when given) that is still missing a summary or classification. Emails are handled concurrently on the server,
+    so prefer this over calling `summarize_email` / `classify_email` once per email.
+
+    Returns:
+    {
+        "processed": 12,
+        "failed": [{"uid": 104, "error": "..."}],
+        "results": [{"uid": 101, "summary": "...", "classification": {...}}, ...]
+    }
+    Emails that already had a summary or classification keep it and only get what was missing.
+    """
+    if not uids:
+        try:
+            check_account(account)
+        except ValueError as e:
+            return {"error": str(e)}
+        uids = email_store.unprocessed_uids(account=account)
+    print(f"Enriching {len(uids)} emails...")
+    return summarize_results(await enrichment.run(uids))
+
+@tool
+async def summarize_emails(uids: list[int]) -> dict:
+    """
+    Summarize several emails in one call, storing each summary in the database.
+
+    Every email in `uids` is summarized again, even if it already has a summary; the
+    work runs concurrently on the server. Prefer this over calling `summarize_email` per UID.
+
+    Returns:
+    {
+        "processed": 3,
+        "failed": [{"uid": 104, "error": "..."}],
+        "results": [{"uid": 101, "subject": "...", "summary": "..."}, ...]
+    }
+    """
+    print(f"Summarizing {len(uids)} emails...")
+    return summarize_results(await enrichment.run(uids, tasks=("summary",)))
+
+@tool
+async def classify_emails(uids: list[int]) -> dict:
+    """
+    Classify several emails in one call, storing each priority and category in the database.
+
+    Every email in `uids` is classified again, even if it already has a classification; the
+    work runs concurrently on the server. Prefer this over calling `classify_email` per UID.
+
+    Returns:
+    {
+        "processed": 3,
+        "failed": [{"uid": 104, "error": "..."}],
+        "results": [{"uid": 101, "subject": "...", "classification": {"priority": "...", "category": "..."}}, ...]
+    }
+    """
+    print(f"Classifying {len(uids)} emails...")
+    return summarize_results(await enrichment.run(uids, tasks=("classification",)))
+
+def select_emails(is_read=None, category=None, priority=None, sender=None, subject=None, query=None, account=None) -> list:
+    """Stored emails (without bodies) matching every filter given: best match first
+    with a query, newest first without.
+
+    category, priority, sender and subject match case-insensitive substrings;
+    query is a full-text search (see EmailIndex.search) that every one of its
+    words must match, since the bulk actions change whatever is selected;
+    account is an exact account id."""
+    if query:
+        scope = email_store.uids(account=account) if account else None
+        hits = email_index.search(query, limit=max(email_store.count(), 1), uids=scope, match_all=True)
+        emails = email_store.get_many([uid for uid, _ in hits], with_body=False)
+    else:
+        emails = email_store.all(with_body=False, account=account)
+
+    filters = [
+        ("sender", sender),
+        ("subject", subject),
+        ("category", category),
+        ("priority", priority),
+    ]
+    selected = []
+    for email_obj in emails:
+        if is_read is not None and bool(email_obj.get("isRead")) != is_read:
+            continue
+        classification = email_obj.get("classification") or {}
+        values = {
+            "sender": email_obj.get("sender"),
+            "subject": email_obj.get("subject"),
+            "category": classification.get("category"),
+            "priority": classification.get("priority"),
         }
-    except Exception as e:
-        print("Classification FAILED:", e)
-        print("Classification response:", response.json())
-        return { "uid" : uid , "classification" : { "priority" : "FAILED TO PARSE", "category" : "FAILED TO PARSE"}}
+        if all(wanted.lower() in (values[name] or "").lower() for name, wanted in filters if wanted):
+            selected.append(email_obj)
+    if not query:
+        selected.sort(key=lambda e: e["uid"], reverse=True)  # UIDs grow as mail arrives
+    return selected
+
+def store_seen_flag(account_id, folder, uidvalidity, by_imap_uid, seen):
+    """Set or clear \\Seen on the messages of one folder, one STORE per chunk.
+
+    by_imap_uid maps IMAP UID -> store uid. Returns (updated uids, failed uids).
+    """
+    updated, failed = [], []
+    with get_pool(account_id).connection() as mail:
+        current = select_folder(mail, folder)
+        if uidvalidity is not None and current != uidvalidity:
+            # the folder was rebuilt since the sync; these IMAP UIDs may name other messages now
+            return updated, list(by_imap_uid.values())
+        for message_set, chunk in chunked_message_sets(by_imap_uid):
+            result = mail.uid("STORE", message_set, "+FLAGS.SILENT" if seen else "-FLAGS.SILENT", "(\\Seen)")
+            (updated if result[0] == "OK" else failed).extend(by_imap_uid[imap_uid] for imap_uid in chunk)
+    return updated, failed
+
+def set_read_flag(uids, seen):
+    """Set or clear \\Seen on the server for uids and mirror it in the store.
+
+    The emails are grouped by account and folder; each account's STOREs run on
+    its own connections, side by side with the other accounts'.
+    """
+    uids = list(dict.fromkeys(uids))
+    locations = email_store.locate(uids)
+    groups, not_found = {}, []
+    for uid in uids:
+        if uid not in locations:
+            not_found.append(uid)
+            continue
+        account_id, folder, uidvalidity, imap_uid = locations[uid]
+        if account_id is None:
+            # stored before there were accounts: the first account's first folder, by IMAP UID
+            first = get_account()
+            account_id, folder, imap_uid = first.id, first.folders[0], uid
+        groups.setdefault((account_id, folder, uidvalidity), {})[imap_uid] = uid
+
+    results = per_account([(key[0], store_seen_flag, *key, by_imap_uid, seen) for key, by_imap_uid in groups.items()])
+    updated, failed = [], []
+    for (key, by_imap_uid), result in zip(groups.items(), results):
+        if isinstance(result, Exception):
+            print(f"Error setting read status in {key[0]}/{key[1]}:", result)
+            failed.extend(by_imap_uid.values())
+        else:
+            updated.extend(result[0])
+            failed.extend(result[1])
+
+    found = [uid for uid in updated if email_store.update(uid, isRead=seen)]
+    found_set = set(found)
+
+    return {
+        "updated": found,
+        "not_found": not_found + [uid for uid in updated if uid not in found_set],
+        "failed": failed,
+    }
 
 @tool
 def mark_as_read(uid: int) -> dict:
     """
     Mark an email as read using its UID and update the database.
 
-    This tool updates the read status of the specified email both in memory and on the mail server.
+    This tool updates the read status of the specified email both in the database and on the mail server.
     It returns a structured response indicating the UID and new `isRead` status.
+    For more than one email use `mark_emails_as_read` instead.
     """
     print(f"Marking email {uid} as read...")
     try:
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(os.environ["EMAIL_USER"], os.environ["EMAIL_PASS"])
-        mail.select("inbox")
-
-        result = mail.store(str(uid), "+FLAGS", "\\Seen")
-        mail.logout()
-
-        if result[0] == "OK":
-            if uid in stored_emails:
-                stored_emails[uid]["isRead"] = True
-                return { "uid" : uid, "isRead" : stored_emails[uid]["isRead"]}
+        result = set_read_flag([uid], True)
+        if uid in result["updated"]:
+            return { "uid" : uid, "isRead" : True}
         return { "uid" : uid, "isRead" : "ERROR: Could not find Email."}
     except Exception as e:
         print("Error marking as read:", e)
@@ -492,27 +799,129 @@ def unmark_as_read(uid: int) -> dict:
     """
     Mark an email as unread using its UID and update the database.
 
-    This tool reverses the read status for a given email both in memory and on the mail server.
+    This tool reverses the read status for a given email both in the database and on the mail server.
     It returns a structured response with the UID and updated `isRead` value.
+    For more than one email use `unmark_emails_as_read` instead.
     """
     #print(f"Unmarking email {uid} as read...")
     try:
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(os.environ["EMAIL_USER"], os.environ["EMAIL_PASS"])
-        mail.select("inbox")
-
-        result = mail.store(str(uid), "-FLAGS", "\\Seen")
-        mail.logout()
-
-        if result[0] == "OK":
-            if uid in stored_emails:
-                stored_emails[uid]["isRead"] = False
-                return { "uid" : uid, "isRead" : stored_emails[uid]["isRead"]}
+        result = set_read_flag([uid], False)
+        if uid in result["updated"]:
+            return { "uid" : uid, "isRead" : False}
         return { "uid" : uid, "isRead" : "ERROR: Could not find Email."}
     except Exception as e:
         print("Error unmarking as read:", e)
         return { "uid": uid, "isRead": "UNKNOWN ERROR MARKING UNREAD" }
 
+@tool
+def mark_emails_as_read(uids: list[int]) -> dict:
+    """
+    Mark several emails as read in one call using their UIDs.
+
+    The server is updated with one request per batch of UIDs rather than one per email,
+    so prefer this over calling `mark_as_read` repeatedly.
+
+    Returns:
+    {
+        "isRead": true,
+        "updated": [101, 102],   # UIDs now marked read
+        "not_found": [],         # not in the database
+        "failed": []             # the server rejected these
+    }
+    """
+    print(f"Marking {len(uids)} emails as read...")
+    try:
+        return {"isRead": True, **set_read_flag(uids, True)}
+    except Exception as e:
+        print("Error marking as read:", e)
+        return {"isRead": "UNKNOWN ERROR MARKING READ", "updated": [], "not_found": [], "failed": list(uids)}
+
+@tool
+def unmark_emails_as_read(uids: list[int]) -> dict:
+    """
+    Mark several emails as unread in one call using their UIDs.
+
+    Works like `mark_emails_as_read`, clearing the read status instead.
+    """
+    print(f"Unmarking {len(uids)} emails as read...")
+    try:
+        return {"isRead": False, **set_read_flag(uids, False)}
+    except Exception as e:
+        print("Error unmarking as read:", e)
+        return {"isRead": "UNKNOWN ERROR MARKING UNREAD", "updated": [], "not_found": [], "failed": list(uids)}
+
+MATCHING_ACTIONS = ("list", "summarize", "classify", "enrich", "mark_read", "mark_unread")
+
+@tool
+async def process_matching_emails(
+    action: str,
+    is_read: Optional[bool] = None,
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    sender: Optional[str] = None,
+    subject: Optional[str] = None,
+    query: Optional[str] = None,
+    account: Optional[str] = None,
+    limit: int = 50,
+) -> dict:
+    """
+    Find emails by filter and act on all of them in a single call.
+
+    This is the tool for bulk requests such as "summarize all my unread emails",
+    "mark everything from LinkedIn as read" or "classify my work emails": one call
+    replaces a lookup followed by one call per email.
+
+    Filters (all optional, combined with AND):
+    - is_read: true for read emails, false for unread ones
+    - category, priority, sender, subject: case-insensitive substring of that field
+    - query: full-text search over subject, sender, summary and body; every word must match
+    - account: only this account's emails (an id from `list_accounts`)
+
+    action is one of:
+    - "list": return uid, subject and sender of the matches
+    - "summarize" / "classify": (re)generate summaries / classifications
+    - "enrich": fill in whatever summary or classification is missing
+    - "mark_read" / "mark_unread": set the read status on the server and in the database
+
+    At most `limit` emails are acted on: the best query matches first when query
+    is given, otherwise the newest. Returns:
+    {
+        "action": "summarize",
+        "matched": 14,            # emails matching the filters
+        "selected": 14,           # emails acted on (matched, capped by limit)
+        "uids": [...],            # the UIDs of those emails
+        ...                       # the action's results, as from the single-purpose bulk tools
+    }
+    """
+    if action not in MATCHING_ACTIONS:
+        return {"error": f"Unknown action '{action}'. Use one of: {', '.join(MATCHING_ACTIONS)}."}
+    try:
+        check_account(account)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    matches = await asyncio.to_thread(select_emails, is_read, category, priority, sender, subject, query, account)
+    selected = matches[:max(limit, 0)]
+    uids = [e["uid"] for e in selected]
+    print(f"{action} on {len(uids)} of {len(matches)} matching emails...")
+    response = {"action": action, "matched": len(matches), "selected": len(uids), "uids": uids}
+
+    if action == "list":
+        response["emails"] = [{"uid": e["uid"], "account": e["account"], "subject": e["subject"], "sender": e["sender"]} for e in selected]
+    elif action in ("summarize", "classify", "enrich"):
+        tasks = {"summarize": ("summary",), "classify": ("classification",), "enrich": None}[action]
+        response.update(summarize_results(await enrichment.run(uids, tasks=tasks)))
+    elif uids:
+        seen = action == "mark_read"
+        try:
+            response.update({"isRead": seen, **await run_imap(set_read_flag, uids, seen)})
+        except Exception as e:
+            print("Error setting read status:", e)
+            response.update({"isRead": "UNKNOWN ERROR SETTING READ STATUS", "updated": [], "not_found": [], "failed": uids})
+    else:
+        response.update({"updated": [], "not_found": [], "failed": []})
+    return response
+
 @tool
 def remove_email(uid: int) -> dict:
     """
@@ -525,8 +934,7 @@ def remove_email(uid: int) -> dict:
     """
     #print("Attempting to remove email:", uid)
     try:
-        removedEmail = stored_emails.pop(uid, None)
-        if removedEmail:
+        if email_store.remove(uid):
             return { "uid" : uid }
         else:
             return { "uid" : "Failed to remove email. UID not found."}
@@ -536,10 +944,47 @@ def remove_email(uid: int) -> dict:
 toolList = [
     summarize_email,
     classify_email,
+    summarize_and_classify_email,
+    enrich_emails,
+    summarize_emails,
+    classify_emails,
+    process_matching_emails,
     mark_as_read,
     unmark_as_read,
+    mark_emails_as_read,
+    unmark_emails_as_read,
     get_stored_email_with_uid,
     get_emails_by_data,
+    search_emails,
     remove_email,
-    get_data_by_id
-]
\ No newline at end of file
+    get_data_by_id,
+    list_accounts
+]
+
+class ToolMetrics(BaseCallbackHandler):
+    """Times every tool invocation, whether the agent or an endpoint/job made it."""
+
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}  # run_id -> (tool name, start time)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = ((serialized or {}).get("name") or kwargs.get("name") or "unknown", time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._tool_done(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._tool_done(run_id, "error")
+
+    def _tool_done(self, run_id, outcome):
+        started = self._started.pop(run_id, None)
+        if started:
+            TOOL_SECONDS.observe(time.perf_counter() - started[1], tool=started[0], outcome=outcome)
+
+
+# attached to the tools themselves, so direct .invoke() calls are timed like the agent's
+_tool_metrics = ToolMetrics()
+for _tool in [value for value in list(globals().values()) if isinstance(value, BaseTool)]:
+    _tool.callbacks = [_tool_metrics]
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import queue
+import random
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import var_child_runnable_config
+
+# Span trees for agent runs. An AgentTrace is the callback handler of one
+# /promptAgent request: the run is the root span, every model call and tool
+# call (with its arguments, duration and token counts) a child, and LLM
+# requests a tool makes through app/llm.py nest under that tool's span.
+#
+# When the run ends the trace is kept if it is sampled (TRACE_SAMPLE_RATE),
+# slow (TRACE_SLOW_SECONDS) or failed, and handed to a background thread
+# that writes it to the sink chosen by TRACE_EXPORTER:
+#   jsonl  one trace per line in TRACE_PATH (default)
+#   otlp   OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT (an OpenTelemetry collector, Jaeger, Tempo, ...)
+#   none   tracing off
+
+_current = contextvars.ContextVar("agent_trace", default=None)
+
+
+def _truncate(value, limit):
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return text if len(text) <= limit else text[:limit] + f"... [{len(text) - limit} more characters]"
+
+
+class AgentTrace(BaseCallbackHandler):
+    run_inline = True  # record on the calling thread instead of a thread pool hop per event
+
+    def __init__(self, name, max_field_chars=None, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.max_field_chars = max_field_chars or int(os.getenv("TRACE_MAX_FIELD_CHARS", "1000"))
+        self.root = self._new_span(None, name, "agent", attributes)
+        self.spans = [self.root]
+        self._open = {}  # LangChain run_id -> span
+        self._lock = threading.Lock()
+
+    def _new_span(self, parent, name, kind, attributes) -> dict:
+        return {
+            "span_id": secrets.token_hex(8),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "kind": kind,
+            "start_ns": time.time_ns(),
+            "end_ns": None,
+            "status": "ok",
+            "attributes": dict(attributes),
+        }
+
+    def _start(self, run_id, parent_run_id, name, kind, attributes) -> dict:
+        with self._lock:
+            span = self._new_span(self._open.get(parent_run_id, self.root), name, kind, attributes)
+            self.spans.append(span)
+            if run_id is not None:
+                self._open[run_id] = span
+        return span
+
+    def _end(self, run_id, error=None, **attributes):
+        with self._lock:
+            span = self._open.pop(run_id, None)
+        if span:
+            self._close(span, error, attributes)
+        return span
+
+    def _close(self, span, error=None, attributes=None):
+        span["end_ns"] = time.time_ns()
+        span["attributes"].update(attributes or {})
+        if error is not None:
+            span["status"] = "error"
+            span["attributes"]["error"] = _truncate(str(error), self.max_field_chars)
+
+    # LangChain callbacks
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._start(run_id, parent_run_id, "model", "llm", {
+            "model": params.get("model") or params.get("model_name") or (serialized or {}).get("name"),
+            "messages": sum(len(batch) for batch in messages),
+        })
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        tool_calls = []
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+                tool_calls += [call["name"] for call in getattr(message, "tool_calls", None) or []]
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, tool_calls=tool_calls)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, inputs=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._start(run_id, parent_run_id, f"tool {name}", "tool", {
+            "tool": name,
+            "arguments": _truncate(inputs if inputs is not None else input_str, self.max_field_chars),
+        })
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output=_truncate(getattr(output, "content", output), self.max_field_chars))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    # Spans for work outside LangChain (see span())
+
+    def _parent_run_id(self):
+        # inside a tool LangChain holds the tool's run in its child config
+        config = var_child_runnable_config.get()
+        callbacks = config.get("callbacks") if config else None
+        return getattr(callbacks, "parent_run_id", None)
+
+    @contextmanager
+    def activate(self):
+        """Make this the trace span() records into, for the block (and tasks it starts)."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                pass  # a streaming response closed from another context; that context never saw the set
+
+    def finish(self, error=None) -> dict:
+        """Close the root span, sum the tokens and hand the trace to the exporter if it is kept."""
+        if self.root["end_ns"] is not None:
+            return self.root
+        self._close(self.root, error)
+        llm_spans = [s for s in self.spans if s["kind"] == "llm"]
+        self.root["attributes"].update({
+            "model_calls": sum(1 for s in llm_spans if s["name"] == "model"),
+            "tool_calls": sum(1 for s in self.spans if s["kind"] == "tool"),
+            "prompt_tokens": sum(s["attributes"].get("prompt_tokens", 0) for s in llm_spans),
+            "completion_tokens": sum(s["attributes"].get("completion_tokens", 0) for s in llm_spans),
+        })
+        exporter = get_exporter()
+        if exporter:
+            exporter.offer(self)
+        return self.root
+
+    @property
+    def duration(self) -> float:
+        return ((self.root["end_ns"] or time.time_ns()) - self.root["start_ns"]) / 1e9
+
+    def to_dict(self) -> dict:
+        start = self.root["start_ns"]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root["name"],
+            "start": start / 1e9,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.root["status"],
+            "attributes": self.root["attributes"],
+            "spans": [
+                {
+                    "span_id": s["span_id"],
+                    "parent_id": s["parent_id"],
+                    "name": s["name"],
+                    "kind": s["kind"],
+                    "offset_ms": round((s["start_ns"] - start) / 1e6, 3),
+                    "duration_ms": round(((s["end_ns"] or self.root["end_ns"]) - s["start_ns"]) / 1e6, 3),
+                    "status": s["status"],
+                    "attributes": s["attributes"],
+                }
+                for s in self.spans if s is not self.root
+            ],
+        }
+
+
+@contextmanager
+def span(name, kind="internal", **attributes):
+    """Record the block as a span of the active agent trace, under the tool
+    running it if there is one. Yields the span's attributes dict to add to;
+    a throwaway dict (and no cost beyond it) when no trace is active."""
+    trace = _current.get()
+    if trace is None:
+        yield {}
+        return
+    current = trace._start(None, trace._parent_run_id(), name, kind, attributes)
+    try:
+        yield current["attributes"]
+    except BaseException as e:
+        trace._close(current, e)
+        raise
+    else:
+        trace._close(current)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(traces) -> dict:
+    """OTLP/HTTP JSON (ExportTraceServiceRequest) for a batch of finished traces."""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            attributes = dict(s["attributes"], **{"span.kind": s["kind"]})
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": s["span_id"],
+                **({"parentSpanId": s["parent_id"]} if s["parent_id"] else {}),
+                "name": s["name"],
+                "kind": 3 if s["kind"] in ("llm", "tool") else 1,  # CLIENT / INTERNAL
+                "startTimeUnixNano": str(s["start_ns"]),
+                "endTimeUnixNano": str(s["end_ns"] or trace.root["end_ns"]),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None],
+                "status": {"code": 2 if s["status"] == "error" else 1},
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "email-agent"}}]},
+        "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": spans}],
+    }]}
+
+
+class TraceExporter:
+    """Decides which finished traces to keep and writes them from a daemon
+    thread, so a request never waits on the sink. When the sink falls
+    behind, traces beyond max_queue are dropped."""
+
+    def __init__(self, kind="jsonl", path=None, endpoint=None, sample_rate=0.1, slow_seconds=10.0, max_queue=1000):
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def keep_reason(self, trace):
+        if trace.root["status"] == "error":
+            return "error"
+        if trace.duration >= self.slow_seconds:
+            return "slow"
+        if random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def offer(self, trace):
+        reason = self.keep_reason(trace)
+        if reason is None:
+            return False
+        trace.root["attributes"]["kept"] = reason
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [trace for trace in batch if trace is not None]
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                print(f"Could not export {len(batch)} agent traces:", e)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        if self.kind == "otlp":
+            httpx.post(self.endpoint, json=to_otlp(batch), timeout=10).raise_for_status()
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace in batch:
+                f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+
+    def close(self, timeout=5.0):
+        """Write what is queued, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    kind = os.getenv("TRACE_EXPORTER", "jsonl").lower()
+    if kind == "none":
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TraceExporter(
+                kind=kind,
+                path=os.getenv("TRACE_PATH", os.path.join(os.path.dirname(__file__), "../agent_traces.jsonl")),
+                endpoint=os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces"),
+                sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+                slow_seconds=float(os.getenv("TRACE_SLOW_SECONDS", "10")),
+            )
+        return _exporter
+
+
+def close_exporter():
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter:
+        exporter.close()
@@ -30,13 +30,16 @@ app.whenReady().then(async () => {
     await fetchProcessAndRenderEmails();
     removeProcessingMessage();
 
+    // New mail is pushed by the backend's IMAP IDLE listener; the interval is only a fallback.
+    listenForEmailEvents();
+
     setInterval(() => {
       if (!isAgentProcessing) {
-        fetchProcessAndRenderEmails();
+        fetchProcessAndRenderEmails("background");
       } else {
         console.log("Skipping email fetch because agent processing is in progress.");
       }
-    }, 300000); // 5 minutes
+    }, 1800000); // 30 minutes
   });
 
   app.on("activate", () => {
@@ -45,46 +48,62 @@ app.whenReady().then(async () => {
 });
 
 
-async function fetchProcessAndRenderEmails() {
+const EMAIL_FIELDS = "uid,account,subject,sender,isRead,summary,classification,raw_body";
+
+// Heavy endpoints queue a job and answer at once; poll it until it finishes.
+async function runJob(path, options = {}) {
+  const res = await fetch(`${process.env.PYAGENT_ENDPOINT}${path}`, options);
+  let job = await res.json();
+  while (job.status === "queued" || job.status === "running") {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    job = await (await fetch(`${process.env.PYAGENT_ENDPOINT}/jobs/${job.id}`)).json();
+  }
+  if (job.status !== "done") {
+    throw new Error(`Job ${job.id} (${job.kind}) ${job.status}: ${job.error}`);
+  }
+  return job.result;
+}
+
+async function fetchProcessAndRenderEmails(priority = "user") {
   try {
     console.log("📥 Fetching emails...");
-    await fetch(`${process.env.PYAGENT_ENDPOINT}/fetchEmails`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" }
-    });
+    await runJob(`/fetchEmails?priority=${priority}`, { method: "POST" });
 
-    // Step 1: Get stored emails after fetch
-    let res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails`);
+    // Step 1: Get stored emails after fetch, only the fields the window shows
+    let res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails?fields=${EMAIL_FIELDS}`);
     let emails = await res.json();
+    const version = res.headers.get("X-Email-Version");
 
-    // Step 2: Summarize and classify each email
-    for (const email of emails) {
-      const uid = email.uid;
-
-      const alreadySummarized = !!email.summary;
-      const alreadyClassified = !!(email.classification?.priority && email.classification?.category);
+    // Step 2: Summarize and classify everything still missing either, in one batch on the server
+    const pending = emails
+      .filter(email => !email.summary || !(email.classification?.priority && email.classification?.category))
+      .map(email => email.uid);
 
-      if (!alreadySummarized) {
-        console.log(`📝 Summarizing email UID ${uid}`);
-        try {
-          await fetch(`${process.env.PYAGENT_ENDPOINT}/summarizeEmail?uid=${uid}`);
-        } catch (err) {
-          console.warn(`Failed to summarize UID ${uid}`, err);
-        }
-      }
-
-      if (!alreadyClassified) {
-        console.log(`🏷️ Classifying email UID ${uid}`);
-        try {
-          await fetch(`${process.env.PYAGENT_ENDPOINT}/classifyEmail?uid=${uid}`);
-        } catch (err) {
-          console.warn(`Failed to classify UID ${uid}`, err);
-        }
+    if (pending.length > 0) {
+      console.log(`📝 Summarizing and classifying ${pending.length} emails`);
+      try {
+        const enrichResult = await runJob("/enrichEmails", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ uids: pending, priority })
+        });
+        enrichResult.failed.forEach(f => console.warn(`Failed to enrich UID ${f.uid}`, f.error));
+      } catch (err) {
+        console.warn("Failed to enrich emails", err);
       }
     }
 
-    res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails`);
-    emails = await res.json();
+    // Step 3: Only what changed since step 1 (the new summaries and classifications)
+    res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails?fields=${EMAIL_FIELDS}&since=${encodeURIComponent(version)}`);
+    const delta = await res.json();
+    if (delta.reset) {
+      emails = delta.emails;
+    } else if (Array.isArray(delta.emails)) {
+      const byUid = new Map(emails.map(email => [email.uid, email]));
+      delta.emails.forEach(email => byUid.set(email.uid, email));
+      delta.removed.forEach(uid => byUid.delete(uid));
+      emails = [...byUid.values()];
+    }
     
     if (Array.isArray(emails)) {
       emails.forEach(email => showEmail(email));
@@ -97,6 +116,92 @@ async function fetchProcessAndRenderEmails() {
   }
 }
 
+async function listenForEmailEvents() {
+  while (true) {
+    try {
+      const res = await fetch(`${process.env.PYAGENT_ENDPOINT}/events`);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          await handleServerEvent(rawEvent);
+        }
+      }
+    } catch (err) {
+      console.warn("Event stream disconnected:", err);
+    }
+    await new Promise(resolve => setTimeout(resolve, 3000));
+  }
+}
+
+async function handleServerEvent(rawEvent) {
+  let event = "message";
+  let data = "";
+  for (const line of rawEvent.split("\n")) {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    else if (line.startsWith("data:")) data += line.slice(5).trim();
+  }
+  if (event !== "emails" || !data) return;
+
+  const changes = JSON.parse(data);
+  console.log("📨 Mailbox changed:", changes);
+  changes.removed.forEach(uid => removeEmail(uid));
+
+  // the server already synced the folder; load just the emails the event names
+  await showEmailsWithUIDs([...changes.new, ...changes.updated]);
+
+  if (changes.new.length > 0) {
+    // not awaited, so later events are handled while the new mail is enriched
+    runJob("/enrichEmails", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ uids: changes.new, priority: "background" })
+    })
+      .then(enrichResult => {
+        enrichResult.failed.forEach(f => console.warn(`Failed to enrich UID ${f.uid}`, f.error));
+        return showEmailsWithUIDs(changes.new);
+      })
+      .catch(err => console.warn("Failed to enrich new emails", err));
+  }
+}
+
+async function showEmailsWithUIDs(uids) {
+  if (uids.length === 0) return;
+  const res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmailsWithUIDs`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ uids, fields: EMAIL_FIELDS.split(",") })
+  });
+  const emailsArray = await res.json();
+  emailsArray.forEach(emailObj => showEmail(emailObj));
+}
+
+// The store version the window is up to date with
+async function currentEmailVersion() {
+  const res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails?fields=uid&limit=1`);
+  return res.headers.get("X-Email-Version");
+}
+
+// Show the emails added or changed since version and drop the removed ones
+async function renderChangesSince(version) {
+  const res = await fetch(`${process.env.PYAGENT_ENDPOINT}/getStoredEmails?fields=${EMAIL_FIELDS}&since=${encodeURIComponent(version)}`);
+  if (!res.ok) {
+    throw new Error(`Failed to fetch changed emails: ${res.statusText}`);
+  }
+  const delta = await res.json();
+  delta.emails.forEach(email => showEmail(email));
+  delta.removed.forEach(uid => removeEmail(uid));
+}
+
 // Quit the app when all windows are closed (except on macOS)
 app.on('window-all-closed', () => {
   if (process.platform !== 'darwin') {
@@ -143,6 +248,8 @@ ipcMain.handle('submitPrompt', async (event, userInput) => {
   showProcessingMessage("Agent processing request:", userInput)
 
   try {
+    const version = await currentEmailVersion();
+
     // Send user input to the agent API
     const res = await fetch(process.env.PYAGENT_ENDPOINT + "/promptAgent", {
       method: "POST",
@@ -160,63 +267,8 @@ ipcMain.handle('submitPrompt', async (event, userInput) => {
     console.log("Agent Message:", result.agent_message.content);
     console.log("Tool Calls:", result.tool_calls);
     
-    const updatedUIDs = new Set();
-    const clearedUIDs = new Set();
-    
-    for (const call of result.tool_calls) {
-      const toolName = call.function.name;
-      let args;
-      try {
-        args = JSON.parse(call.function.arguments);
-      } catch (e) {
-        console.warn("Could not parse args for", toolName, call.function.arguments);
-        continue;
-      }
-    
-      const uid = args.uid;
-      if (typeof uid !== "number") continue;
-    
-      switch (toolName) {
-        case "remove_email":
-          clearedUIDs.add(uid);
-          break;
-    
-        default:
-          updatedUIDs.add(uid);
-          break;
-      }
-    }
-    
-    console.log("Updated UIDs:", updatedUIDs);
-    console.log("Cleared UIDs:", clearedUIDs);
-
-    //getting updates
-    if (updatedUIDs.size > 0) {
-      const params = new URLSearchParams();
-      updatedUIDs.forEach(uid => params.append("uids", uid));
-      const response = await fetch(
-        `${process.env.PYAGENT_ENDPOINT}/getStoredEmailsWithUIDs?${params.toString()}`,
-        {
-          method: "GET",
-          headers: {
-            "Content-Type": "application/json",
-          },
-        }
-      );
-      
-      if (!response.ok) {
-        throw new Error(`Failed to fetch emails: ${response.statusText}`);
-      }
-
-      // render updated
-      const emailsArray = await response.json();
-      emailsArray.forEach(emailObj => showEmail(emailObj));
-    }
-    
-    // remove cleared
-    for (const uid of clearedUIDs) {
-      removeEmail(uid);
-    }
+    // whatever the tools changed (bulk tools pick emails by filter, so their arguments need not list them)
+    await renderChangesSince(version);
 
     showChat({ role: "Agent", message: result.agent_message.content });
     isAgentProcessing = false;